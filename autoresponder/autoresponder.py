@@ -4,9 +4,11 @@ from datetime import datetime
 logger = logging.getLogger("FunPayBot.Autoresponder")
 
 class AutoResponder:
-    def __init__(self, template_manager, enabled=True):
+    def __init__(self, template_manager, enabled=True, usage=None):
         self.template_manager = template_manager
         self.enabled = enabled
+        # TemplateUsage: счетчики в памяти, запись в БД пачками вне пути ответа
+        self.usage = usage
         self.stats = {"responses_sent": 0, "templates_matched": 0}
         logger.info(f"✓ Автоответчик инициализирован ({'включен' if enabled else 'выключен'})")
 
@@ -15,10 +17,13 @@ class AutoResponder:
             return None
         try:
             template = await self.template_manager.find_matching_template(message_text)
+            if self.usage:
+                self.usage.record_check()
             if template:
                 self.stats["templates_matched"] += 1
                 response = self._process_variables(template.response)
-                await self.template_manager.db.increment_template_usage(template.id)
+                if self.usage:
+                    self.usage.record_match(template.id)
                 logger.info(f"🤖 Автоответ по шаблону '{template.name}': {response[:50]}...")
                 self.stats["responses_sent"] += 1
                 return response
@@ -47,4 +52,7 @@ class AutoResponder:
         logger.info("✓ Автоответчик выключен")
 
     def get_stats(self):
-        return {**self.stats, "enabled": self.enabled}
+        stats = {**self.stats, "enabled": self.enabled, "templates": self.template_manager.get_stats()}
+        if self.usage:
+            stats["usage"] = self.usage.get_stats()
+        return stats
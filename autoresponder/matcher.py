@@ -0,0 +1,138 @@
+"""
+autoresponder/matcher.py — скомпилированный матчер триггеров шаблонов.
+
+Строится один раз на перезагрузку кэша и сохраняет порядок приоритета
+исходного перебора: выигрывает первый по списку шаблон, у которого
+триггер входит в текст как подстрока (без учета регистра) или, для
+триггеров с "^", совпадает как регулярное выражение.
+"""
+import logging
+import re
+from collections import deque
+
+logger = logging.getLogger("FunPayBot.Matcher")
+
+_NO_MATCH = float("inf")
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик, возвращающий минимальный индекс совпавшего шаблона"""
+
+    def __init__(self, patterns):
+        # patterns: список (строка, индекс шаблона); пустые строки не допускаются
+        self.goto = [{}]
+        self.fail = [0]
+        self.best = [_NO_MATCH]
+
+        for pattern, index in patterns:
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(_NO_MATCH)
+                node = next_node
+            if index < self.best[node]:
+                self.best[node] = index
+
+        # BFS: суффиксные ссылки и протягивание минимального индекса по ним
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                if self.best[self.fail[child]] < self.best[child]:
+                    self.best[child] = self.best[self.fail[child]]
+
+    def search(self, text, limit=_NO_MATCH):
+        """Минимальный индекс шаблона, встречающегося в text (меньше limit)"""
+        goto, fail, best = self.goto, self.fail, self.best
+        result = limit
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best[node] < result:
+                result = best[node]
+                if result == 0:
+                    break
+        return result
+
+
+class TemplateMatcher:
+    """Неизменяемый матчер, собранный по упорядоченному списку шаблонов"""
+
+    def __init__(self, templates):
+        self.templates = list(templates)
+        self._empty_index = _NO_MATCH
+        self._combined = None
+        self._combined_index = {}
+        self._standalone = []
+
+        literals = []
+        regex_parts = []
+        for index, template in enumerate(self.templates):
+            trigger = template.trigger or ""
+            literal = trigger.lower()
+            if literal:
+                literals.append((literal, index))
+            elif index < self._empty_index:
+                # Пустой триггер входит в любой текст
+                self._empty_index = index
+
+            if not trigger.startswith("^"):
+                continue
+            try:
+                compiled = re.compile(trigger, re.IGNORECASE)
+            except re.error:
+                logger.warning(f"Некорректный regex в шаблоне {template.id}")
+                continue
+            # В общую альтернативу берем только выражения без своих групп и без "|":
+            # они якорятся на начало строки, поэтому достаточно match() с позиции 0,
+            # а альтернатива возвращает первый по порядку совпавший шаблон
+            if compiled.groups == 0 and "|" not in trigger:
+                group = f"t{index}"
+                self._combined_index[group] = index
+                regex_parts.append(f"(?P<{group}>{trigger})")
+            else:
+                self._standalone.append((index, compiled))
+
+        self._literals = AhoCorasick(literals) if literals else None
+        if regex_parts:
+            self._combined = re.compile("|".join(regex_parts), re.IGNORECASE)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def match(self, text):
+        """Первый по порядку подходящий шаблон или None"""
+        best = self._empty_index
+        if self._literals is not None and best:
+            best = self._literals.search(text.lower(), best)
+
+        if self._combined is not None and best:
+            found = self._combined.match(text)
+            if found:
+                index = self._combined_index[found.lastgroup]
+                if index < best:
+                    best = index
+
+        for index, compiled in self._standalone:
+            if index >= best:
+                break
+            if compiled.search(text):
+                best = index
+                break
+
+        if best == _NO_MATCH:
+            return None
+        return self.templates[best]
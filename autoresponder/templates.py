@@ -1,44 +1,105 @@
+"""
+autoresponder/templates.py — кэш активных шаблонов и их матчер.
+
+Не чаще раза в check_interval секунд кэш сверяет счетчик изменений
+шаблонов в БД (template_revision, миграция 6): это одно чтение по ключу.
+Если счетчик сдвинулся, загружаются только строки с revision новее
+кэшированной и id удаленных шаблонов, после чего матчер собирается
+заново и подменяется вместе со списком одним присваиванием — поиск
+видит либо старый, либо новый набор целиком.
+"""
+import asyncio
 import logging
-import re
+import time
 from datetime import datetime
+from .matcher import TemplateMatcher
+from utils.metrics import TEMPLATE_MATCH_TIME
 
 logger = logging.getLogger("FunPayBot.Templates")
 
 class TemplateManager:
-    def __init__(self, database):
+    def __init__(self, database, check_interval=2.0):
         self.db = database
+        self.check_interval = check_interval
+        self.templates = {}  # id -> Template (только активные)
         self.templates_cache = []
+        self.matcher = TemplateMatcher([])
+        self.revision = None  # None — еще не загружали
+        self.checked_at = None  # None — проверок еще не было
         self.cache_updated = None
+        self.refresh_lock = asyncio.Lock()
+        self.stats = {"revision_checks": 0, "reloads": 0, "rows_loaded": 0}
         logger.info("✓ Менеджер шаблонов инициализирован")
 
     async def reload_templates(self):
-        try:
-            self.templates_cache = await self.db.get_active_templates()
-            self.cache_updated = datetime.now()
-            logger.info(f"✓ Загружено {len(self.templates_cache)} шаблонов")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки шаблонов: {e}")
+        """Полная перезагрузка кэша"""
+        async with self.refresh_lock:
+            self.revision = None
+        await self.refresh(force=True)
+
+    async def refresh(self, force=False):
+        """Догрузить изменения, если счетчик в БД сдвинулся (или сразу при force)"""
+        async with self.refresh_lock:
+            # Пока ждали блокировку, проверку мог сделать другой вызов. Интервал
+            # действует и до первой успешной загрузки: иначе при недоступной БД
+            # каждое входящее сообщение шло бы в нее заново
+            if not force and not self._check_due():
+                return
+            # До запроса: при ошибке БД повтор не раньше чем через check_interval
+            self.checked_at = time.monotonic()
+            try:
+                self.stats["revision_checks"] += 1
+                revision = await self.db.get_templates_revision()
+                if revision != self.revision:
+                    await self._load_changes()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки шаблонов: {e}")
+
+    def _check_due(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= self.check_interval
+
+    async def _load_changes(self):
+        since = self.revision if self.revision is not None else -1
+        revision, changed, deleted = await self.db.get_templates_changed_since(since)
+        templates = {} if self.revision is None else dict(self.templates)
+        for template_id in deleted:
+            templates.pop(template_id, None)
+        for template in changed:
+            if template.is_active:
+                templates[template.id] = template
+            else:
+                templates.pop(template.id, None)
+        # Порядок id — порядок приоритета при совпадении нескольких шаблонов
+        ordered = [templates[template_id] for template_id in sorted(templates)]
+        matcher = TemplateMatcher(ordered)
+
+        # Подмена без await между присваиваниями: поиск не увидит полусобранный кэш
+        self.templates, self.templates_cache, self.matcher = templates, ordered, matcher
+        self.revision = revision
+        self.cache_updated = datetime.now()
+        self.stats["reloads"] += 1
+        self.stats["rows_loaded"] += len(changed)
+        logger.info(
+            f"✓ Шаблоны обновлены (ревизия {revision}): {len(changed)} изменено, "
+            f"{len(deleted)} удалено, активных {len(ordered)}"
+        )
 
     async def find_matching_template(self, text):
-        if not self.templates_cache:
-            await self.reload_templates()
-        text_lower = text.lower()
-        for template in self.templates_cache:
-            if template.trigger.lower() in text_lower:
-                return template
-            if template.trigger.startswith("^"):
-                try:
-                    if re.search(template.trigger, text, re.IGNORECASE):
-                        return template
-                except re.error:
-                    logger.warning(f"Некорректный regex в шаблоне {template.id}")
-        return None
+        if self._check_due():
+            await self.refresh()
+        started = time.perf_counter()
+        template = self.matcher.match(text)
+        TEMPLATE_MATCH_TIME.observe(time.perf_counter() - started)
+        return template
 
     async def add_template(self, name, trigger, response):
         try:
             template_id = await self.db.add_template(name, trigger, response)
-            await self.reload_templates()
+            await self.refresh(force=True)
             return template_id
         except Exception as e:
             logger.error(f"Ошибка добавления шаблона: {e}")
             return None
+
+    def get_stats(self):
+        return {**self.stats, "revision": self.revision, "templates": len(self.templates_cache)}
@@ -0,0 +1,125 @@
+"""
+autoresponder/usage.py — учет срабатываний шаблонов автоответчика.
+
+Раньше каждое совпадение делало UPDATE templates с коммитом прямо в пути
+ответа покупателю. Теперь AutoResponder только увеличивает счетчики в
+памяти, а запись идет пачкой раз в flush_interval секунд (и при
+остановке): use_count и last_used_at шаблонов, срабатывания по часам и
+число проверенных сообщений по часам. Из почасовых данных report()
+считает доли совпадений за окна REPORT_WINDOWS — по ним видно шаблоны,
+которые не срабатывают и только замедляют подбор (/templates).
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from utils.periodic import PeriodicFlusher
+
+logger = logging.getLogger("FunPayBot.TemplateUsage")
+
+# (подпись, длина окна в часах) — по возрастанию
+REPORT_WINDOWS = (("24ч", 24), ("7д", 24 * 7), ("30д", 24 * 30))
+
+
+def _hour(now=None):
+    return int((now if now is not None else time.time()) // 3600)
+
+
+class TemplateUsage(PeriodicFlusher):
+    flush_error = "Ошибка записи статистики шаблонов"
+
+    def __init__(self, database, flush_interval=10.0):
+        super().__init__(flush_interval, logger)
+        self.db = database
+        # Почасовые данные старше самого длинного окна не нужны
+        self.retention_hours = REPORT_WINDOWS[-1][1]
+        self.matches = {}  # template_id -> [срабатываний, последнее срабатывание]
+        self.hourly = {}   # (hour, template_id) -> срабатываний
+        self.checks = {}   # hour -> проверено сообщений
+        self.flush_lock = asyncio.Lock()
+        self.stats = {"checks": 0, "matches": 0, "flushes": 0, "errors": 0}
+
+    def record_check(self):
+        """Автоответчик проверил сообщение (знаменатель доли совпадений)"""
+        hour = _hour()
+        self.checks[hour] = self.checks.get(hour, 0) + 1
+        self.stats["checks"] += 1
+
+    def record_match(self, template_id):
+        # Наивное UTC, как timestamp сообщений в БД
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        entry = self.matches.get(template_id)
+        if entry is None:
+            self.matches[template_id] = [1, now]
+        else:
+            entry[0] += 1
+            entry[1] = now
+        key = (_hour(), template_id)
+        self.hourly[key] = self.hourly.get(key, 0) + 1
+        self.stats["matches"] += 1
+
+    async def flush(self):
+        """Записать накопленное одной транзакцией"""
+        async with self.flush_lock:
+            if not self.matches and not self.checks:
+                return
+            matches, self.matches = self.matches, {}
+            hourly, self.hourly = self.hourly, {}
+            checks, self.checks = self.checks, {}
+            try:
+                await self.db.apply_template_usage(
+                    [(count, last_used, template_id) for template_id, (count, last_used) in matches.items()],
+                    [(hour, template_id, count) for (hour, template_id), count in hourly.items()],
+                    list(checks.items()),
+                    _hour() - self.retention_hours
+                )
+            except Exception:
+                # Не теряем: вернется в следующую запись
+                self.stats["errors"] += 1
+                self._merge_back(matches, hourly, checks)
+                raise
+            self.stats["flushes"] += 1
+
+    def _merge_back(self, matches, hourly, checks):
+        for template_id, (count, last_used) in matches.items():
+            entry = self.matches.get(template_id)
+            if entry is None:
+                self.matches[template_id] = [count, last_used]
+            else:
+                entry[0] += count  # last_used в памяти уже новее
+        for key, count in hourly.items():
+            self.hourly[key] = self.hourly.get(key, 0) + count
+        for hour, count in checks.items():
+            self.checks[hour] = self.checks.get(hour, 0) + count
+
+    async def report(self):
+        """Доли срабатываний шаблонов за окна REPORT_WINDOWS, начиная с неработающих.
+
+        Возвращает (проверено сообщений по окнам, [dict по шаблону])
+        """
+        await self.flush()
+        current = _hour()
+        # +1: текущий, еще не закончившийся час входит в окно
+        since = [current - hours + 1 for _, hours in REPORT_WINDOWS]
+        checks, rows = await self.db.get_template_usage(since)
+        report = []
+        for template_id, name, is_active, use_count, last_used_at, window_matches in rows:
+            report.append({
+                "id": template_id,
+                "name": name,
+                "is_active": is_active,
+                "use_count": use_count,
+                "last_used_at": last_used_at,
+                "matches": window_matches,
+                "rates": tuple(
+                    matches / checked if checked else 0.0
+                    for matches, checked in zip(window_matches, checks)
+                ),
+            })
+        # Неактивные и самые редкие за длинное окно — первыми
+        report.sort(key=lambda item: (item["is_active"], item["matches"][-1], item["use_count"]))
+        return checks, report
+
+    def get_stats(self):
+        return {**self.stats, "pending_templates": len(self.matches)}
@@ -0,0 +1,379 @@
+"""
+benchmarks/bench_database.py — задержки операций Database на больших таблицах.
+
+Строит реалистичный набор данных (миллионы сообщений с перекосом по чатам,
+заказы со смесью статусов, пользователи) и замеряет распределение задержек
+основных операций через настоящий Database (WAL), в том числе под
+конкурентными писателями. Печатает p50/p90/p99/max, операций в секунду и
+размер файлов БД; сравнивает с сохраненным baseline и завершается с кодом 1
+при регрессии.
+
+Набор данных строится один раз и переиспользуется (--workdir).
+
+Запуск:
+    python -m benchmarks.bench_database --messages 2000000
+    python -m benchmarks.bench_database --messages 2000000 --save-baseline
+    python -m benchmarks.bench_database --messages 2000000 --baseline benchmarks/baselines/bench_database.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database.database import Database
+from database.models import CREATE_TABLES_SQL
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "bench_database.json")
+WORDS = ["привет", "цена", "есть", "в", "наличии", "оплатил", "спасибо", "когда", "аккаунт", "ключ",
+         "пришлите", "данные", "скидка", "гарант", "отзыв", "hello", "steam", "boost", "ok", "?"]
+STATUSES = ("completed",) * 14 + ("cancelled",) * 3 + ("active", "new")  # активных — единицы процентов
+
+
+# --- Набор данных ---
+
+def dataset_path(workdir, args):
+    return os.path.join(workdir, f"bench_m{args.messages}_c{args.chats}_o{args.orders}_s{args.seed}.db")
+
+
+def skewed_chat(rng, chats):
+    """Чат с перекосом (лог-равномерно): немногие чаты дают большую часть сообщений"""
+    return max(1, int(chats ** rng.random()))
+
+
+def random_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 20)))
+
+
+def build_dataset(path, args):
+    """Наполнение через sqlite3 пачками; схема — та же, что создает Database.initialize()"""
+    rng = random.Random(args.seed)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = OFF")  # только на время наполнения
+    connection.executescript(CREATE_TABLES_SQL)
+    started_at = datetime.now() - timedelta(days=args.days)
+    step = timedelta(days=args.days) / max(args.messages, 1)
+
+    per_user = [0] * (args.chats + 1)
+
+    batch = []
+    for row_id in range(1, args.messages + 1):
+        chat = skewed_chat(rng, args.chats)
+        outgoing = rng.random() < 0.3
+        if not outgoing:
+            per_user[chat] += 1
+        batch.append((
+            chat, 0 if outgoing else chat, "seller" if outgoing else f"user{chat}", random_text(rng),
+            outgoing, (started_at + step * row_id).strftime("%Y-%m-%d %H:%M:%S"), f"h{row_id}"
+        ))
+        if len(batch) >= 50000:
+            _insert_messages(connection, batch)
+            batch = []
+            print(f"  сообщений: {row_id}/{args.messages}", end="\r", flush=True)
+    if batch:
+        _insert_messages(connection, batch)
+
+    order_step = timedelta(days=args.days) / max(args.orders, 1)
+    connection.executemany(
+        """INSERT INTO orders (order_id, buyer_id, buyer_username, description, price, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (
+            (f"B{number}", buyer, f"user{buyer}", random_text(rng), round(rng.uniform(10, 5000), 2),
+             # Активные заказы — в основном свежие
+             "active" if number > args.orders * 0.98 and rng.random() < 0.5 else rng.choice(STATUSES),
+             (started_at + order_step * number).strftime("%Y-%m-%d %H:%M:%S"))
+            for number in range(1, args.orders + 1)
+            for buyer in (skewed_chat(rng, args.chats),)
+        )
+    )
+    connection.executemany(
+        "INSERT INTO users (funpay_user_id, username, total_messages) VALUES (?, ?, ?)",
+        ((chat, f"user{chat}", per_user[chat]) for chat in range(1, args.chats + 1))
+    )
+    connection.commit()
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.execute("ANALYZE")
+    connection.close()
+    print()
+
+
+def _insert_messages(connection, batch):
+    connection.executemany(
+        """INSERT INTO messages (chat_id, author_id, author_username, text, is_outgoing, timestamp, message_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        batch
+    )
+    connection.commit()
+
+
+async def prepare_dataset(path):
+    """Миграции и полная индексация для поиска — один раз на эталонном наборе, не в каждом прогоне"""
+    database = Database(path, write_behind=False)
+    await database.connect()
+    await database.initialize()
+    indexed_up_to, pending_up_to = await database.get_search_backfill_state()
+    if indexed_up_to < pending_up_to:
+        print("Индексация для поиска...")
+        database.search_index.batch_size = 50000
+        while await database.search_index.backfill_once():
+            pass
+    await database.search_index.merge()
+    await database.disconnect()
+
+
+def file_sizes(path):
+    sizes = {}
+    for suffix in ("", "-wal"):
+        try:
+            sizes["db" + suffix.replace("-", "_")] = os.path.getsize(path + suffix)
+        except OSError:
+            sizes["db" + suffix.replace("-", "_")] = 0
+    return {name: round(size / 1024 / 1024, 1) for name, size in sizes.items()}
+
+
+# --- Замеры ---
+
+def summarize(latencies, elapsed):
+    ordered = sorted(latencies)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.5), 3),
+        "p90_ms": round(pick(0.9), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "ops_per_s": round(len(ordered) / elapsed, 1)
+    }
+
+
+async def measure(operation, iterations, budget):
+    """До iterations вызовов, но не дольше budget секунд (минимум 20 вызовов)"""
+    latencies = []
+    started = time.perf_counter()
+    for number in range(iterations):
+        call_started = time.perf_counter()
+        await operation(number)
+        latencies.append(time.perf_counter() - call_started)
+        if number >= 20 and call_started - started > budget:
+            break
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def measure_concurrent(operation, writers, iterations):
+    """writers задач по iterations вызовов; задержка включает ожидание write_lock"""
+    latencies = []
+
+    async def writer(index):
+        for number in range(iterations):
+            call_started = time.perf_counter()
+            await operation(index * iterations + number)
+            latencies.append(time.perf_counter() - call_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(index) for index in range(writers)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def run(path, args):
+    rng = random.Random(args.seed + 1)
+    database = Database(path, write_behind=args.write_behind)
+    await database.connect()
+    await database.initialize()
+    run_id = int(time.time() * 1000)
+    results = {}
+
+    async def add_message(number):
+        chat = skewed_chat(rng, args.chats)
+        await database.add_message(chat, chat, f"user{chat}", random_text(rng), False, f"bench-{run_id}-{number}")
+
+    async def exists_hit(number):
+        await database.message_exists_by_hash(f"h{rng.randint(1, args.messages)}")
+
+    async def exists_miss(number):
+        await database.message_exists_by_hash(f"miss-{run_id}-{number}")
+
+    async def chat_messages_hot(number):
+        await database.get_chat_messages(skewed_chat(rng, args.chats), limit=50)
+
+    async def chat_messages_random(number):
+        await database.get_chat_messages(rng.randint(1, args.chats), limit=50)
+
+    async def active_orders(number):
+        await database.get_active_orders()
+
+    async def search_common(number):
+        await database.search_messages(rng.choice(WORDS[:-1]), limit=20)
+
+    async def search_rare(number):
+        chat = rng.randint(1, args.chats)
+        await database.search_messages(f"user{chat} {rng.choice(WORDS[:-1])}", limit=20)
+
+    search_cursor = {}
+
+    async def search_next_page(number):
+        # Листание: следующая страница от id последнего результата предыдущей
+        word = rng.choice(WORDS[:-1])
+        page = await database.search_messages(word, limit=20, before_id=search_cursor.get(word))
+        search_cursor[word] = page[-1].id if page else None
+
+    async def upsert_user(number):
+        user = rng.randint(1, args.chats * 2)  # половина — новые пользователи
+        await database.add_or_update_user(user, f"user{user}")
+
+    iterations = args.iterations
+    budget = args.budget
+    results["add_message"] = await measure(add_message, iterations, budget)
+    results["message_exists_by_hash[hit]"] = await measure(exists_hit, iterations, budget)
+    results["message_exists_by_hash[miss]"] = await measure(exists_miss, iterations, budget)
+    results["get_chat_messages[hot]"] = await measure(chat_messages_hot, iterations, budget)
+    results["get_chat_messages[random]"] = await measure(chat_messages_random, iterations, budget)
+    results["get_active_orders"] = await measure(active_orders, max(10, iterations // 10), budget)
+    results["add_or_update_user"] = await measure(upsert_user, iterations, budget)
+    results["search_messages[common word]"] = await measure(search_common, iterations, budget)
+    results["search_messages[username + word]"] = await measure(search_rare, iterations, budget)
+    results["search_messages[next page]"] = await measure(search_next_page, iterations, budget)
+
+    # Конкурентные писатели на одном Database — так пишет бот
+    results[f"add_message[x{args.writers}]"] = await measure_concurrent(
+        lambda number: add_message(iterations + number), args.writers, max(1, iterations // args.writers)
+    )
+
+    # Чтение, пока пишут отдельные соединения (WAL: читатель не ждет писателя)
+    others = [Database(path, write_behind=False) for _ in range(args.writers)]
+    for other in others:
+        await other.connect()
+    stop = asyncio.Event()
+
+    async def background_writer(index, other):
+        number = 0
+        while not stop.is_set():
+            chat = skewed_chat(rng, args.chats)
+            await other.add_message(chat, chat, f"user{chat}", random_text(rng), False,
+                                    f"bench-{run_id}-w{index}-{number}")
+            number += 1
+
+    writer_tasks = [asyncio.create_task(background_writer(index, other)) for index, other in enumerate(others)]
+    results[f"get_chat_messages[hot, {args.writers} conn writing]"] = await measure(chat_messages_hot, iterations, budget)
+    results[f"add_message[{args.writers} conn writing]"] = await measure(add_message, max(10, iterations // 5), budget)
+    stop.set()
+    await asyncio.gather(*writer_tasks)
+    for other in others:
+        await other.disconnect()
+
+    await database.disconnect()
+    return results
+
+
+# --- Baseline ---
+
+def compare(results, baseline, tolerance):
+    """Регрессия — p50 или p99 хуже baseline больше чем на tolerance (и больше чем на 0.05 мс)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if current[key] > previous[key] * (1 + tolerance) and current[key] - previous[key] > 0.05:
+                regressions.append(f"{name}: {key} {previous[key]} -> {current[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000, help="строк в messages")
+    parser.add_argument("--chats", type=int, default=20000, help="чатов (и пользователей)")
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365, help="за какой период распределены данные")
+    parser.add_argument("--iterations", type=int, default=2000, help="вызовов на операцию")
+    parser.add_argument("--budget", type=float, default=10.0, help="не дольше N секунд на операцию")
+    parser.add_argument("--writers", type=int, default=4, help="конкурентных писателей")
+    parser.add_argument("--write-behind", action="store_true", help="Database с буфером отложенной записи")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "funpaybot-bench"))
+    parser.add_argument("--rebuild", action="store_true", help="пересоздать набор данных")
+    parser.add_argument("--baseline", default=None, help=f"сравнить с baseline (по умолчанию {DEFAULT_BASELINE})")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, default=None, metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение, доля")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    source = dataset_path(args.workdir, args)
+    if args.rebuild or not os.path.exists(source):
+        print(f"Строим набор данных: {source}")
+        started = time.perf_counter()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(source + suffix):
+                os.remove(source + suffix)
+        build_dataset(source, args)
+        print(f"Готово за {time.perf_counter() - started:.1f}s")
+    asyncio.run(prepare_dataset(source))
+
+    # Замеры пишут в БД — работаем с копией, эталонный набор остается нетронутым
+    path = source[:-3] + "-run.db"
+    for suffix in ("", "-wal", "-shm"):  # включая копию, оставшуюся от прерванного прогона
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with sqlite3.connect(source) as src, sqlite3.connect(path) as dst:
+        src.backup(dst)
+
+    size_before = file_sizes(path)
+    results = asyncio.run(run(path, args))
+    size_after = file_sizes(path)
+
+    print(f"{'операция':<42} {'p50, мс':>9} {'p90, мс':>9} {'p99, мс':>9} {'max, мс':>9} {'оп/с':>9}")
+    for name, result in results.items():
+        print(f"{name:<42} {result['p50_ms']:>9.3f} {result['p90_ms']:>9.3f} {result['p99_ms']:>9.3f} "
+              f"{result['max_ms']:>9.2f} {result['ops_per_s']:>9.0f}")
+    print(f"Размер БД, МБ: до {size_before}, после {size_after}")
+
+    params = {name: getattr(args, name) for name in ("messages", "chats", "orders", "days", "iterations", "budget", "writers",
+                                                      "write_behind", "seed")}
+    report = {
+        "params": params,
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "machine": platform.machine()},
+        "file_size_mb": size_after,
+        "results": results
+    }
+
+    exit_code = 0
+    baseline_path = args.baseline or (DEFAULT_BASELINE if os.path.exists(DEFAULT_BASELINE) and not args.save_baseline else None)
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("params") != params:
+            print(f"⚠️ Параметры baseline отличаются: {baseline.get('params')} — сравнение приблизительное")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"✗ Регрессии относительно {baseline_path} (допуск {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            exit_code = 1
+        else:
+            print(f"✓ Регрессий относительно {baseline_path} нет (допуск {args.tolerance:.0%})")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+            file.write("\n")
+        print(f"Baseline сохранен: {args.save_baseline}")
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    raise SystemExit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
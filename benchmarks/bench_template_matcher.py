@@ -0,0 +1,107 @@
+"""
+benchmarks/bench_template_matcher.py — задержка поиска шаблона от числа шаблонов.
+
+Сравнивает прежний линейный перебор с TemplateMatcher и попутно сверяет,
+что оба возвращают один и тот же шаблон.
+
+Запуск:
+    python -m benchmarks.bench_template_matcher --counts 10 100 1000 5000
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from autoresponder.matcher import TemplateMatcher
+from database.models import Template
+
+WORDS = [
+    "привет", "цена", "наличие", "гарант", "оплата", "возврат", "скидка", "аккаунт",
+    "ключ", "доставка", "price", "hello", "refund", "discount", "steam", "boost",
+]
+
+
+def linear_match(templates, text):
+    """Эталон: прежняя реализация TemplateManager.find_matching_template"""
+    text_lower = text.lower()
+    for template in templates:
+        if template.trigger.lower() in text_lower:
+            return template
+        if template.trigger.startswith("^"):
+            try:
+                if re.search(template.trigger, text, re.IGNORECASE):
+                    return template
+            except re.error:
+                pass
+    return None
+
+
+def random_token(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+
+
+def build_templates(count, regex_share, rng):
+    templates = []
+    for i in range(count):
+        if rng.random() < regex_share:
+            trigger = f"^{rng.choice(WORDS)}\\s+{random_token(rng)}"
+        else:
+            trigger = f"{rng.choice(WORDS)} {random_token(rng)}"
+        templates.append(Template(id=i + 1, name=f"t{i}", trigger=trigger, response="ok"))
+    return templates
+
+
+def build_messages(templates, count, hit_share, rng):
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 12))]
+        if templates and rng.random() < hit_share:
+            trigger = rng.choice(templates).trigger
+            words.insert(0 if trigger.startswith("^") else rng.randint(0, len(words)),
+                         trigger.lstrip("^").replace("\\s+", " "))
+        messages.append(" ".join(words))
+    return messages
+
+
+def measure(func, messages, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in messages:
+            func(text)
+        best = min(best, time.perf_counter() - started)
+    return best / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000, 3000, 10000])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--regex-share", type=float, default=0.1)
+    parser.add_argument("--hit-share", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'templates':>10} {'build, ms':>10} {'linear, us':>12} {'compiled, us':>13} {'speedup':>8}")
+    for count in args.counts:
+        rng = random.Random(args.seed)
+        templates = build_templates(count, args.regex_share, rng)
+        messages = build_messages(templates, args.messages, args.hit_share, rng)
+
+        started = time.perf_counter()
+        matcher = TemplateMatcher(templates)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        for text in messages:
+            if matcher.match(text) is not linear_match(templates, text):
+                raise SystemExit(f"Расхождение с эталоном на тексте: {text!r}")
+
+        linear_us = measure(lambda text: linear_match(templates, text), messages, args.repeat)
+        compiled_us = measure(matcher.match, messages, args.repeat)
+        print(f"{count:>10} {build_ms:>10.1f} {linear_us:>12.1f} {compiled_us:>13.1f} {linear_us / compiled_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
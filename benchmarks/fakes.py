@@ -0,0 +1,331 @@
+"""
+benchmarks/fakes.py — подмена FunPayAPI и python-telegram-bot для нагрузочных прогонов.
+
+install() кладет в sys.modules модули FunPayAPI, telegram, telegram.ext и
+telegram.error с тем же интерфейсом, который использует бот. События
+FunPay генерирует LoadGenerator (число чатов, темп, форма всплесков, доля
+заказов); отправки в FunPay и Telegram только имитируют задержку сети и
+записывают, когда до адресата дошло каждое сообщение.
+"""
+import asyncio
+import enum
+import itertools
+import random
+import re
+import sys
+import threading
+import time
+import types
+from collections import defaultdict, deque
+
+AUTOREPLY_TRIGGER = "нагрузка"
+AUTOREPLY_TEXT = "[авто] Спасибо, скоро отвечу"
+SEQ_RE = re.compile(r"#(\d+)")
+
+
+class LoadGenerator:
+    def __init__(self, chats=100, rate=20.0, shape="steady", burst_size=20,
+                 order_share=0.05, autoreply_share=0.3, seed=1):
+        self.chats = chats
+        self.rate = rate
+        self.shape = shape
+        self.burst_size = burst_size
+        self.order_share = order_share
+        self.autoreply_share = autoreply_share
+        self.random = random.Random(seed)
+        self.seq = itertools.count(1)
+        self.lock = threading.Lock()
+        self.running = False
+        self.started_at = None
+        self.last_poll = None
+        self.carry = 0.0
+        self.next_arrival = None
+
+        self.generated = {}  # seq -> monotonic-время генерации
+        self.awaiting_reply = defaultdict(deque)  # chat_id -> seq сообщений, ждущих автоответа
+        self.reply_latencies = []
+        self.notify_latencies = []
+        self.notified = set()
+        self.counts = {"messages": 0, "orders": 0, "replies": 0, "notifications": 0}
+
+    def start(self):
+        with self.lock:
+            self.running = True
+            self.started_at = self.last_poll = time.monotonic()
+            self.next_arrival = self.started_at
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+
+    def _due(self, now):
+        """Сколько событий должно появиться с прошлого опроса"""
+        elapsed = now - self.last_poll
+        self.last_poll = now
+        if self.shape == "poisson":
+            count = 0
+            while self.next_arrival <= now:
+                count += 1
+                self.next_arrival += self.random.expovariate(self.rate)
+            return count
+        if self.shape == "burst":
+            # Средний темп тот же, но события приходят пачками по burst_size
+            count = 0
+            while self.next_arrival <= now:
+                count += self.burst_size
+                self.next_arrival += self.burst_size / self.rate
+            return count
+        self.carry += elapsed * self.rate
+        count = int(self.carry)
+        self.carry -= count
+        return count
+
+    def poll(self):
+        """События FunPay, накопившиеся с прошлого опроса"""
+        with self.lock:
+            if not self.running:
+                return []
+            now = time.monotonic()
+            events = []
+            for _ in range(self._due(now)):
+                seq = next(self.seq)
+                if self.random.random() < self.order_share:
+                    self.counts["orders"] += 1
+                    order = types.SimpleNamespace(
+                        id=f"H{seq}", description=f"Заказ #{seq} нагрузочный", buyer_username=f"buyer{seq % self.chats}"
+                    )
+                    events.append(types.SimpleNamespace(type=EventTypes.NEW_ORDER, order=order))
+                    continue
+                chat_id = 1000 + int(self.random.paretovariate(1.2)) % self.chats  # часть чатов «горячие»
+                text = f"сообщение #{seq}"
+                if self.random.random() < self.autoreply_share:
+                    text = f"{AUTOREPLY_TRIGGER} #{seq}"
+                    self.awaiting_reply[chat_id].append(seq)
+                self.generated[seq] = now
+                self.counts["messages"] += 1
+                chat = types.SimpleNamespace(id=chat_id, name=f"buyer{chat_id}", last_message_text=text)
+                events.append(types.SimpleNamespace(type=EventTypes.LAST_CHAT_MESSAGE_CHANGED, chat=chat))
+            return events
+
+    def on_funpay_send(self, chat_id, text):
+        """Автоответ дошел до покупателя; склеенный ответ закрывает несколько сообщений"""
+        now = time.monotonic()
+        with self.lock:
+            pending = self.awaiting_reply.get(chat_id)
+            for _ in range(text.count(AUTOREPLY_TEXT[:6])):
+                if not pending:
+                    break
+                seq = pending.popleft()
+                self.reply_latencies.append(now - self.generated[seq])
+                self.counts["replies"] += 1
+
+    def on_telegram_text(self, text):
+        """Уведомление (новое или отредактированное) показано админу"""
+        now = time.monotonic()
+        with self.lock:
+            for match in SEQ_RE.finditer(text):
+                seq = int(match.group(1))
+                if seq in self.notified or seq not in self.generated:
+                    continue
+                self.notified.add(seq)
+                self.notify_latencies.append(now - self.generated[seq])
+                self.counts["notifications"] += 1
+
+
+generator = LoadGenerator()
+network = {"funpay_latency": 0.05, "telegram_latency": 0.03}
+
+
+# --- FunPayAPI ---
+
+class EventTypes(enum.Enum):
+    INITIAL_CHAT = 0
+    CHATS_LIST_CHANGED = 1
+    LAST_CHAT_MESSAGE_CHANGED = 2
+    NEW_MESSAGE = 3
+    INITIAL_ORDER = 4
+    ORDERS_LIST_CHANGED = 5
+    NEW_ORDER = 6
+    ORDER_STATUS_CHANGED = 7
+
+
+class Account:
+    def __init__(self, golden_key, user_agent=None, requests_timeout=10, proxy=None):
+        self.golden_key = golden_key
+        self.user_agent = user_agent
+        self.id = None
+        self.username = None
+        self.csrf_token = None
+        self.phpsessid = None
+        self.bot_character = ""
+
+    def get(self, update_phpsessid=True):
+        self.id = 1
+        self.username = "harness_seller"
+        self.csrf_token = "harness"
+        self.phpsessid = "harness"
+        return self
+
+    def send_message(self, chat_id, text, chat_name=None, interlocutor_id=None, image_id=None,
+                     add_to_ignore_list=True, update_last_saved_message=False, leave_as_unread=False):
+        time.sleep(network["funpay_latency"])
+        generator.on_funpay_send(chat_id, text)
+        return types.SimpleNamespace(id=None, text=text)
+
+
+class Runner:
+    def __init__(self, account, disable_message_requests=False, disabled_order_requests=False, disabled_buyer_viewing_requests=True):
+        self.account = account
+
+    def get_updates(self):
+        return {}
+
+    def parse_updates(self, updates):
+        return generator.poll()
+
+    def mark_as_by_bot(self, chat_id, message_id):
+        pass
+
+    def stop(self):
+        pass
+
+
+# --- python-telegram-bot ---
+
+class TelegramError(Exception):
+    pass
+
+
+class NetworkError(TelegramError):
+    pass
+
+
+class BadRequest(NetworkError):
+    pass
+
+
+class RetryAfter(TelegramError):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class _Filter:
+    def __and__(self, other):
+        return self
+
+    def __invert__(self):
+        return self
+
+
+class _Handler:
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class InlineKeyboardButton:
+    def __init__(self, text, callback_data=None):
+        self.text = text
+        self.callback_data = callback_data
+
+
+class InlineKeyboardMarkup:
+    def __init__(self, inline_keyboard):
+        self.inline_keyboard = inline_keyboard
+
+
+class Update:
+    ALL_TYPES = []
+
+
+class FakeBot:
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(network["telegram_latency"])
+        generator.on_telegram_text(text)
+        return types.SimpleNamespace(message_id=next(self.message_ids), text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(network["telegram_latency"])
+        generator.on_telegram_text(text)
+        return True
+
+
+class FakeUpdater:
+    async def start_polling(self, **kwargs):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class Application:
+    def __init__(self):
+        self.bot = FakeBot()
+        self.updater = FakeUpdater()
+
+    @staticmethod
+    def builder():
+        return _ApplicationBuilder()
+
+    def add_handler(self, handler):
+        pass
+
+    async def initialize(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class _ApplicationBuilder:
+    def token(self, token):
+        return self
+
+    def build(self):
+        return Application()
+
+
+def install():
+    """Подменить FunPayAPI и telegram в sys.modules (до импорта модулей бота)"""
+    funpay = types.ModuleType("FunPayAPI")
+    funpay.Account = Account
+    funpay.Runner = Runner
+    funpay.enums = types.SimpleNamespace(EventTypes=EventTypes)
+    funpay.types = types.SimpleNamespace()
+
+    telegram = types.ModuleType("telegram")
+    telegram.Update = Update
+    telegram.InlineKeyboardButton = InlineKeyboardButton
+    telegram.InlineKeyboardMarkup = InlineKeyboardMarkup
+
+    telegram_ext = types.ModuleType("telegram.ext")
+    telegram_ext.Application = Application
+    telegram_ext.CommandHandler = _Handler
+    telegram_ext.MessageHandler = _Handler
+    telegram_ext.CallbackQueryHandler = _Handler
+    telegram_ext.ContextTypes = types.SimpleNamespace(DEFAULT_TYPE=object)
+    telegram_ext.filters = types.SimpleNamespace(TEXT=_Filter(), COMMAND=_Filter())
+
+    telegram_error = types.ModuleType("telegram.error")
+    telegram_error.TelegramError = TelegramError
+    telegram_error.NetworkError = NetworkError
+    telegram_error.BadRequest = BadRequest
+    telegram_error.RetryAfter = RetryAfter
+
+    telegram.ext = telegram_ext
+    telegram.error = telegram_error
+    sys.modules.update({
+        "FunPayAPI": funpay,
+        "telegram": telegram,
+        "telegram.ext": telegram_ext,
+        "telegram.error": telegram_error
+    })
@@ -0,0 +1,200 @@
+"""
+benchmarks/load_harness.py — нагрузочный прогон бота без сети и без аккаунта FunPay.
+
+Поднимает настоящую связку FunPayBot.initialize()/start() поверх подмен из
+benchmarks/fakes.py (FunPayAPI в потоковом режиме, Telegram Application) и
+гонит синтетические события с заданным темпом и формой всплесков. В конце
+печатает пропускную способность, p50/p99 задержки «событие -> автоответ»
+и «событие -> уведомление», глубину очередей и память процесса.
+
+Запуск:
+    python -m benchmarks.load_harness --duration 30 --chats 200 --rate 50 --shape burst
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks import fakes
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def rss_mb():
+    """Текущий RSS из /proc (Linux), иначе пиковый из getrusage"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def configure_env(args, db_path):
+    """Config читает окружение при импорте — выставляем его до импорта бота"""
+    os.environ.update({
+        "FUNPAY_TOKEN": "harness",
+        "TELEGRAM_BOT_TOKEN": "harness",
+        "TELEGRAM_ADMIN_ID": "1",
+        "DATABASE_PATH": db_path,
+        "LOG_DIR": os.path.join(os.path.dirname(db_path), "logs"),  # не в logs/ репозитория
+        "FUNPAY_TRANSPORT": "thread",
+        # По умолчанию автоответчик выключен, а прогон меряет «событие -> автоответ»
+        "AUTO_RESPONDER_ENABLED": "true",
+        "MESSAGE_SEND_DELAY": str(args.send_delay),
+        "MESSAGE_GLOBAL_RATE": str(args.global_rate),
+        "MESSAGE_QUEUE_MAX_SIZE": str(args.queue_size),
+        "LOG_LEVEL": "WARNING",
+        "METRICS_PORT": "0"
+    })
+    for assignment in args.env:
+        name, _, value = assignment.partition("=")
+        os.environ[name] = value
+
+
+async def seed_templates(db_path):
+    from database.database import Database
+
+    database = Database(db_path)
+    await database.connect()
+    await database.initialize()
+    await database.add_template("harness", fakes.AUTOREPLY_TRIGGER, fakes.AUTOREPLY_TEXT)
+    await database.disconnect()
+
+
+async def run(args):
+    import logging
+    from bot import FunPayBot
+
+    logging.getLogger("FunPayBot").setLevel(logging.WARNING)
+    generator = fakes.generator
+    bot = FunPayBot()
+    await bot.initialize()
+    start_task = asyncio.create_task(bot.start())
+    while not bot.funpay_client.running:
+        await asyncio.sleep(0.01)
+
+    samples = {"queue_size": [], "event_queue": [], "notifications_pending": [], "rss_mb": []}
+    generator.start()
+    started = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        await asyncio.sleep(0.25)
+        samples["queue_size"].append(bot.queue_manager.size)
+        samples["event_queue"].append(bot.funpay_client.bridge.depth)
+        samples["notifications_pending"].append(len(bot.telegram_bot.notifier.pending))
+        samples["rss_mb"].append(rss_mb())
+    generator.stop()
+    generation_time = time.monotonic() - started
+
+    # Даем конвейеру догнать хвост, но не дольше drain секунд
+    drain_started = time.monotonic()
+    while time.monotonic() - drain_started < args.drain:
+        if (bot.funpay_client.bridge.depth == 0 and bot.queue_manager.size == 0
+                and not bot.telegram_bot.notifier.pending and not bot.message_handler.background_tasks):
+            break
+        await asyncio.sleep(0.1)
+
+    handled = bot.event_handler.get_stats()
+    await bot.stop()
+    start_task.cancel()
+    try:
+        await start_task
+    except (asyncio.CancelledError, Exception):
+        pass
+
+    counts = dict(generator.counts)
+    return {
+        "config": {
+            "duration": args.duration, "chats": args.chats, "rate": args.rate, "shape": args.shape,
+            "burst_size": args.burst_size, "order_share": args.order_share,
+            "autoreply_share": args.autoreply_share, "send_delay": args.send_delay
+        },
+        "generated": counts,
+        "throughput": {
+            "events_per_s": round((counts["messages"] + counts["orders"]) / generation_time, 2),
+            "handled_per_s": round((handled["messages_handled"] + handled["orders_handled"]) / generation_time, 2),
+            "replies_per_s": round(counts["replies"] / generation_time, 2)
+        },
+        "latency_ms": {
+            "reply_p50": round(percentile(generator.reply_latencies, 0.5) * 1000, 1),
+            "reply_p99": round(percentile(generator.reply_latencies, 0.99) * 1000, 1),
+            "notify_p50": round(percentile(generator.notify_latencies, 0.5) * 1000, 1),
+            "notify_p99": round(percentile(generator.notify_latencies, 0.99) * 1000, 1)
+        },
+        "unfinished": {
+            "replies": sum(len(pending) for pending in generator.awaiting_reply.values()),
+            "notifications": counts["messages"] - counts["notifications"]
+        },
+        "queues": {
+            name: {"max": max(values, default=0), "avg": round(sum(values) / len(values), 1) if values else 0}
+            for name, values in samples.items() if name != "rss_mb"
+        },
+        "memory_mb": {
+            "rss_max": round(max(samples["rss_mb"], default=0.0), 1),
+            "rss_end": round(samples["rss_mb"][-1], 1) if samples["rss_mb"] else 0.0
+        },
+        "errors": handled["errors"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон FunPayBot на подменах FunPay и Telegram")
+    parser.add_argument("--duration", type=float, default=20.0, help="секунд генерации событий")
+    parser.add_argument("--drain", type=float, default=10.0, help="сколько ждать хвост после генерации")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=20.0, help="событий в секунду (в среднем)")
+    parser.add_argument("--shape", choices=("steady", "poisson", "burst"), default="steady")
+    parser.add_argument("--burst-size", type=int, default=20)
+    parser.add_argument("--order-share", type=float, default=0.05)
+    parser.add_argument("--autoreply-share", type=float, default=0.3)
+    parser.add_argument("--funpay-latency", type=float, default=0.05, help="задержка отправки в FunPay, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.03, help="задержка запроса к Telegram, с")
+    parser.add_argument("--send-delay", type=float, default=0.5, help="MESSAGE_SEND_DELAY (и интервал опроса)")
+    parser.add_argument("--global-rate", type=float, default=0, help="MESSAGE_GLOBAL_RATE (0 — без лимита)")
+    parser.add_argument("--queue-size", type=int, default=1000, help="MESSAGE_QUEUE_MAX_SIZE")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="доп. настройка Config")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="funpaybot-load-") as tmp:
+        db_path = os.path.join(tmp, "load.db")
+        configure_env(args, db_path)
+        fakes.install()
+        fakes.network.update(funpay_latency=args.funpay_latency, telegram_latency=args.telegram_latency)
+        fakes.generator.__init__(
+            chats=args.chats, rate=args.rate, shape=args.shape, burst_size=args.burst_size,
+            order_share=args.order_share, autoreply_share=args.autoreply_share, seed=args.seed
+        )
+        asyncio.run(seed_templates(db_path))
+        report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"Сгенерировано: {report['generated']}")
+        print(f"Пропускная способность: {report['throughput']}")
+        print(f"Задержки, мс: {report['latency_ms']}")
+        print(f"Не завершено: {report['unfinished']}")
+        print(f"Очереди: {report['queues']}")
+        print(f"Память, МБ: {report['memory_mb']}")
+        print(f"Ошибок обработки: {report['errors']}")
+
+    # Нулевые задержки автоответа без единого ответа — сломанный прогон, а не хороший результат
+    if report["unfinished"]["replies"] and not report["generated"]["replies"]:
+        print(f"✗ Ни одного автоответа из {report['unfinished']['replies']} ожидаемых — "
+              f"проверьте AUTO_RESPONDER_ENABLED и шаблон", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
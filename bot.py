@@ -21,12 +21,19 @@ except (ValueError, TypeError):
 
 from utils.logger import setup_logger
 from database.database import Database
+from database.dedup import DedupIndex
 from core.funpay_client import FunPayClient
 from core.telegram_bot import TelegramBot
+from core.telegram_notifier import TelegramNotifier
 from core.queue_manager import MessageQueueManager, MessagePriority
 from core.event_handler import EventHandler
 from handlers.message_handler import MessageHandler
 from handlers.order_handler import OrderHandler
+from autoresponder.templates import TemplateManager
+from autoresponder.autoresponder import AutoResponder
+from autoresponder.usage import TemplateUsage
+from utils.metrics import metrics, MetricsServer
+from utils.tracing import tracer
 
 logger = setup_logger()
 
@@ -35,12 +42,16 @@ class FunPayBot:
     def __init__(self):
         self.running = False
         self.database = None
+        self.dedup_index = None
         self.funpay_client = None
         self.telegram_bot = None
         self.queue_manager = None
+        self.autoresponder = None
+        self.template_usage = None
         self.message_handler = None
         self.order_handler = None
         self.event_handler = None
+        self.metrics_server = None
 
     async def initialize(self):
         logger.info("=" * 80)
@@ -48,9 +59,32 @@ class FunPayBot:
         logger.info("=" * 80)
         logger.info("🔧 Инициализация компонентов...")
 
+        tracer.configure(sample_rate=Config.TRACE_SAMPLE_RATE, buffer_size=Config.TRACE_BUFFER_SIZE)
+
         # БД
         self.database = Database(Config.DATABASE_PATH)
         await self.database.connect()
+        await self.database.initialize()
+
+        # Дедупликация входящих (прогрев из message_hashes)
+        self.dedup_index = DedupIndex(
+            self.database,
+            window=Config.DEDUP_WINDOW,
+            max_entries=Config.DEDUP_MAX_ENTRIES,
+            use_bloom=Config.DEDUP_BLOOM,
+            sweep_interval=Config.DEDUP_SWEEP_INTERVAL
+        )
+        await self.dedup_index.start()
+
+        # Архивация старых сообщений (если включена ARCHIVE_AFTER_DAYS)
+        await self.database.archive.start()
+
+        # Фоновая индексация для /search истории, накопленной до появления индекса
+        await self.database.search_index.start()
+
+        # Статистика срабатываний шаблонов: копится в памяти, пишется пачками
+        self.template_usage = TemplateUsage(self.database, flush_interval=Config.TEMPLATE_USAGE_FLUSH_INTERVAL)
+        self.template_usage.start()
 
         # FunPay клиент
         self.funpay_client = FunPayClient(
@@ -62,7 +96,13 @@ class FunPayBot:
         # Менеджер очереди
         self.queue_manager = MessageQueueManager(
             max_size=Config.MESSAGE_QUEUE_MAX_SIZE,
-            send_delay=Config.MESSAGE_SEND_DELAY
+            send_delay=Config.MESSAGE_SEND_DELAY,
+            workers=Config.MESSAGE_SEND_WORKERS,
+            chat_burst=Config.MESSAGE_CHAT_BURST,
+            global_rate=Config.MESSAGE_GLOBAL_RATE,
+            coalesce_window=Config.MESSAGE_COALESCE_WINDOW,
+            max_message_length=Config.FUNPAY_MAX_MESSAGE_LENGTH,
+            store=self.database if Config.MESSAGE_QUEUE_PERSISTENT else None
         )
 
         # Колбэк для ответов из Telegram
@@ -74,21 +114,44 @@ class FunPayBot:
         self.telegram_bot = TelegramBot(
             token=Config.TELEGRAM_BOT_TOKEN,
             admin_id=Config.TELEGRAM_ADMIN_ID,
-            on_reply_callback=reply_callback
+            on_reply_callback=reply_callback,
+            on_search_callback=self.database.search_messages,
+            on_templates_callback=self.template_usage.report,
+            notifier=TelegramNotifier(
+                int(Config.TELEGRAM_ADMIN_ID),
+                digest_window=Config.TELEGRAM_DIGEST_WINDOW,
+                max_digest_lines=Config.TELEGRAM_DIGEST_MAX_LINES,
+                chat_rate=Config.TELEGRAM_CHAT_RATE,
+                global_rate=Config.TELEGRAM_GLOBAL_RATE
+            )
+        )
+
+        # Автоответчик
+        template_manager = TemplateManager(self.database, check_interval=Config.TEMPLATE_CACHE_TTL)
+        await template_manager.reload_templates()
+        self.autoresponder = AutoResponder(
+            template_manager, enabled=Config.AUTO_RESPONDER_ENABLED, usage=self.template_usage
         )
 
         # Обработчики
         self.message_handler = MessageHandler(
             database=self.database,
             telegram_bot=self.telegram_bot,
-            autoresponder=None,
-            queue_manager=self.queue_manager
+            autoresponder=self.autoresponder,
+            queue_manager=self.queue_manager,
+            dedup_index=self.dedup_index,
+            db_timeout=Config.HANDLER_DB_TIMEOUT,
+            notify_timeout=Config.HANDLER_NOTIFY_TIMEOUT,
+            autoreply_timeout=Config.HANDLER_AUTOREPLY_TIMEOUT
         )
 
         self.order_handler = OrderHandler(
             database=self.database,
-            telegram_bot=self.telegram_bot
+            telegram_bot=self.telegram_bot,
+            cache_size=Config.ORDER_DEDUP_MAX_ENTRIES,
+            cache_ttl=Config.ORDER_DEDUP_TTL
         )
+        await self.order_handler.warm_up()
 
         self.event_handler = EventHandler(
             message_handler=self.message_handler,
@@ -103,11 +166,46 @@ class FunPayBot:
             "NEW_ORDER", self.event_handler.handle_order
         )
 
+        self._register_gauges()
+
         logger.info("✅ Все компоненты инициализированы")
 
+    def _register_gauges(self):
+        """Глубины очередей считываются в момент запроса метрик"""
+        metrics.gauge("funpaybot_send_queue_size", "Сообщений в очереди отправки (в памяти)",
+                      func=lambda: self.queue_manager.size)
+        metrics.gauge("funpaybot_send_queue_spilled", "Сообщений очереди отправки на диске",
+                      func=lambda: self.queue_manager.spilled)
+        metrics.gauge("funpaybot_event_queue_depth", "Событий FunPay в очереди обработки",
+                      func=lambda: self.funpay_client.bridge.depth)
+        metrics.gauge("funpaybot_notifications_pending", "Уведомлений Telegram в очереди",
+                      func=lambda: len(self.telegram_bot.notifier.pending))
+        metrics.gauge("funpaybot_handler_in_flight", "Фоновых этапов обработки сообщений в работе",
+                      func=lambda: len(self.message_handler.background_tasks))
+        metrics.gauge("funpaybot_user_counters_pending", "Пользователей с незаписанными счетчиками",
+                      func=lambda: len(self.database.counters.pending))
+        if self.database.readers is not None:
+            metrics.gauge("funpaybot_db_readers_idle", "Свободных read-only соединений SQLite",
+                          func=lambda: self.database.readers.idle.qsize())
+        if self.database.archive.enabled:
+            metrics.gauge("funpaybot_messages_archived", "Сообщений перенесено в архив с запуска",
+                          func=lambda: self.database.archive.stats["archived"])
+        if self.database.history_cache is not None:
+            metrics.gauge("funpaybot_history_cache_hit_rate", "Доля чтений истории чата из памяти",
+                          func=lambda: self.database.history_cache.get_stats()["hit_rate"])
+
     async def start(self):
         self.running = True
 
+        # Эндпоинт метрик Prometheus (только 127.0.0.1)
+        if Config.METRICS_PORT:
+            self.metrics_server = MetricsServer(port=Config.METRICS_PORT)
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"⚠️ Не удалось открыть порт метрик {Config.METRICS_PORT}: {e}")
+                self.metrics_server = None
+
         # Старт Telegram бота
         await self.telegram_bot.start()
 
@@ -128,18 +226,43 @@ class FunPayBot:
 
         self.running = False
 
+        # Сначала перестаем принимать события, а транспорт и пулы FunPay закрываем
+        # только после очереди: она дописывает оставшиеся ответы через send_message
         if self.funpay_client:
-            logger.info("Остановка FunPay клиента...")
-            await self.funpay_client.stop()
+            logger.info("Остановка прослушивания FunPay...")
+            await self.funpay_client.stop_listening()
+
+        if self.message_handler:
+            await self.message_handler.drain()
 
         if self.queue_manager:
             logger.info("Остановка менеджера очереди...")
             await self.queue_manager.stop()
 
+        if self.funpay_client:
+            logger.info("Остановка FunPay клиента...")
+            await self.funpay_client.stop()
+
         if self.telegram_bot:
             logger.info("Остановка Telegram бота...")
             await self.telegram_bot.stop()
 
+        if self.dedup_index:
+            await self.dedup_index.stop()
+
+        if self.template_usage:
+            try:
+                await self.template_usage.stop()
+            except Exception as e:
+                logger.error(f"⚠️ Статистика шаблонов не записана: {e}")
+
+        if self.database:
+            await self.database.archive.stop()
+            await self.database.search_index.stop()
+
+        if self.metrics_server:
+            await self.metrics_server.stop()
+
         if self.database:
             logger.info("Закрытие подключения к БД...")
             try:
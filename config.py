@@ -10,10 +10,91 @@ class Config:
     DATABASE_PATH = os.getenv("DATABASE_PATH", "database.db")
     MESSAGE_QUEUE_MAX_SIZE = int(os.getenv("MESSAGE_QUEUE_MAX_SIZE", "100"))
     MESSAGE_SEND_DELAY = float(os.getenv("MESSAGE_SEND_DELAY", "2.5"))
-    AUTO_RESPONDER_ENABLED = os.getenv("AUTO_RESPONDER_ENABLED", "true").lower() == "true"
+    AUTO_RESPONDER_ENABLED = os.getenv("AUTO_RESPONDER_ENABLED", "false").lower() == "true"  # автоответы покупателям — только явно
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_DIR = os.getenv("LOG_DIR", "logs")  # каталог файлов логов
 
     # Новые параметры для production
     DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "30.0"))  # таймаут для sqlite
     RECONNECT_MAX_BACKOFF = int(os.getenv("RECONNECT_MAX_BACKOFF", "300"))  # макс. задержка реконнекта
     WATCHDOG_TIMEOUT = int(os.getenv("WATCHDOG_TIMEOUT", "600"))  # watchdog через 10 мин без событий
+
+    # Отложенная запись в БД (групповой коммит)
+    DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "false").lower() == "true"
+    DB_FLUSH_MAX_ROWS = int(os.getenv("DB_FLUSH_MAX_ROWS", "100"))  # сброс при N строках в буфере
+    DB_FLUSH_INTERVAL_MS = int(os.getenv("DB_FLUSH_INTERVAL_MS", "50"))  # или через T мс
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "2"))  # read-only соединений (0 — читать через писателя)
+    USER_COUNTERS_FLUSH_INTERVAL = float(os.getenv("USER_COUNTERS_FLUSH_INTERVAL", "5"))  # счетчики users копятся в памяти, секунды
+    TEMPLATE_USAGE_FLUSH_INTERVAL = float(os.getenv("TEMPLATE_USAGE_FLUSH_INTERVAL", "10"))  # статистика шаблонов копится в памяти, секунды
+    TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", "2"))  # как часто кэш шаблонов сверяет ревизию в БД, секунды
+
+    # Архивация старых сообщений в помесячные БД
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))  # старше N дней — в архив (0 — выкл)
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_COMPRESS = os.getenv("ARCHIVE_COMPRESS", "true").lower() == "true"  # zlib для текста
+    ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))  # секунды между проходами
+    ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))  # строк за транзакцию
+    ARCHIVE_VACUUM_PAGES = int(os.getenv("ARCHIVE_VACUUM_PAGES", "1000"))  # страниц за шаг incremental_vacuum
+
+    # Кэш последних сообщений чатов (get_chat_messages без похода в БД)
+    HISTORY_CACHE_CHATS = int(os.getenv("HISTORY_CACHE_CHATS", "1000"))  # чатов в памяти (0 — выкл)
+    HISTORY_CACHE_MESSAGES = int(os.getenv("HISTORY_CACHE_MESSAGES", "20000"))  # сообщений суммарно
+    HISTORY_CACHE_RING_SIZE = int(os.getenv("HISTORY_CACHE_RING_SIZE", "50"))  # последних сообщений на чат
+
+    # Полнотекстовый поиск (/search): фоновая индексация истории, существовавшей до включения
+    SEARCH_BACKFILL_BATCH = int(os.getenv("SEARCH_BACKFILL_BATCH", "1000"))  # сообщений за транзакцию
+    SEARCH_BACKFILL_PAUSE = float(os.getenv("SEARCH_BACKFILL_PAUSE", "0.1"))  # пауза между пачками, секунды
+    SEARCH_MERGE_INTERVAL = float(os.getenv("SEARCH_MERGE_INTERVAL", "5"))  # фоновое слияние сегментов индекса, секунды
+
+    # Дедупликация входящих сообщений (скользящее окно)
+    DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "60"))  # секунды
+    DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "50000"))  # хэшей в памяти
+    DEDUP_BLOOM = os.getenv("DEDUP_BLOOM", "true").lower() == "true"
+    DEDUP_SWEEP_INTERVAL = int(os.getenv("DEDUP_SWEEP_INTERVAL", "60"))  # очистка message_hashes
+
+    # Очередь отправки: воркеры и лимиты
+    MESSAGE_SEND_WORKERS = int(os.getenv("MESSAGE_SEND_WORKERS", "4"))  # разные чаты — параллельно
+    MESSAGE_CHAT_BURST = int(os.getenv("MESSAGE_CHAT_BURST", "1"))  # токенов в бакете чата (лимит — MESSAGE_SEND_DELAY)
+    MESSAGE_GLOBAL_RATE = float(os.getenv("MESSAGE_GLOBAL_RATE", "0.4"))  # общий лимит, сообщений/с (0.4 = 1 раз в 2.5с; 0 — без лимита)
+    MESSAGE_COALESCE_WINDOW = float(os.getenv("MESSAGE_COALESCE_WINDOW", "0"))  # окно склейки NORMAL/LOW, с (0 — выкл)
+    FUNPAY_MAX_MESSAGE_LENGTH = int(os.getenv("FUNPAY_MAX_MESSAGE_LENGTH", "2000"))  # лимит длины сообщения FunPay
+    MESSAGE_QUEUE_PERSISTENT = os.getenv("MESSAGE_QUEUE_PERSISTENT", "false").lower() == "true"  # очередь в SQLite
+
+    # Транспорт FunPay: "thread" (FunPayAPI в потоках) или "async" (aiohttp, пул keep-alive; экспериментально)
+    FUNPAY_TRANSPORT = os.getenv("FUNPAY_TRANSPORT", "thread").lower()
+    FUNPAY_HTTP_POOL_SIZE = int(os.getenv("FUNPAY_HTTP_POOL_SIZE", "10"))
+    FUNPAY_HTTP_KEEPALIVE = int(os.getenv("FUNPAY_HTTP_KEEPALIVE", "60"))  # секунды
+    FUNPAY_HTTP_TIMEOUT = float(os.getenv("FUNPAY_HTTP_TIMEOUT", "10"))  # секунды
+
+    # Пулы потоков для блокирующих вызовов FunPayAPI
+    FUNPAY_SEND_WORKERS = int(os.getenv("FUNPAY_SEND_WORKERS", "2"))
+    FUNPAY_SEND_MAX_PENDING = int(os.getenv("FUNPAY_SEND_MAX_PENDING", "8"))  # сверх этого — отказ
+    FUNPAY_METADATA_WORKERS = int(os.getenv("FUNPAY_METADATA_WORKERS", "2"))
+    FUNPAY_METADATA_MAX_PENDING = int(os.getenv("FUNPAY_METADATA_MAX_PENDING", "4"))
+    FUNPAY_EXECUTOR_TIMEOUT = float(os.getenv("FUNPAY_EXECUTOR_TIMEOUT", "30"))  # ожидание вызова, секунды
+
+    # Очередь входящих событий FunPay
+    EVENT_QUEUE_MAX_SIZE = int(os.getenv("EVENT_QUEUE_MAX_SIZE", "500"))  # при заполнении опрос замедляется
+    EVENT_WORKERS = int(os.getenv("EVENT_WORKERS", "4"))  # события одного чата — всегда по порядку
+
+    # Этапы обработки входящего сообщения: у каждого свой таймаут, секунды
+    HANDLER_DB_TIMEOUT = float(os.getenv("HANDLER_DB_TIMEOUT", "5"))
+    HANDLER_NOTIFY_TIMEOUT = float(os.getenv("HANDLER_NOTIFY_TIMEOUT", "10"))  # уведомление в Telegram (фон)
+    HANDLER_AUTOREPLY_TIMEOUT = float(os.getenv("HANDLER_AUTOREPLY_TIMEOUT", "5"))  # автоответ (критический путь)
+
+    # Уведомления Telegram: лимиты API и дайджесты
+    TELEGRAM_DIGEST_WINDOW = float(os.getenv("TELEGRAM_DIGEST_WINDOW", "30"))  # подряд идущие сообщения чата — в одно уведомление
+    TELEGRAM_DIGEST_MAX_LINES = int(os.getenv("TELEGRAM_DIGEST_MAX_LINES", "20"))
+    TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1.0"))  # запросов/с в чат админа
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # запросов/с всего
+
+    # Дедупликация заказов (кэш прогревается из таблицы orders при старте)
+    ORDER_DEDUP_MAX_ENTRIES = int(os.getenv("ORDER_DEDUP_MAX_ENTRIES", "10000"))
+    ORDER_DEDUP_TTL = int(os.getenv("ORDER_DEDUP_TTL", "259200"))  # секунды (3 дня)
+
+    # Метрики Prometheus на http://127.0.0.1:METRICS_PORT/metrics (0 — выключено)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+    # Трассировка событий: доля сэмплируемых событий и размер кольцевого буфера span'ов
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # 0 — выкл, 1 — каждое событие
+    TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "2000"))
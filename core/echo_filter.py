@@ -0,0 +1,87 @@
+"""
+core/echo_filter.py — подавление эха собственных сообщений бота.
+
+FunPay присылает отправленное ботом сообщение обратно как событие чата.
+Для каждого чата хранится короткое кольцо (deque с maxlen) хэшей недавно
+отправленных текстов со сроком жизни на монотонных часах. Простаивающие
+чаты удаляет колесо таймеров, поэтому память не растет с числом чатов.
+Все операции O(1) и защищены блокировкой: отправка идет из event loop,
+а события разбираются в потоке опроса.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("FunPayBot.EchoFilter")
+
+
+class EchoFilter:
+    def __init__(self, ttl=10.0, ring_size=8, idle_timeout=30.0, tick=1.0):
+        self.ttl = ttl
+        self.ring_size = ring_size
+        self.idle_timeout = max(idle_timeout, ttl)
+        self.tick = tick
+        self.lock = threading.Lock()
+        self.rings = {}  # chat_id -> deque[(хэш текста, monotonic-время истечения)]
+        self.deadlines = {}  # chat_id -> когда чат можно удалить
+        # Колесо таймеров: слот = номер тика по модулю числа слотов
+        self.wheel = [set() for _ in range(int(self.idle_timeout / tick) + 3)]
+        self.current_tick = int(time.monotonic() / tick)
+        self.stats = {"remembered": 0, "echoes": 0, "evicted_chats": 0}
+
+    def remember(self, chat_id, text):
+        """Запомнить отправленный в чат текст"""
+        now = time.monotonic()
+        with self.lock:
+            self._advance(now)
+            ring = self.rings.get(chat_id)
+            if ring is None:
+                ring = self.rings[chat_id] = deque(maxlen=self.ring_size)
+            ring.append((hash(text), now + self.ttl))
+            self._touch(chat_id, now)
+            self.stats["remembered"] += 1
+
+    def is_echo(self, chat_id, text):
+        """True, если текст совпадает с отправленным в этот чат за последние ttl секунд"""
+        now = time.monotonic()
+        with self.lock:
+            self._advance(now)
+            ring = self.rings.get(chat_id)
+            if not ring:
+                return False
+            text_hash = hash(text)
+            for sent_hash, expires in ring:
+                if sent_hash == text_hash and expires > now:
+                    self.stats["echoes"] += 1
+                    return True
+            return False
+
+    def _touch(self, chat_id, now):
+        deadline = now + self.idle_timeout
+        self.deadlines[chat_id] = deadline
+        # Слот следующего за дедлайном тика: к его обработке дедлайн уже прошел.
+        # Старую запись в колесе не ищем — при срабатывании слота сверяем дедлайн
+        self.wheel[(int(deadline / self.tick) + 1) % len(self.wheel)].add(chat_id)
+
+    def _advance(self, now):
+        target_tick = int(now / self.tick)
+        if target_tick - self.current_tick >= len(self.wheel):
+            # Долго не было вызовов: достаточно одного полного оборота
+            self.current_tick = target_tick - len(self.wheel)
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            slot = self.wheel[self.current_tick % len(self.wheel)]
+            if not slot:
+                continue
+            for chat_id in slot:
+                deadline = self.deadlines.get(chat_id)
+                if deadline is not None and deadline <= now:
+                    del self.deadlines[chat_id]
+                    del self.rings[chat_id]
+                    self.stats["evicted_chats"] += 1
+            slot.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "chats": len(self.rings)}
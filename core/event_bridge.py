@@ -0,0 +1,120 @@
+"""
+core/event_bridge.py — мост событий из потока опроса FunPay в event loop.
+
+События передаются пачками (один call_soon_threadsafe на опрос) в
+ограниченную очередь. Пул воркеров разбирает ее, при этом события одного
+чата всегда попадают к одному воркеру и обрабатываются по порядку. Когда
+очередь заполнена, поток опроса ждет свободного места — опрос замедляется
+вместо роста памяти.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from utils.tracing import tracer
+
+logger = logging.getLogger("FunPayBot.EventBridge")
+
+
+class EventBridge:
+    def __init__(self, dispatch, max_size=500, workers=4):
+        self.dispatch = dispatch  # async (event_type, data)
+        self.max_size = max_size
+        self.workers = max(1, workers)
+        self.slots = threading.Semaphore(max_size)
+        self.depth = 0
+        self.depth_lock = threading.Lock()
+        self.loop = None
+        self.queues = []
+        self.worker_tasks = []
+        self.closed = False
+        self.stats = {"batches": 0, "events": 0, "dispatched": 0, "errors": 0, "backpressure_waits": 0, "max_depth": 0}
+
+    def start(self, loop):
+        self.loop = loop
+        self.closed = False
+        self.queues = [asyncio.Queue() for _ in range(self.workers)]
+        self.worker_tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+        logger.info(f"✓ Мост событий запущен (max_size={self.max_size}, workers={self.workers})")
+
+    async def stop(self):
+        self.closed = True
+        for task in self.worker_tasks:
+            task.cancel()
+        for task in self.worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.worker_tasks = []
+
+    def put_batch_threadsafe(self, items):
+        """Из потока опроса: items — список (ключ, тип события, данные, trace id). Блокирует, пока нет места"""
+        accepted = []
+        for item in items:
+            if not self.slots.acquire(blocking=False):
+                # Сначала отдаем уже принятое, иначе воркерам нечего освобождать
+                if accepted:
+                    self.loop.call_soon_threadsafe(self._enqueue, accepted)
+                    accepted = []
+                if not self._acquire_blocking():
+                    return
+            accepted.append(item)
+        if accepted:
+            self.loop.call_soon_threadsafe(self._enqueue, accepted)
+
+    async def put_batch(self, items):
+        """Из event loop (async-транспорт): ждет места без блокировки потока"""
+        accepted = []
+        for item in items:
+            if not self.slots.acquire(blocking=False):
+                if accepted:
+                    self._enqueue(accepted)
+                    accepted = []
+                self.stats["backpressure_waits"] += 1
+                while not self.slots.acquire(blocking=False):
+                    if self.closed:
+                        return
+                    await asyncio.sleep(0.05)
+            accepted.append(item)
+        if accepted:
+            self._enqueue(accepted)
+
+    def _acquire_blocking(self):
+        self.stats["backpressure_waits"] += 1
+        while not self.closed:
+            if self.slots.acquire(timeout=0.5):
+                return True
+        return False
+
+    def _enqueue(self, items):
+        self.stats["batches"] += 1
+        self.stats["events"] += len(items)
+        with self.depth_lock:
+            self.depth += len(items)
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.depth)
+        enqueued_at = time.monotonic()
+        for key, event_type, data, trace_id in items:
+            self.queues[hash(key) % self.workers].put_nowait((event_type, data, trace_id, enqueued_at))
+
+    async def _worker(self, queue):
+        while True:
+            event_type, data, trace_id, enqueued_at = await queue.get()
+            try:
+                # Контекст с trace id наследуют все задачи, созданные обработчиками
+                with tracer.activate(trace_id):
+                    waited = time.monotonic() - enqueued_at
+                    tracer.record(trace_id, "bridge.wait", time.time() - waited, waited, event=event_type)
+                    await self.dispatch(event_type, data)
+                self.stats["dispatched"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Ошибка обработки события {event_type}: {e}", exc_info=True)
+            finally:
+                with self.depth_lock:
+                    self.depth -= 1
+                self.slots.release()
+
+    def get_stats(self):
+        return {**self.stats, "depth": self.depth, "max_size": self.max_size}
@@ -1,5 +1,7 @@
 import logging
 
+from utils.tracing import tracer
+
 logger = logging.getLogger("FunPayBot.EventHandler")
 
 class EventHandler:
@@ -11,7 +13,8 @@ class EventHandler:
 
     async def handle_message(self, message):
         try:
-            success = await self.message_handler.handle(message)
+            with tracer.span("event_handler.handle_message"):
+                success = await self.message_handler.handle(message)
             if success:
                 self.stats["messages_handled"] += 1
         except Exception as e:
@@ -20,7 +23,8 @@ class EventHandler:
 
     async def handle_order(self, order):
         try:
-            success = await self.order_handler.handle(order)
+            with tracer.span("event_handler.handle_order"):
+                success = await self.order_handler.handle(order)
             if success:
                 self.stats["orders_handled"] += 1
         except Exception as e:
@@ -3,36 +3,60 @@ core/funpay_client.py — МИНИМУМ ЛОГОВ
 """
 import asyncio
 import logging
+import time
 from typing import Optional, Callable
 from datetime import datetime, timedelta
 from FunPayAPI import Account, Runner, types, enums
 from utils.retry import async_retry
 from utils.helpers import sanitize_for_funpay
+from core.funpay_transport import AsyncFunPayTransport, TransportUnavailable
+from utils.executors import BoundedExecutor
+from core.event_bridge import EventBridge
+from core.echo_filter import EchoFilter
+from utils.metrics import metrics, FUNPAY_SEND_LATENCY
+from utils.tracing import tracer
 from config import Config
 
 logger = logging.getLogger("FunPayBot.FunPayClient")
+# Обновляются и из потока опроса — поэтому в потокобезопасном реестре, а не в self.stats
+EVENTS_RECEIVED = metrics.counter("funpaybot_funpay_events_total", "Событий FunPay получено", labelnames=("type",))
+CONNECTION_ERRORS = metrics.counter("funpaybot_funpay_connection_errors_total", "Ошибок подключения/опроса FunPay")
+MESSAGES_SENT = metrics.counter("funpaybot_funpay_messages_sent_total", "Сообщений отправлено в FunPay")
 DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
 class FunPayClient:
-    def __init__(self, token, requests_delay=4, notify_admin_callback=None):
+    def __init__(self, token, requests_delay=4, notify_admin_callback=None, transport_mode=None):
         self.token = token
         self.requests_delay = requests_delay
         self.notify_admin_callback = notify_admin_callback
         self.account = None
         self.runner = None
+        self.parse_future = None  # последний разбор Runner.parse_updates в пуле метаданных
+        # "async" — опрос и отправка через aiohttp; "thread" — FunPayAPI в пуле потоков
+        self.transport_mode = transport_mode or Config.FUNPAY_TRANSPORT
+        self.transport = None
+        # Ограниченная очередь событий поток опроса -> event loop
+        self.bridge = EventBridge(
+            self._trigger_handlers,
+            max_size=Config.EVENT_QUEUE_MAX_SIZE,
+            workers=Config.EVENT_WORKERS
+        )
+        # Свои пулы под каждую роль: долгоживущий listener не отнимает потоки у отправки
+        self.listener_executor = BoundedExecutor("listener", max_workers=1)
+        self.send_executor = BoundedExecutor(
+            "send", max_workers=Config.FUNPAY_SEND_WORKERS, max_pending=Config.FUNPAY_SEND_MAX_PENDING
+        )
+        self.metadata_executor = BoundedExecutor(
+            "metadata", max_workers=Config.FUNPAY_METADATA_WORKERS, max_pending=Config.FUNPAY_METADATA_MAX_PENDING
+        )
         self.connected = False
         self.running = False
         self.event_handlers = {}
-        self.stats = {
-            "messages_sent": 0,
-            "messages_received": 0,
-            "orders_received": 0,
-            "connection_errors": 0,
-            "reconnects": 0
-        }
+        self.stats = {"reconnects": 0}
         self.last_event_time = None
         self.main_loop = None
-        self.recently_sent = {}
+        # Недавно отправленные тексты: их возврат из FunPay — эхо, а не новое сообщение
+        self.echo_filter = EchoFilter(ttl=10, idle_timeout=30)
         self.bot_username = None
         logger.info("✓ FunPay клиент инициализирован")
 
@@ -44,9 +68,17 @@ class FunPayClient:
                 user_agent = getattr(Config, 'USER_AGENT', DEFAULT_USER_AGENT)
                 self.account = Account(self.token, user_agent=user_agent)
                 
-                await asyncio.get_event_loop().run_in_executor(None, self.account.get)
+                await self.metadata_executor.run(self.account.get, timeout=Config.FUNPAY_EXECUTOR_TIMEOUT)
                 
                 self.runner = Runner(self.account)
+                if self.transport_mode == "async" and self.transport is None:
+                    self.transport = AsyncFunPayTransport(
+                        self.account,
+                        pool_size=Config.FUNPAY_HTTP_POOL_SIZE,
+                        keepalive=Config.FUNPAY_HTTP_KEEPALIVE,
+                        timeout=Config.FUNPAY_HTTP_TIMEOUT
+                    )
+                    await self.transport.open()
                 self.connected = True
                 
                 username = getattr(self.account, 'username', 'Unknown')
@@ -55,7 +87,7 @@ class FunPayClient:
                 logger.info(f"✓ Авторизован как: {username} (ID: {user_id})")
                 return True
             except Exception as e:
-                self.stats["connection_errors"] += 1
+                CONNECTION_ERRORS.inc()
                 logger.error(f"✗ Ошибка подключения (попытка {attempt}/{max_attempts}): {e}")
                 if attempt < max_attempts:
                     await asyncio.sleep(5)
@@ -76,85 +108,98 @@ class FunPayClient:
                 except Exception as e:
                     logger.error(f"Ошибка в обработчике {event_type}: {e}", exc_info=True)
 
-    def _is_echo_message(self, chat_id: int, message_text: str) -> bool:
-        """Проверяем, не это ли наше сообщение, отправленное недавно"""
-        if chat_id not in self.recently_sent:
-            return False
+    def _prepare_event(self, event):
+        """Фильтрация события FunPay; возвращает (ключ, тип, данные, trace id) для моста событий или None"""
+        self.last_event_time = datetime.now()
         
-        now = datetime.now()
-        for sent_msg in self.recently_sent[chat_id]:
-            time_diff = (now - sent_msg["time"]).total_seconds()
-            if time_diff < 10 and sent_msg["text"] == message_text:
-                return True
+        if event.type == enums.EventTypes.LAST_CHAT_MESSAGE_CHANGED:
+            EVENTS_RECEIVED.labels("message").inc()
+            chat_id = event.chat.id
+            author = getattr(event.chat, 'name', 'Unknown')
+            message_text = getattr(event.chat, 'last_message_text', '')
+            
+            if self.echo_filter.is_echo(chat_id, message_text):
+                return None
+            
+            if author == self.bot_username:
+                return None
+            
+            logger.info(f"📥 Новое сообщение в чате {chat_id} от {author}")
+            # Ключ очереди — чат: события одного чата обрабатываются по порядку
+            return chat_id, "NEW_MESSAGE", MinimalMessage(chat_id, author, message_text), tracer.new_trace()
+            
+        elif event.type == enums.EventTypes.NEW_ORDER:
+            EVENTS_RECEIVED.labels("order").inc()
+            logger.info(f"🛒 Новый заказ получен")
+            return "orders", "NEW_ORDER", event.order, tracer.new_trace()
         
-        return False
+        return None
 
-    def _cleanup_old_messages(self, chat_id: int):
-        """Удаляем сообщения, отправленные более 30 секунд назад"""
-        if chat_id not in self.recently_sent:
-            return
-        
-        now = datetime.now()
-        self.recently_sent[chat_id] = [
-            msg for msg in self.recently_sent[chat_id]
-            if (now - msg["time"]).total_seconds() < 30
-        ]
+    def _prepare_batch(self, events):
+        batch = []
+        for event in events:
+            if not self.running:
+                break
+            try:
+                prepared = self._prepare_event(event)
+                if prepared:
+                    batch.append(prepared)
+            except Exception as e:
+                logger.error(f"⚠️ Ошибка обработки события: {e}", exc_info=True)
+        return batch
 
     def _sync_listen_loop(self):
         logger.info("🔄 Запуск прослушивания событий FunPay (sync loop)...")
-        try:
-            for event in self.runner.listen(requests_delay=self.requests_delay):
-                if not self.running:
-                    break
-                
-                self.last_event_time = datetime.now()
-                
-                try:
-                    if event.type == enums.EventTypes.LAST_CHAT_MESSAGE_CHANGED:
-                        self.stats["messages_received"] += 1
-                        chat_id = event.chat.id
-                        author = getattr(event.chat, 'name', 'Unknown')
-                        message_text = getattr(event.chat, 'last_message_text', '')
-                        
-                        self._cleanup_old_messages(chat_id)
-                        
-                        if self._is_echo_message(chat_id, message_text):
-                            continue
-                        
-                        if author == self.bot_username:
-                            continue
-                        
-                        logger.info(f"📥 Новое сообщение в чате {chat_id} от {author}")
-                        
-                        class MinimalMessage:
-                            def __init__(self, chat_id, author, text):
-                                self.chat_id = chat_id
-                                self.author = author
-                                self.text = text
-                        
-                        message = MinimalMessage(chat_id, author, message_text)
-                        
-                        asyncio.run_coroutine_threadsafe(
-                            self._trigger_handlers("NEW_MESSAGE", message),
-                            self.main_loop
-                        )
-                        
-                    elif event.type == enums.EventTypes.NEW_ORDER:
-                        self.stats["orders_received"] += 1
-                        logger.info(f"🛒 Новый заказ получен")
-                        
-                        asyncio.run_coroutine_threadsafe(
-                            self._trigger_handlers("NEW_ORDER", event.order),
-                            self.main_loop
-                        )
-                        
-                except Exception as e:
-                    logger.error(f"⚠️ Ошибка обработки события: {e}", exc_info=True)
-                    continue
-                    
-        except Exception as e:
-            logger.error(f"Ошибка в sync listen loop: {e}", exc_info=True)
-            self.running = False
+        backoff = self.requests_delay
+        while self.running:
+            try:
+                # То же, что Runner.listen, но события одного опроса идут одной пачкой
+                updates = self.runner.get_updates()
+                events = self.runner.parse_updates(updates)
+                backoff = self.requests_delay
+            except Exception as e:
+                CONNECTION_ERRORS.inc()
+                logger.error(f"⚠️ Ошибка получения событий: {e}")
+                backoff = min(backoff * 2, Config.RECONNECT_MAX_BACKOFF)
+                time.sleep(backoff)
+                continue
+            
+            batch = self._prepare_batch(events)
+            if batch:
+                # Блокируется, если очередь событий заполнена, — опрос замедляется
+                self.bridge.put_batch_threadsafe(batch)
+            
+            time.sleep(self.requests_delay)
+
+    async def _async_listen_loop(self):
+        logger.info("🔄 Запуск прослушивания событий FunPay (async loop)...")
+        backoff = self.requests_delay
+        while self.running:
+            try:
+                # Runner не потокобезопасен: разбор, не уложившийся в таймаут, продолжает
+                # идти в потоке — пока он не закончится, новый опрос не начинаем
+                if self.parse_future is not None and not self.parse_future.done():
+                    await self.metadata_executor.wait(self.parse_future, timeout=Config.FUNPAY_EXECUTOR_TIMEOUT)
+                updates = await self.transport.get_updates(self.runner)
+                # Разбор делает FunPayAPI; он сам может дозапрашивать историю чатов
+                # и список продаж через requests, поэтому выполняется в потоке
+                self.parse_future = self.metadata_executor.submit(self.runner.parse_updates, updates)
+                events = await self.metadata_executor.wait(self.parse_future, timeout=Config.FUNPAY_EXECUTOR_TIMEOUT)
+                backoff = self.requests_delay
+            except TransportUnavailable:
+                break
+            except Exception as e:
+                CONNECTION_ERRORS.inc()
+                logger.error(f"⚠️ Ошибка получения событий: {e}")
+                backoff = min(backoff * 2, Config.RECONNECT_MAX_BACKOFF)
+                await asyncio.sleep(backoff)
+                continue
+            
+            batch = self._prepare_batch(events)
+            if batch:
+                await self.bridge.put_batch(batch)
+            
+            await asyncio.sleep(self.requests_delay)
 
     async def start_listening(self):
         if not self.connected:
@@ -163,52 +208,105 @@ class FunPayClient:
         self.main_loop = asyncio.get_event_loop()
         
         self.running = True
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._sync_listen_loop)
+        self.bridge.start(self.main_loop)
+        if self.transport and self.transport.is_open:
+            await self._async_listen_loop()
+        if self.running:
+            if self.parse_future is not None and not self.parse_future.done():
+                # Синхронный цикл тоже разбирает через Runner — дожидаемся прерванного разбора
+                await asyncio.wrap_future(self.parse_future)
+            # Поток FunPayAPI — основной режим или запасной, если async-транспорт закрылся
+            await self.listener_executor.run(self._sync_listen_loop)
 
-    async def stop(self):
-        logger.info("⏹️ Остановка FunPay клиента...")
+    async def stop_listening(self):
+        """Прекратить опрос FunPay; отправка сообщений продолжает работать"""
         self.running = False
         if self.runner:
             try:
                 self.runner.stop()
             except:
                 pass
+        await self.bridge.stop()
+
+    async def stop(self):
+        """Полная остановка: вызывать после очереди отправки — дальше send_message не работает"""
+        logger.info("⏹️ Остановка FunPay клиента...")
+        await self.stop_listening()
+        if self.transport:
+            await self.transport.close()
+        for executor in (self.listener_executor, self.send_executor, self.metadata_executor):
+            executor.shutdown()
         self.connected = False
 
     async def send_message(self, chat_id: int, text: str):
         """Отправка сообщения без retry на парсинг ошибку"""
         try:
             sanitized_text = sanitize_for_funpay(text)
-            loop = asyncio.get_event_loop()
             
-            try:
-                await loop.run_in_executor(
-                    None,
-                    self.account.send_message,
-                    chat_id,
-                    sanitized_text
-                )
-            except AttributeError as e:
-                if "'NoneType' object has no attribute 'text'" in str(e):
-                    logger.debug(f"⚠️ Сообщение отправлено, но парсинг ответа упал (FunPayAPI баг)")
-                else:
-                    raise
+            with tracer.span("funpay.send_message", chat_id=chat_id):
+                await self._send(chat_id, sanitized_text)
             
-            if chat_id not in self.recently_sent:
-                self.recently_sent[chat_id] = []
+            self.echo_filter.remember(chat_id, sanitized_text)
             
-            self.recently_sent[chat_id].append({
-                "text": sanitized_text,
-                "time": datetime.now()
-            })
-            
-            self.stats["messages_sent"] += 1
+            MESSAGES_SENT.inc()
             logger.info(f"✅ Сообщение отправлено в чат {chat_id}")
             return True
         except Exception as e:
             logger.error(f"✗ Ошибка отправки сообщения в чат {chat_id}: {e}")
             raise
 
+    async def _send(self, chat_id, sanitized_text):
+        started = time.perf_counter()
+        sent = False
+        if self.transport:
+            try:
+                await self.transport.send_message(chat_id, sanitized_text, runner=self.runner)
+                sent = True
+                FUNPAY_SEND_LATENCY.labels("async").observe(time.perf_counter() - started)
+            except TransportUnavailable:
+                logger.debug("Async-транспорт недоступен, отправка через FunPayAPI")
+
+        if not sent:
+            started = time.perf_counter()
+            await self._send_via_thread(chat_id, sanitized_text)
+            FUNPAY_SEND_LATENCY.labels("thread").observe(time.perf_counter() - started)
+
+    async def _send_via_thread(self, chat_id, text):
+        try:
+            await self.send_executor.run(
+                self.account.send_message,
+                chat_id,
+                text,
+                timeout=Config.FUNPAY_EXECUTOR_TIMEOUT
+            )
+        except AttributeError as e:
+            if "'NoneType' object has no attribute 'text'" in str(e):
+                logger.debug(f"⚠️ Сообщение отправлено, но парсинг ответа упал (FunPayAPI баг)")
+            else:
+                raise
+
     def get_stats(self):
-        return self.stats.copy()
+        stats = {
+            "messages_sent": MESSAGES_SENT.get(),
+            "messages_received": EVENTS_RECEIVED.labels("message").get(),
+            "orders_received": EVENTS_RECEIVED.labels("order").get(),
+            "connection_errors": CONNECTION_ERRORS.get(),
+            **self.stats
+        }
+        if self.transport:
+            stats["transport"] = self.transport.get_stats()
+        stats["event_bridge"] = self.bridge.get_stats()
+        stats["echo_filter"] = self.echo_filter.get_stats()
+        stats["executors"] = {
+            executor.name: executor.get_stats()
+            for executor in (self.listener_executor, self.send_executor, self.metadata_executor)
+        }
+        return stats
+
+
+class MinimalMessage:
+    def __init__(self, chat_id, author, text):
+        self.chat_id = chat_id
+        self.author = author
+        self.text = text
+        self.received_at = time.monotonic()  # для метрики «событие -> уведомление»
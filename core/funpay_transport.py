@@ -0,0 +1,172 @@
+"""
+core/funpay_transport.py — асинхронный транспорт FunPay поверх aiohttp.
+
+Опрос runner/ и отправка сообщений идут через одну сессию aiohttp с пулом
+keep-alive соединений, без потоков и без стека requests. Формат запросов
+повторяет FunPayAPI (Runner.get_updates и Account.send_message), а разбор
+ответа runner/ по-прежнему делает Runner.parse_updates.
+"""
+import json
+import logging
+import time
+
+import aiohttp
+
+logger = logging.getLogger("FunPayBot.FunPayTransport")
+
+BASE_URL = "https://funpay.com/"
+RUNNER_HEADERS = {
+    "accept": "*/*",
+    "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "x-requested-with": "XMLHttpRequest"
+}
+
+
+class FunPayTransportError(Exception):
+    """Ошибка запроса к FunPay через асинхронный транспорт"""
+
+
+class TransportUnavailable(FunPayTransportError):
+    """Запрос не был отправлен: можно безопасно повторить через FunPayAPI"""
+
+
+class AsyncFunPayTransport:
+    def __init__(self, account, pool_size=10, keepalive=60, timeout=10):
+        self.account = account
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.session = None
+        self.stats = {
+            "polls": 0, "poll_errors": 0, "poll_time_total": 0.0, "poll_time_last": 0.0,
+            "sends": 0, "send_errors": 0, "send_time_total": 0.0, "send_time_last": 0.0
+        }
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive)
+        self.session = aiohttp.ClientSession(
+            base_url=BASE_URL,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            # Куки передаем заголовком из account: PHPSESSID обновляется FunPayAPI
+            cookie_jar=aiohttp.DummyCookieJar()
+        )
+        logger.info(f"✓ Async-транспорт FunPay готов (pool={self.pool_size}, keepalive={self.keepalive}s)")
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    @property
+    def is_open(self):
+        return self.session is not None and not self.session.closed
+
+    def _headers(self):
+        headers = dict(RUNNER_HEADERS)
+        headers["cookie"] = f"golden_key={self.account.golden_key}"
+        if self.account.phpsessid:
+            headers["cookie"] += f"; PHPSESSID={self.account.phpsessid}"
+        if self.account.user_agent:
+            headers["user-agent"] = self.account.user_agent
+        return headers
+
+    async def _post_runner(self, payload):
+        if not self.is_open:
+            raise TransportUnavailable("Сессия aiohttp закрыта")
+        async with self.session.post("runner/", data=payload, headers=self._headers()) as response:
+            if response.status != 200:
+                raise FunPayTransportError(f"runner/ ответил {response.status}")
+            return await response.json(content_type=None)
+
+    async def get_updates(self, runner):
+        """Аналог Runner.get_updates: запрос изменений чатов и счетчиков заказов"""
+        # Теги последних событий хранятся в приватных полях Runner. Если их нет,
+        # эта версия FunPayAPI устроена иначе, чем транспорт ожидает: не угадываем,
+        # а закрываем транспорт — опрос и отправка уходят на FunPayAPI в потоке
+        try:
+            orders_tag = runner._Runner__last_order_event_tag
+            chats_tag = runner._Runner__last_msg_event_tag
+        except AttributeError:
+            logger.error("❌ Runner без тегов событий: версия FunPayAPI несовместима с async-транспортом, "
+                         "переключаемся на FUNPAY_TRANSPORT=thread")
+            await self.close()
+            raise TransportUnavailable("Несовместимая версия FunPayAPI")
+        objects = [
+            {"type": "orders_counters", "id": self.account.id, "tag": orders_tag, "data": False},
+            {"type": "chat_bookmarks", "id": self.account.id, "tag": chats_tag, "data": False}
+        ]
+        payload = {
+            "objects": json.dumps(objects),
+            "request": "False",  # так его кодирует requests в FunPayAPI
+            "csrf_token": self.account.csrf_token
+        }
+
+        started = time.perf_counter()
+        try:
+            updates = await self._post_runner(payload)
+        except TransportUnavailable:
+            raise
+        except Exception:
+            self.stats["poll_errors"] += 1
+            raise
+        elapsed = time.perf_counter() - started
+        self.stats["polls"] += 1
+        self.stats["poll_time_total"] += elapsed
+        self.stats["poll_time_last"] = elapsed
+        return updates
+
+    async def send_message(self, chat_id, text, runner=None):
+        """Аналог Account.send_message; возвращает ID отправленного сообщения или None"""
+        request = {
+            "action": "chat_message",
+            "data": {"node": chat_id, "last_message": -1, "content": f"{self.account.bot_character}{text}"}
+        }
+        objects = [{
+            "type": "chat_node",
+            "id": chat_id,
+            "tag": "00000000",
+            "data": {"node": chat_id, "last_message": -1, "content": ""}
+        }]
+        payload = {
+            "objects": json.dumps(objects),
+            "request": json.dumps(request),
+            "csrf_token": self.account.csrf_token
+        }
+
+        started = time.perf_counter()
+        try:
+            result = await self._post_runner(payload)
+            response = result.get("response")
+            if not response:
+                raise FunPayTransportError(f"Сообщение в чат {chat_id} не доставлено")
+            if response.get("error") is not None:
+                raise FunPayTransportError(f"Сообщение в чат {chat_id} не доставлено: {response['error']}")
+        except TransportUnavailable:
+            raise
+        except Exception:
+            self.stats["send_errors"] += 1
+            raise
+        elapsed = time.perf_counter() - started
+        self.stats["sends"] += 1
+        self.stats["send_time_total"] += elapsed
+        self.stats["send_time_last"] = elapsed
+
+        message_id = None
+        try:
+            message_id = int(result["objects"][0]["data"]["messages"][-1]["id"])
+        except (KeyError, IndexError, TypeError, ValueError):
+            logger.debug("Не удалось разобрать ID отправленного сообщения")
+        # Как и FunPayAPI: Runner не должен считать наше сообщение новым событием
+        if runner is not None and message_id is not None and isinstance(chat_id, int):
+            runner.mark_as_by_bot(chat_id, message_id)
+        return message_id
+
+    def get_stats(self):
+        polls = self.stats["polls"] or 1
+        sends = self.stats["sends"] or 1
+        return {
+            **self.stats,
+            "poll_time_avg": round(self.stats["poll_time_total"] / polls, 4),
+            "send_time_avg": round(self.stats["send_time_total"] / sends, 4)
+        }
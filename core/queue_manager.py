@@ -1,12 +1,24 @@
 import asyncio
+import heapq
+import itertools
 import logging
+import time
+from collections import OrderedDict
 from typing import Optional, Dict, Any
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
+from utils.rate_limiter import TokenBucket
+from utils.metrics import QUEUE_WAIT
+from utils.tracing import tracer, current_trace
 
 logger = logging.getLogger("FunPayBot.QueueManager")
 
+CHAT_STATS_LIMIT = 500  # сколько чатов держим в статистике ожидания
+IDLE_BUCKETS_LIMIT = 1000  # после этого числа бакетов чистим простаивающие
+FAILED_OUTBOUND_RETENTION_DAYS = 7  # строки failed в outbound_queue храним для разбора
+FAILED_OUTBOUND_PRUNE_INTERVAL = 3600  # секунд между чистками
+
 class MessagePriority(Enum):
     LOW = 1
     NORMAL = 2
@@ -18,21 +30,64 @@ class QueuedMessage:
     priority: int = field(compare=True)
     chat_id: int = field(compare=False)
     text: str = field(compare=False)
+    seq: int = field(default=0, compare=True)  # FIFO внутри одного приоритета
     callback: Optional[callable] = field(default=None, compare=False)
     metadata: Dict[str, Any] = field(default_factory=dict, compare=False)
     timestamp: datetime = field(default_factory=datetime.now, compare=False)
+    enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+    parts: list = field(default_factory=list, compare=False)  # исходные сообщения склеенной отправки
+    row_ids: list = field(default_factory=list, compare=False)  # строки outbound_queue (персистентный режим)
+    trace_id: Optional[str] = field(default=None, compare=False)
+    # send_callback в работе или упал с исключением — сообщение могло уйти в FunPay
+    in_doubt: bool = field(default=False, compare=False)
 
 class MessageQueueManager:
-    def __init__(self, max_size=100, send_delay=2.5, max_retries=3):
+    def __init__(self, max_size=100, send_delay=2.5, max_retries=3, workers=1,
+                 chat_rate=None, chat_burst=1, global_rate=None,
+                 coalesce_window=0.0, max_message_length=2000, store=None, drain_timeout=10.0):
         self.max_size = max_size
+        self.drain_timeout = drain_timeout  # сколько stop() ждет отправки оставшегося в памяти
         self.send_delay = send_delay
         self.max_retries = max_retries
-        self.queue = asyncio.PriorityQueue(maxsize=max_size)
-        self.stats = {"total_queued": 0, "total_sent": 0, "total_failed": 0, "queue_full_count": 0}
+        self.workers = max(1, workers)
+        # По умолчанию в каждый чат — не чаще раза в send_delay
+        self.chat_rate = chat_rate or 1.0 / send_delay
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, capacity=1) if global_rate else None
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+
+        # Очередь на чат + очередь готовых к отправке чатов: один чат обслуживает
+        # один воркер, поэтому порядок внутри чата сохраняется
+        self.chat_queues: Dict[int, list] = {}
+        self.ready = asyncio.PriorityQueue()
+        self.size = 0  # в очередях чатов + в окне склейки
+        self.seq = itertools.count()
+
+        # Окно склейки: NORMAL/LOW сообщения в один чат копятся coalesce_window секунд
+        self.coalesce_window = coalesce_window
+        self.max_message_length = max_message_length
+        self.holding: Dict[int, QueuedMessage] = {}
+        self.holding_timers: Dict[int, asyncio.TimerHandle] = {}
+
+        # Персистентный режим: store (Database) хранит неотправленное в outbound_queue,
+        # в памяти — только голова очереди, остальное ждет на диске
+        self.store = store
+        self.spilled = 0
+        self.refill_task = None
+        # Колбэки и метаданные сообщений, ушедших на диск: row_id -> (callback, metadata, trace_id).
+        # Живут только в этом процессе — после рестарта восстановленные сообщения без колбэков
+        self.spilled_callbacks: Dict[int, tuple] = {}
+        self.pruned_at = 0.0
+
+        self.stats = {
+            "total_queued": 0, "total_sent": 0, "total_failed": 0, "queue_full_count": 0,
+            "coalesced_messages": 0, "spilled": 0, "replayed": 0, "deduplicated": 0
+        }
+        self.chat_wait = OrderedDict()  # chat_id -> {"count", "total", "max"}
         self.running = False
-        self.worker_task = None
-        self.last_send_time = None
-        logger.info(f"✓ Менеджер очереди инициализирован (max_size={max_size}, delay={send_delay}s)")
+        self.worker_tasks = []
+        self.sending: Dict[int, QueuedMessage] = {}  # seq -> сообщение, которое воркер отправляет сейчас
+        logger.info(f"✓ Менеджер очереди инициализирован (max_size={max_size}, delay={send_delay}s, workers={self.workers})")
 
     async def add_message(self, chat_id, text, priority=MessagePriority.NORMAL, callback=None, metadata=None):
         try:
@@ -40,96 +95,353 @@ class MessageQueueManager:
                 priority=-priority.value,
                 chat_id=chat_id,
                 text=text,
+                seq=next(self.seq),
                 callback=callback,
-                metadata=metadata or {}
+                metadata=metadata or {},
+                trace_id=current_trace.get()
             )
-            self.queue.put_nowait(message)
+            if self.store:
+                # Только явный ключ: одинаковый текст в тот же чат — не обязательно дубль
+                dedup_key = message.metadata.get("dedup_key")
+                row_id = await self.store.add_outbound(chat_id, text, priority.value, dedup_key)
+                if row_id is None:
+                    self.stats["deduplicated"] += 1
+                    logger.debug(f"Такое сообщение уже ждет отправки (chat_id={chat_id}), пропускаем")
+                    return True
+                message.row_ids = [row_id]
+
+            if self.spilled > 0:
+                # На диске уже есть очередь — встаем за ней, чтобы не обогнать старые сообщения
+                accepted = False
+            elif self.coalesce_window > 0 and priority in (MessagePriority.LOW, MessagePriority.NORMAL):
+                accepted = self._coalesce(message)
+            else:
+                accepted = self.size < self.max_size
+                if accepted:
+                    self.size += 1
+                    self._push(message)
+
+            if not accepted:
+                if not self.store:
+                    raise asyncio.QueueFull()
+                # Память заполнена — сообщение остается на диске и подтянется позже
+                await self.store.set_outbound_status(message.row_ids, "spilled")
+                if message.callback or message.metadata:
+                    self.spilled_callbacks[message.row_ids[0]] = (message.callback, message.metadata, message.trace_id)
+                self.spilled += 1
+                self.stats["spilled"] += 1
+                # Воркеры могли уже всё разобрать — тогда подкачку не запустит никто, кроме нас
+                self._maybe_refill()
+                logger.debug(f"Очередь в памяти заполнена, сообщение сохранено на диск (chat_id={chat_id})")
             self.stats["total_queued"] += 1
-            logger.debug(f"✓ Сообщение в очередь (chat_id={chat_id}, priority={priority.name}, queue_size={self.queue.qsize()})")
+            logger.debug(f"✓ Сообщение в очередь (chat_id={chat_id}, priority={priority.name}, queue_size={self.size})")
             return True
         except asyncio.QueueFull:
             self.stats["queue_full_count"] += 1
-            logger.warning(f"⚠️ Очередь переполнена! (размер={self.queue.qsize()}/{self.max_size})")
+            logger.warning(f"⚠️ Очередь переполнена! (размер={self.size}/{self.max_size})")
             return False
         except Exception as e:
             logger.error(f"✗ Ошибка добавления в очередь: {e}")
             return False
 
+    def _coalesce(self, message):
+        """Добавление в окно склейки; False, если для новой группы нет места"""
+        group = self.holding.get(message.chat_id)
+        if group is not None:
+            merged_length = len(group.text) + 1 + len(message.text)
+            if merged_length <= self.max_message_length:
+                group.text = f"{group.text}\n{message.text}"
+                group.priority = min(group.priority, message.priority)
+                group.parts.append(message)
+                group.row_ids.extend(message.row_ids)
+                self.stats["coalesced_messages"] += 1
+                return True
+            # Не влезает в лимит FunPay — отпускаем накопленное и начинаем новую группу
+            self._release(message.chat_id)
+
+        if self.size >= self.max_size:
+            return False
+        self.size += 1
+        group = QueuedMessage(
+            priority=message.priority,
+            chat_id=message.chat_id,
+            text=message.text,
+            seq=message.seq,
+            parts=[message],
+            row_ids=list(message.row_ids),
+            trace_id=message.trace_id
+        )
+        self.holding[message.chat_id] = group
+        self.holding_timers[message.chat_id] = asyncio.get_running_loop().call_later(
+            self.coalesce_window, self._release, message.chat_id
+        )
+        return True
+
+    def _release(self, chat_id):
+        timer = self.holding_timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+        group = self.holding.pop(chat_id, None)
+        if group is not None:
+            self._push(group)
+
+    def _push(self, message):
+        chat_queue = self.chat_queues.get(message.chat_id)
+        if chat_queue is None:
+            # Чат не в работе и не в очереди готовых — ставим его туда
+            self.chat_queues[message.chat_id] = [message]
+            self.ready.put_nowait((message.priority, message.seq, message.chat_id))
+        else:
+            heapq.heappush(chat_queue, message)
+
     async def start(self, send_callback):
         if self.running:
             logger.warning("⚠️ Менеджер очереди уже запущен")
             return
         
         self.running = True
-        self.worker_task = asyncio.create_task(self._worker(send_callback))
+        if self.store:
+            await self._replay()
+        self.worker_tasks = [
+            asyncio.create_task(self._worker(send_callback, number))
+            for number in range(1, self.workers + 1)
+        ]
         logger.info("✓ Менеджер очереди запущен")
 
     async def stop(self):
         if not self.running:
             return
         
+        # Удержанные в окне склейки группы — в очереди, и всё поставленное
+        # дописываем, пока позволяет drain_timeout
+        for chat_id in list(self.holding):
+            self._release(chat_id)
+        deadline = time.monotonic() + self.drain_timeout
+        while self.size > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+        # Воркеры выходят сами после текущей отправки; зависшие — отменяем
         self.running = False
-        if self.worker_task:
-            self.worker_task.cancel()
+        _, stuck = await asyncio.wait(self.worker_tasks, timeout=max(0.0, deadline - time.monotonic()) + 1.0)
+        # До отмены: finally воркера уберет прерванную отправку из sending
+        interrupted = list(self.sending.values())
+        for task in stuck:
+            task.cancel()
+        for task in stuck:
             try:
-                await self.worker_task
+                await task
             except asyncio.CancelledError:
                 pass
-        
+        self.worker_tasks = []
+        if self.refill_task:
+            self.refill_task.cancel()
+            self.refill_task = None
+        await self._requeue_unstarted(interrupted)
+        await self._fail_unsent(interrupted)
+
         logger.info("✓ Менеджер очереди остановлен")
 
-    async def _worker(self, send_callback):
-        logger.info("🔄 Обработчик очереди запущен")
+    async def _requeue_unstarted(self, interrupted):
+        """Прерванные, которые точно не ушли (отправка не начиналась или получила явный отказ), —
+        обратно в pending: после рестарта отправятся. Остальные остаются в sending, replay их не повторяет"""
+        row_ids = [row_id for message in interrupted if not message.in_doubt for row_id in message.row_ids]
+        if not self.store or not row_ids:
+            return
+        try:
+            await self.store.set_outbound_status(row_ids, "pending")
+        except Exception as e:
+            logger.error(f"Ошибка возврата прерванных сообщений в очередь: {e}")
+
+    async def _fail_unsent(self, interrupted=()):
+        """Колбэки сообщений, которые в этом процессе уже не отправятся, получают неуспех"""
+        unsent = list(interrupted) + [message for chat_queue in self.chat_queues.values() for message in chat_queue]
+        self.chat_queues.clear()
+        self.size = 0
+        for message in unsent:
+            for part in message.parts or [message]:
+                await self._run_callback(part.callback, False, {**part.metadata, "shutdown": True})
+        # Сообщения на диске отправятся после рестарта, но их колбэки живут только здесь
+        for callback, metadata, _ in self.spilled_callbacks.values():
+            await self._run_callback(callback, False, {**metadata, "shutdown": True})
+        self.spilled_callbacks.clear()
+        if unsent:
+            logger.warning(f"⚠️ Не отправлено при остановке: {len(unsent)} сообщ.")
+
+    async def _replay(self):
+        """Восстановление неотправленных сообщений после рестарта"""
+        try:
+            await self._prune_failed()
+            inflight = await self.store.prepare_outbound_replay()
+            if inflight:
+                logger.warning(f"⚠️ {inflight} сообщ. были в процессе отправки при остановке — повторно не отправляем")
+            rows = await self.store.claim_spilled_outbound(self.max_size - self.size)
+            for row_id, chat_id, text, priority in rows:
+                self._push_restored(row_id, chat_id, text, priority)
+            self.stats["replayed"] += len(rows)
+            self.spilled = await self.store.count_spilled_outbound()
+            if rows or self.spilled:
+                logger.info(f"✓ Восстановлено из БД: {len(rows)} в памяти, {self.spilled} на диске")
+        except Exception as e:
+            logger.error(f"✗ Ошибка восстановления очереди: {e}", exc_info=True)
+
+    def _push_restored(self, row_id, chat_id, text, priority):
+        callback, metadata, trace_id = self.spilled_callbacks.pop(row_id, (None, {}, None))
+        message = QueuedMessage(
+            priority=-priority,
+            chat_id=chat_id,
+            text=text,
+            seq=next(self.seq),
+            callback=callback,
+            metadata=metadata,
+            row_ids=[row_id],
+            trace_id=trace_id
+        )
+        self.size += 1
+        self._push(message)
+
+    def _maybe_refill(self):
+        if not self.store or self.spilled <= 0 or self.size > self.max_size // 2:
+            return
+        if self.refill_task is None or self.refill_task.done():
+            self.refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        try:
+            limit = self.max_size - self.size
+            rows = await self.store.claim_spilled_outbound(limit)
+            for row_id, chat_id, text, priority in rows:
+                self._push_restored(row_id, chat_id, text, priority)
+            # Вернулось меньше, чем просили, — диск пуст
+            self.spilled = 0 if len(rows) < limit else max(0, self.spilled - len(rows))
+        except Exception as e:
+            logger.error(f"Ошибка подкачки очереди с диска: {e}")
+
+    async def _worker(self, send_callback, number=1):
+        logger.info(f"🔄 Обработчик очереди #{number} запущен")
         while self.running:
             try:
                 try:
-                    message = await asyncio.wait_for(self.queue.get(), timeout=1.0)
+                    _, _, chat_id = await asyncio.wait_for(self.ready.get(), timeout=1.0)
                 except asyncio.TimeoutError:
                     continue
                 
-                await self._enforce_rate_limit()
-                
-                success = await self._send_with_retry(message, send_callback)
-                
-                if success:
-                    self.stats["total_sent"] += 1
-                else:
-                    self.stats["total_failed"] += 1
-                
-                if message.callback:
-                    try:
-                        if asyncio.iscoroutinefunction(message.callback):
-                            await message.callback(success, message.metadata)
-                        else:
-                            message.callback(success, message.metadata)
-                    except Exception as e:
-                        logger.error(f"Ошибка в callback: {e}")
-                
-                self.queue.task_done()
+                chat_queue = self.chat_queues[chat_id]
+                message = heapq.heappop(chat_queue)
+                self.size -= 1
+                self._maybe_refill()
+                self.sending[message.seq] = message
+                try:
+                    await self._process(message, send_callback)
+                finally:
+                    self.sending.pop(message.seq, None)
+                    if chat_queue:
+                        head = chat_queue[0]
+                        self.ready.put_nowait((head.priority, head.seq, chat_id))
+                    else:
+                        del self.chat_queues[chat_id]
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"Ошибка в обработчике очереди: {e}", exc_info=True)
                 await asyncio.sleep(1)
 
-    async def _enforce_rate_limit(self):
-        if self.last_send_time is None:
-            self.last_send_time = datetime.now()
-            return
+    async def _process(self, message, send_callback):
+        await self._enforce_rate_limit(message.chat_id)
+        wait = time.monotonic() - message.enqueued_at
+        self._record_wait(message.chat_id, wait)
+        QUEUE_WAIT.observe(wait)
+        # Склеенная отправка: ожидание пишем в трассу каждого исходного сообщения
+        for part in message.parts or [message]:
+            part_wait = time.monotonic() - part.enqueued_at
+            tracer.record(part.trace_id, "queue.wait", time.time() - part_wait, part_wait, chat_id=message.chat_id)
         
-        elapsed = (datetime.now() - self.last_send_time).total_seconds()
-        if elapsed < self.send_delay:
-            wait_time = self.send_delay - elapsed
-            await asyncio.sleep(wait_time)
+        with tracer.activate(message.trace_id), tracer.span("queue.send", chat_id=message.chat_id):
+            await self._persist_status(message, "sending")
+            success = await self._send_with_retry(message, send_callback)
+            await self._persist_status(message, "sent" if success else "failed")
         
-        self.last_send_time = datetime.now()
+        if success:
+            self.stats["total_sent"] += 1
+        else:
+            self.stats["total_failed"] += 1
+            if self.store and time.monotonic() - self.pruned_at >= FAILED_OUTBOUND_PRUNE_INTERVAL:
+                await self._prune_failed()
+        
+        if message.parts:
+            # Склеенная отправка: каждый исходный колбэк получает общий результат
+            for part in message.parts:
+                metadata = {**part.metadata, "merged_text": message.text, "coalesced": len(message.parts)}
+                await self._run_callback(part.callback, success, metadata)
+        else:
+            await self._run_callback(message.callback, success, message.metadata)
+
+    async def _persist_status(self, message, status):
+        if not self.store or not message.row_ids:
+            return
+        try:
+            if status == "sent":
+                await self.store.delete_outbound(message.row_ids)
+            else:
+                await self.store.set_outbound_status(message.row_ids, status)
+        except Exception as e:
+            logger.error(f"Ошибка записи статуса отправки ({status}): {e}")
+
+    async def _prune_failed(self):
+        """Удаление старых неотправленных (failed) строк outbound_queue; sent удаляются сразу"""
+        self.pruned_at = time.monotonic()
+        try:
+            deleted = await self.store.prune_failed_outbound(FAILED_OUTBOUND_RETENTION_DAYS)
+            if deleted:
+                logger.info(f"🧹 Удалено {deleted} старых неотправленных сообщений из outbound_queue")
+        except Exception as e:
+            logger.error(f"Ошибка очистки outbound_queue: {e}")
+
+    async def _run_callback(self, callback, success, metadata):
+        if not callback:
+            return
+        try:
+            if asyncio.iscoroutinefunction(callback):
+                await callback(success, metadata)
+            else:
+                callback(success, metadata)
+        except Exception as e:
+            logger.error(f"Ошибка в callback: {e}")
+
+    async def _enforce_rate_limit(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= IDLE_BUCKETS_LIMIT:
+                self._drop_idle_buckets()
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, capacity=self.chat_burst)
+        await bucket.acquire()
+        if self.global_bucket:
+            await self.global_bucket.acquire()
+
+    def _drop_idle_buckets(self):
+        # Полный бакет ничем не отличается от нового — его можно забыть
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items() if bucket.is_idle()]:
+            del self.chat_buckets[chat_id]
+
+    def _record_wait(self, chat_id, wait):
+        entry = self.chat_wait.get(chat_id)
+        if entry is None:
+            entry = self.chat_wait[chat_id] = {"count": 0, "total": 0.0, "max": 0.0}
+            if len(self.chat_wait) > CHAT_STATS_LIMIT:
+                self.chat_wait.popitem(last=False)
+        else:
+            self.chat_wait.move_to_end(chat_id)
+        entry["count"] += 1
+        entry["total"] += wait
+        entry["max"] = max(entry["max"], wait)
 
     async def _send_with_retry(self, message, send_callback):
         for attempt in range(1, self.max_retries + 1):
             try:
+                message.in_doubt = True
                 success = await send_callback(message.chat_id, message.text)
                 if success:
                     return True
+                message.in_doubt = False
                 if attempt < self.max_retries:
                     await asyncio.sleep(attempt * 2)
             except Exception as e:
@@ -139,5 +451,24 @@ class MessageQueueManager:
         
         return False
 
+    def get_chat_wait_stats(self):
+        return {
+            chat_id: {
+                "count": entry["count"],
+                "avg_wait": round(entry["total"] / entry["count"], 3),
+                "max_wait": round(entry["max"], 3)
+            }
+            for chat_id, entry in self.chat_wait.items()
+        }
+
     def get_stats(self):
-        return {**self.stats, "queue_size": self.queue.qsize(), "is_running": self.running}
+        return {
+            **self.stats,
+            "queue_size": self.size,
+            "holding_chats": len(self.holding),
+            "spilled_on_disk": self.spilled,
+            "active_chats": len(self.chat_queues),
+            "workers": self.workers,
+            "is_running": self.running,
+            "chat_wait": self.get_chat_wait_stats()
+        }
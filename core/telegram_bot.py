@@ -2,19 +2,39 @@
 core/telegram_bot.py — ТОЛЬКО HELP И STATS (БЕЗ DEBUG)
 """
 import asyncio
+import html
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 
+from autoresponder.usage import REPORT_WINDOWS
+from core.telegram_notifier import TelegramNotifier
+from utils.metrics import metrics
+from utils.profiler import profiler, ProfilerBusy
+from utils.tracing import tracer
+
 logger = logging.getLogger("FunPayBot.TelegramBot")
 
+SEARCH_PAGE_SIZE = 5
+SEARCH_EXCERPT_LENGTH = 200
+
 class TelegramBot:
-    def __init__(self, token, admin_id, on_reply_callback=None):
+    def __init__(self, token, admin_id, on_reply_callback=None, notifier=None, on_search_callback=None,
+                 on_templates_callback=None):
         self.token = token
         self.admin_id = int(admin_id)
         self.on_reply_callback = on_reply_callback
+        # async (query, limit, before_id) -> [Message] от новых к старым
+        self.on_search_callback = on_search_callback
+        # async () -> (проверено сообщений по окнам, [шаблон]) — TemplateUsage.report
+        self.on_templates_callback = on_templates_callback
+        # Уведомления идут через планировщик: лимиты Telegram, дайджесты, повтор после 429
+        self.notifier = notifier or TelegramNotifier(self.admin_id)
         self.app = None
         self.awaiting_reply = {}
+        # user_id -> {"query": str, "cursors": [before_id начала каждой страницы]}
+        self.searches = {}
+        self.profile_task = None  # фоновый /profile: держим ссылку и отменяем при остановке
         self.stats = {"notifications_sent": 0, "replies_sent": 0, "commands_processed": 0}
         logger.info("✓ Telegram бот инициализирован")
 
@@ -27,11 +47,16 @@ class TelegramBot:
             
             self.app.add_handler(CommandHandler("help", self._cmd_help))
             self.app.add_handler(CommandHandler("stats", self._cmd_stats))
+            self.app.add_handler(CommandHandler("trace", self._cmd_trace))
+            self.app.add_handler(CommandHandler("profile", self._cmd_profile))
+            self.app.add_handler(CommandHandler("search", self._cmd_search))
+            self.app.add_handler(CommandHandler("templates", self._cmd_templates))
             self.app.add_handler(CallbackQueryHandler(self._button_callback))
             self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_message))
             
             await self.app.initialize()
             await self.app.start()
+            self.notifier.start(self.app.bot)
             
             await self.app.updater.start_polling(
                 allowed_updates=Update.ALL_TYPES,
@@ -56,6 +81,10 @@ class TelegramBot:
     async def stop(self):
         """Остановка бота"""
         try:
+            if self.profile_task and not self.profile_task.done():
+                self.profile_task.cancel()
+                await asyncio.gather(self.profile_task, return_exceptions=True)
+            await self.notifier.stop()
             if self.app:
                 await self.app.updater.stop()
                 await self.app.stop()
@@ -73,7 +102,11 @@ class TelegramBot:
                 "📖 <b>Справка</b>\n\n"
                 "Доступные команды:\n"
                 "/help - Эта справка\n"
-                "/stats - Статистика бота\n\n"
+                "/stats - Статистика бота\n"
+                "/trace - Последние трассы обработки событий\n"
+                "/profile [сек] [cpu|sample] - Профиль работающего бота\n"
+                "/search слова - Поиск по истории переписки\n"
+                "/templates - Срабатывания шаблонов автоответчика\n\n"
                 "<b>Как это работает:</b>\n"
                 "1️⃣ Когда приходит сообщение из FunPay, я отправляю тебе уведомление\n"
                 "2️⃣ Нажимаешь кнопку <b>\"✍️ Ответить\"</b>\n"
@@ -93,18 +126,183 @@ class TelegramBot:
                 f"📊 <b>Статистика</b>\n\n"
                 f"📬 Уведомлений отправлено: <b>{self.stats['notifications_sent']}</b>\n"
                 f"💬 Ответов отправлено: <b>{self.stats['replies_sent']}</b>\n"
-                f"⌨️ Команд обработано: <b>{self.stats['commands_processed']}</b>",
+                f"⌨️ Команд обработано: <b>{self.stats['commands_processed']}</b>\n"
+                f"📨 Запросов к Telegram API: <b>{self.notifier.get_stats()['api_calls']}</b>"
+                f"{self._latency_summary()}",
                 parse_mode="HTML"
             )
         except Exception as e:
             logger.error(f"❌ Ошибка в _cmd_stats: {e}", exc_info=True)
 
+    def _is_admin(self, update):
+        return update.effective_user is not None and update.effective_user.id == self.admin_id
+
+    async def _cmd_trace(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /trace — последние сэмплированные трассы с разбивкой по этапам"""
+        try:
+            self.stats["commands_processed"] += 1
+            if not self._is_admin(update):
+                return
+
+            traces = tracer.recent_traces(limit=5)
+            if not traces:
+                await update.message.reply_text(
+                    f"🔍 Трасс пока нет (доля сэмплирования: {tracer.sample_rate:.0%})"
+                )
+                return
+            blocks = []
+            for trace_id, total, spans in traces:
+                lines = [f"{trace_id}  всего {total * 1000:.1f} мс"]
+                lines.extend(f"  {name:<32} {duration * 1000:8.1f} мс" for name, duration in spans)
+                blocks.append("\n".join(lines))
+            await update.message.reply_text(
+                f"<pre>{html.escape(chr(10).join(blocks))[:4000]}</pre>",
+                parse_mode="HTML"
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка в _cmd_trace: {e}", exc_info=True)
+
+    async def _cmd_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /profile [секунды] [cpu|sample] — профиль процесса без рестарта (только админ)"""
+        try:
+            self.stats["commands_processed"] += 1
+            if not self._is_admin(update):
+                logger.warning(f"⚠️ /profile от не-админа {update.effective_user.id if update.effective_user else '?'}")
+                return
+
+            args = context.args or []
+            duration = float(args[0]) if args and args[0].replace(".", "", 1).isdigit() else 10.0
+            mode = "sample" if "sample" in args else "cpu"
+            if self.profile_task and not self.profile_task.done():
+                await update.message.reply_text("⏳ Профилирование уже идет")
+                return
+            await update.message.reply_text(f"🔬 Профилирую {duration:.0f}s ({mode})...")
+            # Долгая команда не должна держать обработку других апдейтов Telegram
+            self.profile_task = asyncio.create_task(self._run_profile(update, duration, mode))
+        except Exception as e:
+            logger.error(f"❌ Ошибка в _cmd_profile: {e}", exc_info=True)
+
+    async def _run_profile(self, update, duration, mode):
+        try:
+            report = await profiler.run(duration=duration, mode=mode)
+        except ProfilerBusy:
+            await update.message.reply_text("⏳ Профилирование уже идет")
+            return
+        except Exception as e:
+            logger.error(f"❌ Ошибка профилирования: {e}", exc_info=True)
+            await update.message.reply_text(f"❌ Ошибка профилирования: {e}")
+            return
+        await update.message.reply_text(f"<pre>{html.escape(report)[:4000]}</pre>", parse_mode="HTML")
+
+    async def _cmd_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /search слова — поиск по истории сообщений, постранично (только админ)"""
+        try:
+            self.stats["commands_processed"] += 1
+            if not self._is_admin(update) or not self.on_search_callback:
+                return
+
+            query = " ".join(context.args or []).strip()
+            if not query:
+                await update.message.reply_text("🔎 Использование: /search слова\nИщутся сообщения, где есть все слова; ключ* — по началу слова")
+                return
+            self.searches[update.effective_user.id] = {"query": query, "cursors": [None]}
+            text, keyboard = await self._search_page(update.effective_user.id, 0)
+            await update.message.reply_text(text, parse_mode="HTML", reply_markup=keyboard)
+        except Exception as e:
+            logger.error(f"❌ Ошибка в _cmd_search: {e}", exc_info=True)
+            await update.message.reply_text(f"❌ Ошибка поиска: {e}")
+
+    async def _search_page(self, user_id, page):
+        """Страница результатов: пагинация по ключу (id последнего сообщения), без OFFSET"""
+        search = self.searches[user_id]
+        # Лишняя строка — признак, что есть следующая страница
+        results = await self.on_search_callback(
+            search["query"], limit=SEARCH_PAGE_SIZE + 1, before_id=search["cursors"][page]
+        )
+        has_next = len(results) > SEARCH_PAGE_SIZE
+        results = results[:SEARCH_PAGE_SIZE]
+        if has_next and len(search["cursors"]) == page + 1:
+            search["cursors"].append(results[-1].id)
+
+        if not results:
+            return f"🔎 По запросу <b>{html.escape(search['query'])}</b> ничего не найдено", None
+        lines = [f"🔎 <b>{html.escape(search['query'])}</b> — страница {page + 1}"]
+        for message in results:
+            when = message.timestamp.strftime("%d.%m.%Y %H:%M") if message.timestamp else "?"
+            author = "вы" if message.is_outgoing else message.author_username
+            lines.append(
+                f"\n<b>{html.escape(str(author))}</b> · чат <code>{message.chat_id}</code> · {when}\n"
+                f"{html.escape(_excerpt(message.text, search['query']))}"
+            )
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"search_{page - 1}"))
+        if has_next:
+            buttons.append(InlineKeyboardButton("Старше ➡️", callback_data=f"search_{page + 1}"))
+        return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def _cmd_templates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Команда /templates — доли срабатываний шаблонов за окна (только админ)"""
+        try:
+            self.stats["commands_processed"] += 1
+            if not self._is_admin(update) or not self.on_templates_callback:
+                return
+
+            checks, templates = await self.on_templates_callback()
+            if not templates:
+                await update.message.reply_text("📋 Шаблонов нет")
+                return
+            windows = " / ".join(label for label, _ in REPORT_WINDOWS)
+            lines = [
+                f"📋 <b>Шаблоны</b>: срабатывания за {windows}",
+                f"Проверено сообщений: <b>{' / '.join(str(count) for count in checks)}</b>",
+            ]
+            for template in templates:
+                if not template["is_active"]:
+                    mark = "⏸"
+                elif not template["matches"][-1]:
+                    mark = "💤"
+                else:
+                    mark = "✅"
+                last_used = template["last_used_at"].strftime("%d.%m.%Y %H:%M UTC") if template["last_used_at"] else "никогда"
+                rates = " / ".join(f"{rate:.1%}" for rate in template["rates"])
+                lines.append(
+                    f"\n{mark} <b>{html.escape(template['name'])}</b> (id {template['id']})\n"
+                    f"{' / '.join(str(count) for count in template['matches'])} · {rates} · "
+                    f"всего {template['use_count']} · последнее: {last_used}"
+                )
+            text = "\n".join(lines)
+            if len(text) > 4000:
+                text = text[:4000].rsplit("\n", 1)[0] + "\n…"
+            await update.message.reply_text(text, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"❌ Ошибка в _cmd_templates: {e}", exc_info=True)
+            await update.message.reply_text(f"❌ Ошибка статистики шаблонов: {e}")
+
+    def _latency_summary(self):
+        """Задержки из реестра метрик: p50/p99 по каждой гистограмме"""
+        lines = []
+        for name, value in metrics.summary().items():
+            if not isinstance(value, dict):
+                continue
+            short_name = name.replace("funpaybot_", "").replace("_seconds", "")
+            lines.append(
+                f"• {short_name}: p50 <b>{value['p50'] * 1000:.1f}</b> мс, "
+                f"p99 <b>{value['p99'] * 1000:.1f}</b> мс (n={value['count']})"
+            )
+        if not lines:
+            return ""
+        return "\n\n⏱️ <b>Задержки</b>\n" + "\n".join(lines)
+
     async def _button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка нажатий кнопок"""
         query = update.callback_query
         await query.answer()
         
         try:
+            # На дайджест уже отреагировали — новые сообщения пойдут отдельным уведомлением
+            self.notifier.close_digest(query.message.message_id)
+
             if query.data.startswith("reply_"):
                 chat_id = int(query.data.split("_")[1])
                 self.awaiting_reply[query.from_user.id] = chat_id
@@ -114,6 +312,15 @@ class TelegramBot:
                     parse_mode="HTML"
                 )
                 
+            elif query.data.startswith("search_"):
+                page = int(query.data.split("_")[1])
+                search = self.searches.get(query.from_user.id)
+                if not search or page >= len(search["cursors"]):
+                    await query.edit_message_text("⌛ Поиск устарел, повторите /search")
+                    return
+                text, keyboard = await self._search_page(query.from_user.id, page)
+                await query.edit_message_text(text=text, parse_mode="HTML", reply_markup=keyboard)
+
             elif query.data == "skip":
                 await query.edit_message_text(
                     text=query.message.text + "\n\n⏭️ <b>Пропущено.</b>",
@@ -153,32 +360,21 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"❌ Ошибка в _handle_message: {e}", exc_info=True)
 
-    async def send_message_notification(self, chat_id, username, text, timestamp=None):
-        """Отправка уведомления о новом сообщении с кнопками"""
+    async def send_message_notification(self, chat_id, username, text, timestamp=None, received_at=None):
+        """Уведомление о новом сообщении с кнопками (подряд идущие складываются в дайджест)"""
         try:
             if not self.app:
                 logger.error("❌ Бот не инициализирован")
                 return
-            
-            notification = (
-                f"💬 <b>Новое сообщение от {username}</b>\n\n"
-                f"<b>Сообщение:</b>\n{text[:500]}"
-            )
-            
+
             keyboard = InlineKeyboardMarkup([
                 [
                     InlineKeyboardButton("✍️ Ответить", callback_data=f"reply_{chat_id}"),
                     InlineKeyboardButton("⏭️ Пропустить", callback_data="skip")
                 ]
             ])
-            
-            await self.app.bot.send_message(
-                chat_id=self.admin_id, 
-                text=notification,
-                parse_mode="HTML",
-                reply_markup=keyboard
-            )
-            
+
+            self.notifier.notify_message(chat_id, str(username), text, reply_markup=keyboard, received_at=received_at)
             self.stats["notifications_sent"] += 1
         except Exception as e:
             logger.error(f"❌ Ошибка отправки уведомления: {e}")
@@ -193,11 +389,22 @@ class TelegramBot:
             price_str = f"{price:.2f} ₽" if price else "не указана"
             notification = f"🛒 <b>Новый заказ!</b>\n\n<b>ID:</b> {order_id}\n<b>Покупатель:</b> {buyer_username}\n<b>Описание:</b> {description}\n<b>Цена:</b> {price_str}"
             
-            await self.app.bot.send_message(
-                chat_id=self.admin_id, 
-                text=notification,
-                parse_mode="HTML"
-            )
+            self.notifier.notify(notification)
             self.stats["notifications_sent"] += 1
         except Exception as e:
             logger.error(f"❌ Ошибка отправки уведомления о заказе: {e}")
+
+    def get_stats(self):
+        return {**self.stats, "notifier": self.notifier.get_stats()}
+
+
+def _excerpt(text, query):
+    """Фрагмент текста вокруг первого совпавшего слова запроса"""
+    if len(text) <= SEARCH_EXCERPT_LENGTH:
+        return text
+    lowered = text.lower()
+    positions = [lowered.find(word.lower().rstrip("*")) for word in query.split()]
+    position = min((p for p in positions if p >= 0), default=0)
+    start = max(0, min(position - SEARCH_EXCERPT_LENGTH // 4, len(text) - SEARCH_EXCERPT_LENGTH))
+    fragment = text[start:start + SEARCH_EXCERPT_LENGTH]
+    return ("…" if start else "") + fragment + ("…" if start + SEARCH_EXCERPT_LENGTH < len(text) else "")
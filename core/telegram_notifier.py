@@ -0,0 +1,294 @@
+"""
+core/telegram_notifier.py — планировщик исходящих уведомлений Telegram.
+
+Все уведомления проходят через одну очередь с лимитами Telegram (на чат и
+общий). Сообщения одного чата FunPay, пришедшие подряд в пределах окна,
+складываются в дайджест: первое отправляется новым сообщением, следующие
+дописываются в него через edit_message_text. Ответ 429 (RetryAfter) не
+теряет уведомление — оно ждет указанное время и отправляется снова.
+"""
+import asyncio
+import html
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from utils.metrics import EVENT_TO_NOTIFICATION
+from utils.rate_limiter import TokenBucket
+
+logger = logging.getLogger("FunPayBot.TelegramNotifier")
+
+TELEGRAM_MAX_TEXT = 4096
+LINE_PREVIEW = 500
+FINAL_HEADER = "🛑 <b>Бот останавливается</b> — не показанные уведомления:"
+
+
+class Digest:
+    def __init__(self, key, chat_id, username, reply_markup):
+        self.key = key
+        self.chat_id = chat_id
+        self.username = username
+        self.reply_markup = reply_markup
+        self.lines = []
+        self.message_id = None
+        self.updated = time.monotonic()
+        self.attempts = 0
+        self.pending_since = None  # получение самого раннего еще не показанного сообщения
+
+    def render(self):
+        header = f"💬 <b>Новое сообщение от {html.escape(self.username)}</b>"
+        if len(self.lines) > 1:
+            header = f"💬 <b>Сообщения от {html.escape(self.username)}</b> ({len(self.lines)})"
+        body = "\n".join(self.lines)
+        # Дайджест не должен выходить за лимит Telegram: старые строки отрезаем
+        while len(header) + len(body) + 32 > TELEGRAM_MAX_TEXT and "\n" in body:
+            body = body.split("\n", 1)[1]
+        return f"{header}\n\n<b>Сообщение:</b>\n{body}"
+
+
+class PlainNotification:
+    def __init__(self, key, text, reply_markup=None):
+        self.key = key
+        self.text = text
+        self.reply_markup = reply_markup
+        self.attempts = 0
+
+
+class TelegramNotifier:
+    def __init__(self, admin_id, digest_window=30.0, max_digest_lines=20,
+                 chat_rate=1.0, global_rate=30.0, max_attempts=3, max_open_digests=1000):
+        self.admin_id = admin_id
+        self.digest_window = digest_window
+        self.max_digest_lines = max_digest_lines
+        self.max_attempts = max_attempts
+        self.max_open_digests = max_open_digests
+        self.chat_bucket = TokenBucket(chat_rate) if chat_rate > 0 else None
+        self.global_bucket = TokenBucket(global_rate) if global_rate > 0 else None
+
+        self.bot = None
+        self.digests = {}  # chat_id FunPay -> открытый дайджест
+        self.digests_by_message = {}  # message_id Telegram -> дайджест
+        self.pending = OrderedDict()  # ключ -> Digest | PlainNotification
+        self.current = None  # взят воркером из pending, но еще не доставлен
+        self.has_pending = asyncio.Event()
+        self.keys = itertools.count()
+        self.task = None
+        self.stats = {
+            "notifications": 0, "folded": 0, "sent": 0, "edited": 0,
+            "retry_after": 0, "errors": 0, "dropped": 0
+        }
+
+    def start(self, bot):
+        self.bot = bot
+        if self.task is None:
+            self.task = asyncio.create_task(self._worker())
+            logger.info(f"✓ Планировщик уведомлений запущен (окно дайджеста={self.digest_window}s)")
+
+    async def stop(self, timeout=5.0):
+        """Остановка: timeout секунд очередь разбирается как обычно, остаток уходит итоговой сводкой"""
+        if self.task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        # Прерванная доставка могла не дойти — лучше показать дважды, чем потерять
+        if self.current is not None:
+            self.pending[self.current.key] = self.current
+            self.pending.move_to_end(self.current.key, last=False)
+            self.current = None
+        if self.pending:
+            await self._flush_final()
+
+    async def _flush_final(self):
+        """Всё недоставленное — одним-двумя сообщениями вместо запроса на каждый чат:
+        при лимите Telegram на чат админа это укладывается в секунды"""
+        items = list(self.pending.values())
+        self.pending.clear()
+        chunks = []  # [текст, число уведомлений]
+        for item in items:
+            block = item.text if isinstance(item, PlainNotification) else item.render()
+            if len(FINAL_HEADER) + 2 + len(block) > TELEGRAM_MAX_TEXT:
+                # Не режем HTML посередине: длинный блок уходит отдельным сообщением
+                chunks.append([block, 1])
+            elif chunks and chunks[-1][0].startswith(FINAL_HEADER) and len(chunks[-1][0]) + 2 + len(block) <= TELEGRAM_MAX_TEXT:
+                chunks[-1][0] = f"{chunks[-1][0]}\n\n{block}"
+                chunks[-1][1] += 1
+            else:
+                chunks.append([f"{FINAL_HEADER}\n\n{block}", 1])
+
+        lost = 0
+        for chunk, count in chunks:
+            await self._wait_limits()
+            try:
+                try:
+                    await self.bot.send_message(chat_id=self.admin_id, text=chunk, parse_mode="HTML")
+                except RetryAfter as e:
+                    delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                    await asyncio.sleep(delay)
+                    await self.bot.send_message(chat_id=self.admin_id, text=chunk, parse_mode="HTML")
+                self.stats["sent"] += 1
+            except Exception as e:
+                self.stats["errors"] += 1
+                lost += count
+                logger.error(f"❌ Итоговая сводка уведомлений не отправлена: {e}")
+        if lost:
+            self.stats["dropped"] += lost
+            logger.error(f"❌ Потеряно уведомлений при остановке: {lost} из {len(items)}")
+        else:
+            logger.info(f"✓ Недоставленные уведомления ({len(items)}) отправлены сводкой при остановке")
+
+    def notify_message(self, chat_id, username, text, reply_markup=None, received_at=None):
+        """Сообщение из чата FunPay: дописывается в открытый дайджест или открывает новый"""
+        self.stats["notifications"] += 1
+        now = time.monotonic()
+        digest = self.digests.get(chat_id)
+        if (digest is None
+                or now - digest.updated > self.digest_window
+                or len(digest.lines) >= self.max_digest_lines):
+            if digest is not None and digest.message_id is not None:
+                self.digests_by_message.pop(digest.message_id, None)
+            digest = Digest(f"digest_{next(self.keys)}", chat_id, username, reply_markup)
+            self.digests[chat_id] = digest
+            if len(self.digests) > self.max_open_digests:
+                self._prune(now)
+        else:
+            self.stats["folded"] += 1
+        digest.lines.append(html.escape(text[:LINE_PREVIEW]))
+        digest.updated = now
+        if digest.pending_since is None:
+            digest.pending_since = received_at or now
+        self._schedule(digest)
+
+    def notify(self, text, reply_markup=None):
+        """Отдельное уведомление (заказы и т.п.), без склейки"""
+        self.stats["notifications"] += 1
+        self._schedule(PlainNotification(f"plain_{next(self.keys)}", text, reply_markup))
+
+    def close_digest(self, message_id):
+        """Дайджест, на который уже отреагировали кнопкой, больше не дописываем"""
+        digest = self.digests_by_message.pop(message_id, None)
+        if digest is not None and self.digests.get(digest.chat_id) is digest:
+            del self.digests[digest.chat_id]
+
+    def _prune(self, now):
+        for chat_id, digest in list(self.digests.items()):
+            if now - digest.updated > self.digest_window:
+                del self.digests[chat_id]
+                if digest.message_id is not None:
+                    self.digests_by_message.pop(digest.message_id, None)
+
+    def _schedule(self, item):
+        # Повторная постановка дайджеста не плодит запросы: в очереди он один
+        self.pending[item.key] = item
+        self.has_pending.set()
+
+    async def _worker(self):
+        while True:
+            await self.has_pending.wait()
+            if not self.pending:
+                self.has_pending.clear()
+                continue
+            key, item = self.pending.popitem(last=False)
+            self.current = item
+            await self._wait_limits()
+            try:
+                await self._deliver(item)
+                item.attempts = 0
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                logger.warning(f"⏳ Telegram просит подождать {delay:.0f}s (429)")
+                self._requeue(item)
+                await asyncio.sleep(delay)
+            except NetworkError as e:
+                # BadRequest — тоже NetworkError в PTB, но повторять его бессмысленно
+                self.stats["errors"] += 1
+                if isinstance(e, BadRequest) or not self._retry(item):
+                    self.stats["dropped"] += 1
+                    logger.error(f"❌ Уведомление не отправлено: {e}")
+                else:
+                    logger.warning(f"⚠️ Ошибка сети Telegram, повтор: {e}")
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["dropped"] += 1
+                logger.error(f"❌ Ошибка отправки уведомления: {e}", exc_info=True)
+            self.current = None
+
+    async def _wait_limits(self):
+        if self.chat_bucket:
+            await self.chat_bucket.acquire()
+        if self.global_bucket:
+            await self.global_bucket.acquire()
+
+    async def _deliver(self, item):
+        if isinstance(item, PlainNotification):
+            await self.bot.send_message(
+                chat_id=self.admin_id, text=item.text, parse_mode="HTML", reply_markup=item.reply_markup
+            )
+            self.stats["sent"] += 1
+            return
+
+        text = item.render()
+        rendered_lines = len(item.lines)
+        if item.message_id is None:
+            message = await self.bot.send_message(
+                chat_id=self.admin_id, text=text, parse_mode="HTML", reply_markup=item.reply_markup
+            )
+            item.message_id = message.message_id
+            self.digests_by_message[item.message_id] = item
+            self.stats["sent"] += 1
+            self._shown(item, rendered_lines)
+            return
+
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.admin_id, message_id=item.message_id, text=text,
+                parse_mode="HTML", reply_markup=item.reply_markup
+            )
+            self.stats["edited"] += 1
+            self._shown(item, rendered_lines)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            # Сообщение удалено или слишком старое для правки — шлем новым
+            logger.debug(f"Дайджест не отредактирован ({e}), отправляем заново")
+            self.digests_by_message.pop(item.message_id, None)
+            item.message_id = None
+            self._requeue(item)
+
+    def _shown(self, digest, rendered_lines):
+        if digest.pending_since is not None:
+            EVENT_TO_NOTIFICATION.observe(time.monotonic() - digest.pending_since)
+        # Строки, дописанные во время запроса, еще не показаны
+        digest.pending_since = digest.updated if len(digest.lines) > rendered_lines else None
+
+    def _requeue(self, item):
+        self.pending[item.key] = item
+        self.pending.move_to_end(item.key, last=False)
+        self.has_pending.set()
+
+    def _retry(self, item):
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            return False
+        self._requeue(item)
+        return True
+
+    def get_stats(self):
+        api_calls = self.stats["sent"] + self.stats["edited"]
+        return {
+            **self.stats,
+            "api_calls": api_calls,
+            "pending": len(self.pending),
+            "open_digests": len(self.digests)
+        }
@@ -0,0 +1,215 @@
+"""
+database/archive.py — вынос старых сообщений в помесячные архивные БД.
+
+Сообщения старше max_age_days пачками переносятся из messages в файлы
+archive/messages_YYYY_MM.db (текст по желанию сжат zlib) и удаляются из
+основной БД. Сначала архив коммитится, потом строки удаляются, поэтому
+падение посередине дает только повторный перенос (INSERT OR IGNORE по id).
+Освободившиеся страницы возвращаются ОС через incremental_vacuum
+небольшими шагами, чтобы не держать запись надолго.
+
+Архив читается через тот же Database API (include_archive=True).
+"""
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from .models import Message
+
+logger = logging.getLogger("FunPayBot.Archive")
+
+ARCHIVE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    message_id TEXT,
+    author_id INTEGER NOT NULL,
+    author_username TEXT,
+    text BLOB NOT NULL,
+    compressed BOOLEAN DEFAULT 0,
+    is_outgoing BOOLEAN DEFAULT 0,
+    timestamp TIMESTAMP,
+    delivered BOOLEAN DEFAULT 1,
+    message_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_archive_chat ON messages(chat_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_archive_hash ON messages(message_hash);
+"""
+
+
+class MessageArchive:
+    def __init__(self, database, directory="archive", max_age_days=0, compress=True,
+                 batch_size=1000, interval=3600, vacuum_pages=1000):
+        self.db = database
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.compress = compress
+        self.batch_size = batch_size
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.task = None
+        self.stats = {"archived": 0, "runs": 0, "vacuumed_pages": 0, "errors": 0, "last_run": None}
+
+    @property
+    def enabled(self):
+        return self.max_age_days > 0
+
+    async def start(self):
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.task = asyncio.create_task(self._background_loop())
+        logger.info(f"✓ Архивация сообщений: старше {self.max_age_days} дн. -> {self.directory}/ "
+                    f"(сжатие: {'да' if self.compress else 'нет'})")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _background_loop(self):
+        # Однократный перевод старой БД на incremental auto_vacuum (полный VACUUM)
+        try:
+            await self.db.ensure_incremental_vacuum()
+        except Exception as e:
+            logger.error(f"Ошибка перевода БД на incremental_vacuum: {e}")
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Ошибка архивации сообщений: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Перенести всё, что старше порога, и вернуть место; возвращает число перенесенных строк"""
+        moved = 0
+        max_age_seconds = self.max_age_days * 86400
+        while True:
+            rows = await self.db.get_messages_older_than(max_age_seconds, self.batch_size)
+            if not rows:
+                break
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(_month_of(row[7]), []).append(row)
+            for month, month_rows in by_month.items():
+                await asyncio.to_thread(self._write, month, month_rows)
+            await self.db.delete_messages([row[0] for row in rows], {row[1] for row in rows})
+            moved += len(rows)
+            if len(rows) < self.batch_size:
+                break
+            await asyncio.sleep(0)  # не занимаем писателя подряд
+
+        if moved:
+            logger.info(f"📦 В архив перенесено сообщений: {moved}")
+        self.stats["archived"] += moved
+        self.stats["runs"] += 1
+        self.stats["last_run"] = datetime.now().isoformat(timespec="seconds")
+        await self.vacuum()
+        return moved
+
+    async def vacuum(self):
+        """Вернуть свободные страницы по vacuum_pages за шаг"""
+        while True:
+            freed, remaining = await self.db.incremental_vacuum(self.vacuum_pages)
+            self.stats["vacuumed_pages"] += freed
+            if not remaining or not freed:
+                break
+            await asyncio.sleep(0.05)
+
+    # --- Файлы архива ---
+
+    def _path(self, month):
+        return os.path.join(self.directory, f"messages_{month}.db")
+
+    def months(self):
+        """Месяцы с архивом, от новых к старым"""
+        files = glob.glob(os.path.join(self.directory, "messages_*.db"))
+        return sorted((os.path.basename(path)[len("messages_"):-3] for path in files), reverse=True)
+
+    def _write(self, month, rows):
+        connection = sqlite3.connect(self._path(month), timeout=30)
+        try:
+            connection.executescript(ARCHIVE_SCHEMA_SQL)
+            connection.execute("PRAGMA synchronous = FULL")  # архив должен быть на диске до удаления из основной БД
+            connection.executemany(
+                """INSERT OR IGNORE INTO messages (id, chat_id, message_id, author_id, author_username, text,
+                compressed, is_outgoing, timestamp, delivered, message_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(row[0], row[1], row[2], row[3], row[4], *self._pack(row[5]), row[6], row[7], row[8], row[9])
+                 for row in rows]
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _pack(self, text):
+        if not self.compress:
+            return text, False
+        return zlib.compress(text.encode("utf-8"), 6), True
+
+    def _read(self, month, sql, params):
+        uri = Path(self._path(month)).absolute().as_uri() + "?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, timeout=30)
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    # --- Чтение ---
+
+    async def get_chat_messages(self, chat_id, limit=50):
+        """Сообщения чата из архива, от новых к старым"""
+        return await asyncio.to_thread(self._get_chat_messages, chat_id, limit)
+
+    def _get_chat_messages(self, chat_id, limit):
+        messages = []
+        for month in self.months():
+            rows = self._read(
+                month,
+                """SELECT id, chat_id, message_id, author_id, author_username, text, compressed,
+                is_outgoing, timestamp, delivered, message_hash
+                FROM messages WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?""",
+                (chat_id, limit - len(messages))
+            )
+            messages.extend(_to_message(row) for row in rows)
+            if len(messages) >= limit:
+                break
+        return messages
+
+    async def message_exists_by_hash(self, message_hash):
+        return await asyncio.to_thread(self._message_exists_by_hash, message_hash)
+
+    def _message_exists_by_hash(self, message_hash):
+        return any(
+            self._read(month, "SELECT 1 FROM messages WHERE message_hash = ? LIMIT 1", (message_hash,))
+            for month in self.months()
+        )
+
+    def get_stats(self):
+        return {**self.stats, "enabled": self.enabled, "months": len(self.months())}
+
+
+def _month_of(timestamp):
+    # CURRENT_TIMESTAMP: "YYYY-MM-DD HH:MM:SS"
+    return str(timestamp)[:7].replace("-", "_")
+
+
+def _to_message(row):
+    text = zlib.decompress(row[5]).decode("utf-8") if row[6] else row[5]
+    return Message(
+        id=row[0], chat_id=row[1], message_id=row[2],
+        author_id=row[3], author_username=row[4], text=text,
+        is_outgoing=bool(row[7]),
+        timestamp=datetime.fromisoformat(row[8]) if row[8] else None,
+        delivered=bool(row[9]), message_hash=row[10]
+    )
@@ -0,0 +1,78 @@
+"""
+database/counters.py — счетчики сообщений и заказов пользователей в памяти.
+
+add_message/add_order не обновляют users на каждую строку: приращения
+копятся здесь по funpay_user_id и раз в flush_interval секунд (и при
+остановке) записываются одним пакетным UPSERT. Горячая строка (например,
+funpay_user_id=0, куда сейчас пишутся все заказы) обновляется один раз за
+период, а не на каждое событие. Незаписанные приращения учитываются при
+чтении (Database.get_user), поэтому значения видны сразу.
+"""
+import logging
+
+from utils.periodic import PeriodicFlusher
+
+logger = logging.getLogger("FunPayBot.UserCounters")
+
+
+class UserCounters(PeriodicFlusher):
+    flush_error = "Ошибка записи счетчиков пользователей"
+
+    def __init__(self, database, flush_interval=5.0):
+        super().__init__(flush_interval, logger)
+        self.db = database
+        # funpay_user_id -> [сообщений, заказов, последний username]
+        self.pending = {}
+        # Пачка, которая сейчас пишется: до коммита тоже считается незаписанной
+        self.flushing = {}
+        self.stats = {"increments": 0, "flushes": 0, "rows_flushed": 0, "errors": 0}
+
+    def add(self, user_id, username, messages=0, orders=0):
+        self._merge(user_id, username, messages, orders)
+        self.stats["increments"] += 1
+
+    def _merge(self, user_id, username, messages, orders):
+        entry = self.pending.get(user_id)
+        if entry is None:
+            self.pending[user_id] = [messages, orders, username]
+        else:
+            entry[0] += messages
+            entry[1] += orders
+            if username:
+                entry[2] = username
+
+    def get(self, user_id):
+        """Еще не записанные приращения пользователя: (сообщений, заказов)"""
+        messages = orders = 0
+        for source in (self.flushing, self.pending):
+            entry = source.get(user_id)
+            if entry:
+                messages += entry[0]
+                orders += entry[1]
+        return messages, orders
+
+    async def flush(self):
+        """Записать накопленное; возвращает число обновленных пользователей"""
+        if not self.pending or self.flushing:
+            return 0
+        self.flushing, self.pending = self.pending, {}
+        rows = [
+            (user_id, username or "", messages, orders)
+            for user_id, (messages, orders, username) in self.flushing.items()
+        ]
+        try:
+            await self.db.apply_user_counters(rows)
+        except Exception:
+            # Приращения не теряем: вернутся в следующую запись
+            self.stats["errors"] += 1
+            for user_id, (messages, orders, username) in self.flushing.items():
+                self._merge(user_id, username, messages, orders)
+            raise
+        finally:
+            self.flushing = {}
+        self.stats["flushes"] += 1
+        self.stats["rows_flushed"] += len(rows)
+        return len(rows)
+
+    def get_stats(self):
+        return {**self.stats, "pending_users": len(self.pending)}
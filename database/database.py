@@ -1,17 +1,60 @@
 import aiosqlite
+import asyncio
+import functools
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, List
 from .models import CREATE_TABLES_SQL, User, Message, Order, Template
+from .write_buffer import WriteBehindBuffer
+from .history_cache import ChatHistoryCache
+from .reader_pool import ReaderPool, is_read_query
+from .archive import MessageArchive
+from .search import MessageSearchIndex, match_query
+from .counters import UserCounters
+from .migrations import Migrator
 from config import Config
+from utils.metrics import DB_STATEMENT_TIME, timed
 
 logger = logging.getLogger("FunPayBot.Database")
 
+
+def db_timed(func):
+    """Время операции в funpaybot_db_statement_seconds{op=<имя метода>}"""
+    return timed(DB_STATEMENT_TIME.labels(func.__name__))(func)
+
+
 class Database:
-    def __init__(self, db_path="database.db"):
+    def __init__(self, db_path="database.db", write_behind=None):
         self.db_path = db_path
         self.connection = None
         self.timeout = Config.DB_TIMEOUT  # Критично для sqlite под нагрузкой
+        self.write_behind = Config.DB_WRITE_BEHIND if write_behind is None else write_behind
+        self.write_buffer = None
+        self.write_lock = asyncio.Lock()  # Одна транзакция на соединение: пишем по очереди
+        self.readers = None  # пул read-only соединений; None — читаем через писателя
+        self.archive = MessageArchive(
+            self,
+            directory=Config.ARCHIVE_DIR,
+            max_age_days=Config.ARCHIVE_AFTER_DAYS,
+            compress=Config.ARCHIVE_COMPRESS,
+            batch_size=Config.ARCHIVE_BATCH_SIZE,
+            interval=Config.ARCHIVE_INTERVAL,
+            vacuum_pages=Config.ARCHIVE_VACUUM_PAGES
+        )
+        self.search_index = MessageSearchIndex(
+            self,
+            batch_size=Config.SEARCH_BACKFILL_BATCH,
+            pause=Config.SEARCH_BACKFILL_PAUSE,
+            merge_interval=Config.SEARCH_MERGE_INTERVAL
+        )
+        self.counters = UserCounters(self, flush_interval=Config.USER_COUNTERS_FLUSH_INTERVAL)
+        self.history_cache = None
+        if Config.HISTORY_CACHE_CHATS > 0:
+            self.history_cache = ChatHistoryCache(
+                max_chats=Config.HISTORY_CACHE_CHATS,
+                max_messages=Config.HISTORY_CACHE_MESSAGES,
+                ring_size=Config.HISTORY_CACHE_RING_SIZE
+            )
 
     async def connect(self):
         try:
@@ -20,13 +63,41 @@ class Database:
                 timeout=self.timeout  # Увеличенный таймаут против "database is locked"
             )
             await self.connection.execute("PRAGMA foreign_keys = ON")
-            await self.connection.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging для конкурентности
+            await self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")  # действует для новой БД
+            cursor = await self.connection.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging для конкурентности
+            # PRAGMA возвращает строку: недочитанный курсор держит старый снимок чтения,
+            # и запись после коммита другого соединения получает "database is locked"
+            await cursor.close()
+            if Config.DB_READ_POOL_SIZE > 0 and self.db_path != ":memory:":
+                # Писатель — одно соединение, чтения — параллельно на своих (WAL это позволяет)
+                self.readers = ReaderPool(self.db_path, size=Config.DB_READ_POOL_SIZE, timeout=self.timeout)
+                await self.readers.open()
+            self.counters.start()
+            if self.write_behind:
+                self.write_buffer = WriteBehindBuffer(
+                    self.connection,
+                    self.write_lock,
+                    max_rows=Config.DB_FLUSH_MAX_ROWS,
+                    flush_interval=Config.DB_FLUSH_INTERVAL_MS / 1000,
+                    counters=self.counters
+                )
+                self.write_buffer.start()
             logger.info(f"✓ Подключение к БД: {self.db_path} (timeout={self.timeout}s)")
         except Exception as e:
             logger.error(f"✗ Ошибка подключения к БД: {e}")
             raise
 
     async def disconnect(self):
+        if self.write_buffer:
+            await self.write_buffer.stop()
+            self.write_buffer = None
+        try:
+            await self.counters.stop()  # после буфера: его сброс тоже добавляет приращения
+        except Exception as e:
+            logger.error(f"⚠️ Счетчики пользователей не записаны: {e}")
+        if self.readers:
+            await self.readers.close()
+            self.readers = None
         if self.connection:
             await self.connection.close()
             logger.info("✓ БД закрыта")
@@ -35,66 +106,162 @@ class Database:
         try:
             await self.connection.executescript(CREATE_TABLES_SQL)
             await self.connection.commit()
-            logger.info("✓ Схема БД инициализирована")
+            version = await Migrator(self.connection, self.write_lock).migrate()
+            logger.info(f"✓ Схема БД инициализирована (версия {version})")
         except Exception as e:
             logger.error(f"✗ Ошибка инициализации схемы БД: {e}")
             raise
 
-    async def message_exists_by_hash(self, message_hash: str) -> bool:
+    async def _fetchall(self, sql, params=()):
+        """Выборка: SELECT уходит в пул чтения, остальное — на соединение писателя"""
+        if self.readers and is_read_query(sql):
+            return await self.readers.fetchall(sql, params)
+        cursor = await self.connection.execute(sql, params)
+        return await cursor.fetchall()
+
+    async def _fetchone(self, sql, params=()):
+        if self.readers and is_read_query(sql):
+            return await self.readers.fetchone(sql, params)
+        cursor = await self.connection.execute(sql, params)
+        return await cursor.fetchone()
+
+    @db_timed
+    async def message_exists_by_hash(self, message_hash: str, include_archive=False) -> bool:
         """Проверка дубликата по хэшу (КРИТИЧНО)"""
+        if self.write_buffer and self.write_buffer.has_pending_hash(message_hash):
+            return True
         try:
-            cursor = await self.connection.execute(
+            row = await self._fetchone(
                 "SELECT 1 FROM messages WHERE message_hash = ? LIMIT 1",
                 (message_hash,)
             )
-            row = await cursor.fetchone()
+            if row is None and include_archive:
+                return await self.archive.message_exists_by_hash(message_hash)
             return row is not None
         except Exception as e:
             logger.error(f"Ошибка проверки message_hash: {e}")
             return False
 
-    async def add_or_update_user(self, funpay_user_id, username):
-        try:
+    @db_timed
+    async def message_hash_active(self, message_hash, now) -> bool:
+        row = await self._fetchone(
+            "SELECT 1 FROM message_hashes WHERE message_hash = ? AND expires_at > ? LIMIT 1",
+            (message_hash, now)
+        )
+        return row is not None
+
+    @db_timed
+    async def load_message_hashes(self, now):
+        return await self._fetchall(
+            "SELECT message_hash, expires_at FROM message_hashes WHERE expires_at > ? ORDER BY expires_at",
+            (now,)
+        )
+
+    @db_timed
+    async def save_message_hashes(self, rows):
+        """rows: список (message_hash, chat_id, expires_at)"""
+        async with self.write_lock:
+            await self.connection.executemany(
+                """INSERT INTO message_hashes (message_hash, chat_id, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(message_hash) DO UPDATE SET expires_at = excluded.expires_at""",
+                rows
+            )
+            await self.connection.commit()
+
+    @db_timed
+    async def delete_expired_message_hashes(self, now, batch_size=500):
+        async with self.write_lock:
             cursor = await self.connection.execute(
-                """INSERT INTO users (funpay_user_id, username, last_seen)
-                VALUES (?, ?, ?)
-                ON CONFLICT(funpay_user_id) DO UPDATE SET
-                    username = excluded.username,
-                    last_seen = excluded.last_seen
-                RETURNING id""",
-                (funpay_user_id, username, datetime.now())
+                """DELETE FROM message_hashes WHERE id IN (
+                    SELECT id FROM message_hashes WHERE expires_at <= ? LIMIT ?
+                )""",
+                (now, batch_size)
             )
-            row = await cursor.fetchone()
             await self.connection.commit()
+        return cursor.rowcount
+
+    @db_timed
+    async def add_or_update_user(self, funpay_user_id, username):
+        try:
+            async with self.write_lock:
+                cursor = await self.connection.execute(
+                    """INSERT INTO users (funpay_user_id, username, last_seen)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(funpay_user_id) DO UPDATE SET
+                        username = excluded.username,
+                        last_seen = excluded.last_seen
+                    RETURNING id""",
+                    (funpay_user_id, username, datetime.now())
+                )
+                row = await cursor.fetchone()
+                await self.connection.commit()
             return row[0] if row else None
         except Exception as e:
             logger.error(f"Ошибка add_or_update_user: {e}")
             raise
 
+    @db_timed
+    async def get_user(self, funpay_user_id) -> Optional[User]:
+        """Пользователь со счетчиками с учетом еще не записанных приращений"""
+        row = await self._fetchone("SELECT * FROM users WHERE funpay_user_id = ?", (funpay_user_id,))
+        messages, orders = self.counters.get(funpay_user_id)
+        if row is None:
+            if not messages and not orders:
+                return None
+            return User(funpay_user_id=funpay_user_id, total_messages=messages, total_orders=orders)
+        return User(
+            id=row[0], funpay_user_id=row[1], username=row[2],
+            first_seen=datetime.fromisoformat(row[3]) if row[3] else None,
+            last_seen=datetime.fromisoformat(row[4]) if row[4] else None,
+            total_messages=row[5] + messages, total_orders=row[6] + orders,
+            is_blocked=bool(row[7]), notes=row[8]
+        )
+
+    @db_timed
+    async def apply_user_counters(self, rows):
+        """rows: (funpay_user_id, username, +сообщений, +заказов); новые пользователи создаются"""
+        async with self.write_lock:
+            await self.connection.executemany(
+                """INSERT INTO users (funpay_user_id, username, total_messages, total_orders)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(funpay_user_id) DO UPDATE SET
+                    total_messages = total_messages + excluded.total_messages,
+                    total_orders = total_orders + excluded.total_orders""",
+                rows
+            )
+            await self.connection.commit()
+
+    @db_timed
     async def add_message(self, chat_id, author_id, author_username, text, is_outgoing=False, message_hash=None):
         """Добавление сообщения с проверкой дубликата"""
+        if self.write_buffer:
+            # Групповой коммит: ждем сброса буфера вместе с остальными писателями
+            row_id = await self.write_buffer.submit(
+                "message", (chat_id, author_id, author_username, text, is_outgoing, message_hash), message_hash
+            )
+            self._remember_message(row_id, chat_id, author_id, author_username, text, is_outgoing, message_hash)
+            return row_id
         try:
             # Дедупликация (КРИТИЧНО)
             if message_hash and await self.message_exists_by_hash(message_hash):
                 logger.debug(f"Дубликат сообщения игнорируется (hash: {message_hash[:8]}...)")
                 return None
 
-            cursor = await self.connection.execute(
-                """INSERT INTO messages (chat_id, author_id, author_username, text, is_outgoing, message_hash)
-                VALUES (?, ?, ?, ?, ?, ?)
-                RETURNING id""",
-                (chat_id, author_id, author_username, text, is_outgoing, message_hash)
-            )
-            row = await cursor.fetchone()
-            await self.connection.commit()
-
-            await self.connection.execute(
-                "UPDATE users SET total_messages = total_messages + 1 WHERE funpay_user_id = ?",
-                (author_id,)
-            )
-            await self.connection.commit()
+            async with self.write_lock:
+                cursor = await self.connection.execute(
+                    """INSERT INTO messages (chat_id, author_id, author_username, text, is_outgoing, message_hash)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    RETURNING id""",
+                    (chat_id, author_id, author_username, text, is_outgoing, message_hash)
+                )
+                row = await cursor.fetchone()
+                await self.connection.commit()
 
-            return row[0] if row else None
+            row_id = row[0] if row else None
+            if row_id is not None:
+                self.counters.add(author_id, author_username, messages=1)
+            self._remember_message(row_id, chat_id, author_id, author_username, text, is_outgoing, message_hash)
+            return row_id
         except aiosqlite.IntegrityError as e:
             logger.debug(f"Дубликат сообщения (IntegrityError): {e}")
             return None
@@ -102,59 +269,241 @@ class Database:
             logger.error(f"Ошибка add_message: {e}")
             raise
 
-    async def get_chat_messages(self, chat_id, limit=50):
-        cursor = await self.connection.execute(
-            "SELECT * FROM messages WHERE chat_id = ? ORDER BY timestamp DESC LIMIT ?",
-            (chat_id, limit)
-        )
-        rows = await cursor.fetchall()
-        messages = []
-        for row in rows:
-            messages.append(Message(
-                id=row[0], chat_id=row[1], message_id=row[2],
-                author_id=row[3], author_username=row[4], text=row[5],
-                is_outgoing=bool(row[6]),
-                timestamp=datetime.fromisoformat(row[7]) if row[7] else None,
-                delivered=bool(row[8]), message_hash=row[9]
+    async def enqueue_message(self, chat_id, author_id, author_username, text, is_outgoing=False, message_hash=None):
+        """Запись сообщения без ожидания коммита; возвращает Future с ID строки"""
+        if self.write_buffer:
+            future = self.write_buffer.submit(
+                "message", (chat_id, author_id, author_username, text, is_outgoing, message_hash), message_hash
+            )
+            future.add_done_callback(functools.partial(
+                self._remember_flushed, (chat_id, author_id, author_username, text, is_outgoing, message_hash)
             ))
+            return future
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(await self.add_message(chat_id, author_id, author_username, text, is_outgoing, message_hash))
+        return future
+
+    def _remember_message(self, row_id, chat_id, author_id, author_username, text, is_outgoing, message_hash):
+        """Write-through в кэш истории; timestamp — как CURRENT_TIMESTAMP в SQLite (UTC, до секунды)"""
+        if self.history_cache is None or row_id is None:
+            return
+        self.history_cache.append(Message(
+            id=row_id, chat_id=chat_id, author_id=author_id, author_username=author_username,
+            text=text, is_outgoing=bool(is_outgoing),
+            timestamp=datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0),
+            message_hash=message_hash
+        ))
+
+    def _remember_flushed(self, message_args, future):
+        if not future.cancelled() and future.exception() is None:
+            self._remember_message(future.result(), *message_args)
+
+    @db_timed
+    async def get_chat_messages(self, chat_id, limit=50, include_archive=False):
+        """Последние сообщения чата (от новых к старым); активные чаты — из памяти.
+
+        include_archive=True добирает недостающее до limit из помесячного архива.
+        """
+        messages = await self._get_recent_chat_messages(chat_id, limit)
+        if include_archive and len(messages) < limit:
+            messages.extend(await self.archive.get_chat_messages(chat_id, limit - len(messages)))
         return messages
 
-    async def add_order(self, order_id, buyer_id, buyer_username, description="", price=None):
-        try:
+    async def _get_recent_chat_messages(self, chat_id, limit):
+        if self.history_cache is not None:
+            cached = self.history_cache.get(chat_id, limit)
+            if cached is not None:
+                return cached
+            # Промах: читаем не меньше кольца, чтобы следующие запросы попадали в кэш
+            fetch = max(limit, self.history_cache.ring_size)
+            self.history_cache.begin_fill(chat_id)
+            try:
+                messages = await self._select_chat_messages(chat_id, fetch)
+            except BaseException:
+                self.history_cache.abort_fill(chat_id)
+                raise
+            self.history_cache.fill(chat_id, messages, complete=len(messages) < fetch)
+            return messages[:limit]
+        return await self._select_chat_messages(chat_id, limit)
+
+    async def _select_chat_messages(self, chat_id, limit):
+        rows = await self._fetchall(
+            "SELECT * FROM messages WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (chat_id, limit)
+        )
+        return [_row_to_message(row) for row in rows]
+
+    # --- Архивация (database/archive.py) ---
+
+    @db_timed
+    async def get_messages_older_than(self, max_age_seconds, limit):
+        """Самые старые сообщения старше max_age_seconds (строки messages целиком)"""
+        return await self._fetchall(
+            "SELECT * FROM messages WHERE timestamp < datetime('now', ?) ORDER BY timestamp LIMIT ?",
+            (f"-{int(max_age_seconds)} seconds", limit)
+        )
+
+    @db_timed
+    async def delete_messages(self, row_ids, chat_ids=()):
+        async with self.write_lock:
+            await self.connection.executemany(
+                "DELETE FROM messages WHERE id = ?",
+                [(row_id,) for row_id in row_ids]
+            )
+            await self.connection.commit()
+        if self.history_cache is not None:
+            for chat_id in chat_ids:
+                self.history_cache.invalidate(chat_id)
+
+    async def ensure_incremental_vacuum(self):
+        """Существующую БД перевести на auto_vacuum=INCREMENTAL (однократный полный VACUUM)"""
+        cursor = await self.connection.execute("PRAGMA auto_vacuum")
+        row = await cursor.fetchone()
+        if row and row[0] == 2:
+            return
+        logger.warning("⏳ Однократный VACUUM: перевод БД на incremental auto_vacuum (запись приостановлена)")
+        async with self.write_lock:
+            await self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await self.connection.execute("VACUUM")
+        logger.info("✓ БД переведена на incremental auto_vacuum")
+
+    @db_timed
+    async def incremental_vacuum(self, pages):
+        """Освободить до pages страниц; возвращает (освобождено, осталось свободных)"""
+        async with self.write_lock:
+            cursor = await self.connection.execute("PRAGMA freelist_count")
+            before = (await cursor.fetchone())[0]
+            if before:
+                cursor = await self.connection.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+                await cursor.fetchall()  # страницы освобождаются по мере чтения результата
+                await self.connection.commit()
+            cursor = await self.connection.execute("PRAGMA freelist_count")
+            after = (await cursor.fetchone())[0]
+        return before - after, after
+
+    # --- Полнотекстовый поиск (database/search.py) ---
+
+    @db_timed
+    async def search_messages(self, query, limit=20, before_id=None, chat_id=None):
+        """Сообщения, содержащие все слова запроса ("слово*" — по началу), от новых к старым.
+
+        Пагинация по ключу: следующая страница — before_id = id последнего
+        сообщения предыдущей. FTS5 отдает совпадения в порядке убывания rowid,
+        поэтому выборка останавливается на limit, а не сортирует все совпадения.
+        """
+        expression = match_query(query)
+        if not expression:
+            return []
+        self.search_index.stats["searches"] += 1
+        sql = """SELECT m.* FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ?"""
+        params = [expression]
+        if before_id is not None:
+            sql += " AND messages_fts.rowid < ?"
+            params.append(before_id)
+        if chat_id is not None:
+            sql += " AND m.chat_id = ?"
+            params.append(chat_id)
+        sql += " ORDER BY messages_fts.rowid DESC LIMIT ?"
+        params.append(limit)
+        rows = await self._fetchall(sql, params)
+        return [_row_to_message(row) for row in rows]
+
+    async def get_search_backfill_state(self):
+        """(indexed_up_to, pending_up_to) фонового заполнения индекса поиска"""
+        row = await self._fetchone("SELECT indexed_up_to, pending_up_to FROM messages_fts_backfill WHERE id = 1")
+        return (row[0], row[1]) if row else (0, 0)
+
+    @db_timed
+    async def backfill_search_index(self, batch_size):
+        """Проиндексировать следующую пачку старых сообщений; (строк, indexed_up_to, pending_up_to)"""
+        async with self.write_lock:
             cursor = await self.connection.execute(
-                """INSERT INTO orders (order_id, buyer_id, buyer_username, description, price)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(order_id) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
-                RETURNING id""",
-                (order_id, buyer_id, buyer_username, description, price)
+                "SELECT indexed_up_to, pending_up_to FROM messages_fts_backfill WHERE id = 1"
+            )
+            indexed_up_to, pending_up_to = await cursor.fetchone()
+            if indexed_up_to >= pending_up_to:
+                return 0, indexed_up_to, pending_up_to
+            cursor = await self.connection.execute(
+                "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM messages WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+                (indexed_up_to, pending_up_to, batch_size)
+            )
+            batch_end, rows = await cursor.fetchone()
+            # Пусто — оставшиеся старые сообщения уже удалены (архив)
+            batch_end = batch_end if rows == batch_size else pending_up_to
+            await self.connection.execute(
+                """INSERT INTO messages_fts (rowid, text, author_username)
+                SELECT id, text, author_username FROM messages WHERE id > ? AND id <= ?""",
+                (indexed_up_to, batch_end)
+            )
+            await self.connection.execute(
+                "UPDATE messages_fts_backfill SET indexed_up_to = ? WHERE id = 1", (batch_end,)
             )
-            row = await cursor.fetchone()
             await self.connection.commit()
+        return rows, batch_end, pending_up_to
 
+    @db_timed
+    async def merge_search_index(self, pages):
+        """Шаг слияния сегментов FTS5 (~pages страниц); False — сливать нечего"""
+        async with self.write_lock:
+            changes = self.connection.total_changes
             await self.connection.execute(
-                "UPDATE users SET total_orders = total_orders + 1 WHERE funpay_user_id = ?",
-                (buyer_id,)
+                "INSERT INTO messages_fts (messages_fts, rank) VALUES ('merge', ?)", (pages,)
             )
             await self.connection.commit()
+            # FTS5 не сообщает результат merge иначе: без работы счетчик изменений не растет
+            return self.connection.total_changes - changes > 1
 
+    @db_timed
+    async def add_order(self, order_id, buyer_id, buyer_username, description="", price=None):
+        if self.write_buffer:
+            return await self.write_buffer.submit("order", (order_id, buyer_id, buyer_username, description, price))
+        try:
+            async with self.write_lock:
+                cursor = await self.connection.execute(
+                    """INSERT INTO orders (order_id, buyer_id, buyer_username, description, price)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(order_id) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+                    RETURNING id""",
+                    (order_id, buyer_id, buyer_username, description, price)
+                )
+                row = await cursor.fetchone()
+                await self.connection.commit()
+
+            if row:
+                self.counters.add(buyer_id, buyer_username, orders=1)
             return row[0] if row else None
         except Exception as e:
             logger.error(f"Ошибка add_order: {e}")
             raise
 
+    async def enqueue_order(self, order_id, buyer_id, buyer_username, description="", price=None):
+        """Запись заказа без ожидания коммита; возвращает Future с ID строки"""
+        if self.write_buffer:
+            return self.write_buffer.submit("order", (order_id, buyer_id, buyer_username, description, price))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(await self.add_order(order_id, buyer_id, buyer_username, description, price))
+        return future
+
+    @db_timed
     async def update_order_status(self, order_id, status):
         completed_at = datetime.now() if status == "completed" else None
-        await self.connection.execute(
-            "UPDATE orders SET status = ?, updated_at = ?, completed_at = ? WHERE order_id = ?",
-            (status, datetime.now(), completed_at, order_id)
-        )
-        await self.connection.commit()
+        async with self.write_lock:
+            await self.connection.execute(
+                "UPDATE orders SET status = ?, updated_at = ?, completed_at = ? WHERE order_id = ?",
+                (status, datetime.now(), completed_at, order_id)
+            )
+            await self.connection.commit()
 
+    @db_timed
     async def get_active_orders(self):
-        cursor = await self.connection.execute(
-            "SELECT * FROM orders WHERE status IN ('new', 'active') ORDER BY created_at DESC"
+        # По статусу отдельно: каждая половина идет по idx_orders_status_created уже
+        # упорядоченной, и SQLite сливает их без сортировки (IN (...) сортирует всё заново)
+        rows = await self._fetchall(
+            """SELECT * FROM orders WHERE status = 'new'
+            UNION ALL SELECT * FROM orders WHERE status = 'active'
+            ORDER BY created_at DESC"""
         )
-        rows = await cursor.fetchall()
         orders = []
         for row in rows:
             orders.append(Order(
@@ -168,33 +517,223 @@ class Database:
             ))
         return orders
 
-    async def add_template(self, name, trigger, response):
-        cursor = await self.connection.execute(
-            "INSERT INTO templates (name, trigger, response) VALUES (?, ?, ?) RETURNING id",
-            (name, trigger, response)
+    @db_timed
+    async def load_recent_order_ids(self, max_age_seconds, limit):
+        """ID последних заказов для прогрева дедупликации (один запрос)"""
+        rows = await self._fetchall(
+            "SELECT order_id FROM orders WHERE created_at >= datetime('now', ?) ORDER BY id DESC LIMIT ?",
+            (f"-{int(max_age_seconds)} seconds", limit)
         )
-        row = await cursor.fetchone()
-        await self.connection.commit()
+        return [row[0] for row in rows]
+
+    # --- Персистентная очередь отправки (outbound_queue) ---
+    # Статусы: pending — в памяти менеджера очереди, spilled — только на диске,
+    # sending — отправка начата, failed — отправить не удалось. Отправленные строки удаляются.
+
+    @db_timed
+    async def add_outbound(self, chat_id, text, priority, dedup_key=None):
+        """Возвращает ID строки или None, если такое сообщение уже ждет отправки"""
+        async with self.write_lock:
+            cursor = await self.connection.execute(
+                """INSERT INTO outbound_queue (chat_id, text, priority, dedup_key) VALUES (?, ?, ?, ?)
+                ON CONFLICT(dedup_key) WHERE status IN ('pending', 'spilled', 'sending') DO NOTHING
+                RETURNING id""",
+                (chat_id, text, priority, dedup_key)
+            )
+            row = await cursor.fetchone()
+            await self.connection.commit()
+        return row[0] if row else None
+
+    @db_timed
+    async def set_outbound_status(self, row_ids, status):
+        async with self.write_lock:
+            await self.connection.executemany(
+                "UPDATE outbound_queue SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                [(status, row_id) for row_id in row_ids]
+            )
+            await self.connection.commit()
+
+    @db_timed
+    async def delete_outbound(self, row_ids):
+        async with self.write_lock:
+            await self.connection.executemany(
+                "DELETE FROM outbound_queue WHERE id = ?",
+                [(row_id,) for row_id in row_ids]
+            )
+            await self.connection.commit()
+
+    @db_timed
+    async def claim_spilled_outbound(self, limit):
+        """Переводит до limit сообщений с диска в память (по приоритету, затем по порядку)"""
+        async with self.write_lock:
+            cursor = await self.connection.execute(
+                """UPDATE outbound_queue SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM outbound_queue WHERE status = 'spilled'
+                    ORDER BY priority DESC, id LIMIT ?
+                )
+                RETURNING id, chat_id, text, priority""",
+                (limit,)
+            )
+            rows = await cursor.fetchall()
+            await self.connection.commit()
+        return sorted(rows, key=lambda row: (-row[3], row[0]))
+
+    @db_timed
+    async def prepare_outbound_replay(self):
+        """Перед запуском: всё неотправленное — на диск, начатые отправки — в failed.
+
+        Возвращает число сообщений в sending: они могли уйти до падения,
+        поэтому повторно не отправляются.
+        """
+        async with self.write_lock:
+            cursor = await self.connection.execute(
+                "UPDATE outbound_queue SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE status = 'sending'"
+            )
+            inflight = cursor.rowcount
+            await self.connection.execute(
+                "UPDATE outbound_queue SET status = 'spilled' WHERE status = 'pending'"
+            )
+            await self.connection.commit()
+        return inflight
+
+    @db_timed
+    async def prune_failed_outbound(self, max_age_days):
+        async with self.write_lock:
+            cursor = await self.connection.execute(
+                "DELETE FROM outbound_queue WHERE status = 'failed' AND updated_at < datetime('now', ?)",
+                (f"-{max_age_days} days",)
+            )
+            await self.connection.commit()
+        return cursor.rowcount
+
+    @db_timed
+    async def count_spilled_outbound(self):
+        row = await self._fetchone(
+            "SELECT COUNT(*) FROM outbound_queue WHERE status = 'spilled'"
+        )
+        return row[0] if row else 0
+
+    @db_timed
+    async def add_template(self, name, trigger, response):
+        async with self.write_lock:
+            cursor = await self.connection.execute(
+                "INSERT INTO templates (name, trigger, response) VALUES (?, ?, ?) RETURNING id",
+                (name, trigger, response)
+            )
+            row = await cursor.fetchone()
+            await self.connection.commit()
         return row[0] if row else None
 
+    @db_timed
     async def get_active_templates(self):
-        cursor = await self.connection.execute(
-            "SELECT * FROM templates WHERE is_active = 1"
+        rows = await self._fetchall(
+            "SELECT * FROM templates WHERE is_active = 1 ORDER BY id"
         )
-        rows = await cursor.fetchall()
-        templates = []
-        for row in rows:
-            templates.append(Template(
-                id=row[0], name=row[1], trigger=row[2], response=row[3],
-                is_active=bool(row[4]), use_count=row[5],
-                created_at=datetime.fromisoformat(row[6]) if row[6] else None,
-                updated_at=datetime.fromisoformat(row[7]) if row[7] else None
-            ))
-        return templates
+        return [_row_to_template(row) for row in rows]
+
+    @db_timed
+    async def get_templates_revision(self):
+        """Счетчик изменений шаблонов (растет при любой правке через триггеры миграции 6)"""
+        row = await self._fetchone("SELECT revision FROM template_revision WHERE id = 1")
+        return row[0] if row else 0
 
-    async def increment_template_usage(self, template_id):
-        await self.connection.execute(
-            "UPDATE templates SET use_count = use_count + 1 WHERE id = ?",
-            (template_id,)
+    @db_timed
+    async def get_templates_changed_since(self, revision):
+        """Шаблоны (и неактивные), измененные после revision, и id удаленных.
+
+        Возвращает (текущая ревизия, [Template], [id]). Ревизия читается первой:
+        правка между запросами в худшем случае загрузится повторно, но не потеряется
+        """
+        row = await self._fetchone("SELECT revision FROM template_revision WHERE id = 1")
+        current = row[0] if row else 0
+        rows = await self._fetchall(
+            "SELECT * FROM templates WHERE revision > ? ORDER BY id", (revision,)
+        )
+        deleted = await self._fetchall(
+            "SELECT template_id FROM template_tombstones WHERE revision > ?", (revision,)
+        )
+        return current, [_row_to_template(row) for row in rows], [row[0] for row in deleted]
+
+    @db_timed
+    async def apply_template_usage(self, usage, hourly, checks, prune_before_hour):
+        """usage: (+срабатываний, last_used_at, template_id); hourly: (hour, template_id, +срабатываний);
+        checks: (hour, +сообщений). Часы раньше prune_before_hour удаляются"""
+        async with self.write_lock:
+            await self.connection.executemany(
+                "UPDATE templates SET use_count = use_count + ?, last_used_at = ? WHERE id = ?",
+                usage
+            )
+            await self.connection.executemany(
+                """INSERT INTO template_usage_hourly (hour, template_id, matches) VALUES (?, ?, ?)
+                ON CONFLICT(hour, template_id) DO UPDATE SET matches = matches + excluded.matches""",
+                hourly
+            )
+            await self.connection.executemany(
+                """INSERT INTO autoresponder_checks_hourly (hour, messages) VALUES (?, ?)
+                ON CONFLICT(hour) DO UPDATE SET messages = messages + excluded.messages""",
+                checks
+            )
+            await self.connection.execute("DELETE FROM template_usage_hourly WHERE hour < ?", (prune_before_hour,))
+            await self.connection.execute("DELETE FROM autoresponder_checks_hourly WHERE hour < ?", (prune_before_hour,))
+            await self.connection.commit()
+
+    @db_timed
+    async def get_template_usage(self, since_hours):
+        """Срабатывания шаблонов за окна, начинающиеся с часов since_hours (по возрастанию длины окна).
+
+        Возвращает (проверено сообщений по окнам, [(id, name, is_active, use_count, last_used_at, срабатывания по окнам)])
+        """
+        oldest = min(since_hours)
+
+        def window_sums(column):
+            return ", ".join(
+                f"SUM(CASE WHEN hour >= {int(hour)} THEN {column} ELSE 0 END) AS w{i}"
+                for i, hour in enumerate(since_hours)
+            )
+
+        checks = await self._fetchone(
+            f"SELECT {window_sums('messages')} FROM autoresponder_checks_hourly WHERE hour >= ?",
+            (oldest,)
+        )
+        match_columns = ", ".join(f"COALESCE(u.w{i}, 0)" for i in range(len(since_hours)))
+        match_sums = window_sums("matches")
+        rows = await self._fetchall(
+            f"""SELECT t.id, t.name, t.is_active, t.use_count, t.last_used_at, {match_columns}
+            FROM templates t
+            LEFT JOIN (
+                SELECT template_id, {match_sums} FROM template_usage_hourly
+                WHERE hour >= ? GROUP BY template_id
+            ) u ON u.template_id = t.id
+            ORDER BY t.id""",
+            (oldest,)
         )
-        await self.connection.commit()
+        window_checks = tuple(value or 0 for value in checks) if checks else (0,) * len(since_hours)
+        return window_checks, [
+            (row[0], row[1], bool(row[2]), row[3],
+             datetime.fromisoformat(row[4]) if row[4] else None, tuple(row[5:]))
+            for row in rows
+        ]
+
+
+def _row_to_template(row):
+    """Строка SELECT * FROM templates -> Template"""
+    return Template(
+        id=row[0], name=row[1], trigger=row[2], response=row[3],
+        is_active=bool(row[4]), use_count=row[5],
+        created_at=datetime.fromisoformat(row[6]) if row[6] else None,
+        updated_at=datetime.fromisoformat(row[7]) if row[7] else None,
+        last_used_at=datetime.fromisoformat(row[8]) if row[8] else None,
+        revision=row[9]
+    )
+
+
+def _row_to_message(row):
+    """Строка SELECT * FROM messages -> Message"""
+    return Message(
+        id=row[0], chat_id=row[1], message_id=row[2],
+        author_id=row[3], author_username=row[4], text=row[5],
+        is_outgoing=bool(row[6]),
+        timestamp=datetime.fromisoformat(row[7]) if row[7] else None,
+        delivered=bool(row[8]), message_hash=row[9]
+    )
@@ -0,0 +1,182 @@
+"""
+database/dedup.py — дедупликация входящих сообщений со скользящим окном.
+
+Хэши последних сообщений держатся в памяти (ограниченный OrderedDict),
+поэтому обычный случай «не дубликат» не ходит в БД. Хэши сохраняются
+в message_hashes, чтобы после рестарта окно прогревалось из БД,
+а фоновая задача пачками удаляет просроченные строки.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from utils.helpers import generate_content_hash
+
+logger = logging.getLogger("FunPayBot.Dedup")
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, hex_hash):
+        # Двойное хэширование по двум половинам sha256
+        first = int(hex_hash[:16], 16)
+        second = int(hex_hash[16:32], 16) | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, hex_hash):
+        for position in self._positions(hex_hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, hex_hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(hex_hash))
+
+
+class DedupIndex:
+    def __init__(self, database, window=60, max_entries=50000, use_bloom=True,
+                 sweep_interval=60, sweep_batch=500, persist_interval=5):
+        self.db = database
+        self.window = window
+        self.max_entries = max_entries
+        self.use_bloom = use_bloom
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.persist_interval = persist_interval
+
+        self.entries = OrderedDict()  # hash -> monotonic-время истечения
+        self.pending_rows = []  # (hash, chat_id, expires_at) для записи в message_hashes
+        # Два поколения Bloom-фильтра: текущее и предыдущее окно
+        self.bloom = BloomFilter(max_entries) if use_bloom else None
+        self.previous_bloom = None
+        self.bloom_rotated_at = time.monotonic()
+        # Пока вытесненные по размеру хэши не истекли, промах в памяти не окончателен
+        self.evicted_until = 0.0
+
+        self.task = None
+        self.stats = {"checked": 0, "duplicates": 0, "db_lookups": 0, "evicted": 0, "expired_rows_deleted": 0}
+        logger.info(f"✓ Дедупликация инициализирована (окно={window}s, max={max_entries})")
+
+    async def start(self):
+        await self.warm_up()
+        self.task = asyncio.create_task(self._background_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.persist()
+
+    async def warm_up(self):
+        """Загрузка непросроченных хэшей из message_hashes одним запросом"""
+        try:
+            rows = await self.db.load_message_hashes(datetime.now())
+        except Exception as e:
+            logger.error(f"Ошибка прогрева дедупликации: {e}")
+            return
+        now_wall = datetime.now()
+        now = time.monotonic()
+        for message_hash, expires_at in rows:
+            if isinstance(expires_at, str):
+                expires_at = datetime.fromisoformat(expires_at)
+            self._remember(message_hash, now + (expires_at - now_wall).total_seconds())
+        logger.info(f"✓ Дедупликация прогрета: {len(self.entries)} хэшей")
+
+    async def is_duplicate(self, chat_id, text):
+        """Проверка и регистрация сообщения; True, если такое уже было в окне"""
+        self.stats["checked"] += 1
+        message_hash = generate_content_hash(chat_id, text)
+        now = time.monotonic()
+        self._expire(now)
+
+        if message_hash in self.entries:
+            self.stats["duplicates"] += 1
+            return True
+
+        if now < self.evicted_until and self._maybe_seen(message_hash):
+            # Редкий путь: хэш мог быть вытеснен из памяти по размеру
+            if any(row[0] == message_hash for row in self.pending_rows):
+                self.stats["duplicates"] += 1
+                return True
+            self.stats["db_lookups"] += 1
+            try:
+                if await self.db.message_hash_active(message_hash, datetime.now()):
+                    self.stats["duplicates"] += 1
+                    return True
+            except Exception as e:
+                logger.error(f"Ошибка проверки хэша в БД: {e}")
+
+        self._remember(message_hash, now + self.window)
+        self.pending_rows.append((message_hash, chat_id, datetime.now() + timedelta(seconds=self.window)))
+        return False
+
+    def _maybe_seen(self, message_hash):
+        if self.bloom is None:
+            return True
+        return message_hash in self.bloom or (self.previous_bloom is not None and message_hash in self.previous_bloom)
+
+    def _remember(self, message_hash, expires):
+        self.entries[message_hash] = expires
+        self.entries.move_to_end(message_hash)
+        if self.bloom is not None:
+            self.bloom.add(message_hash)
+        while len(self.entries) > self.max_entries:
+            _, evicted_expires = self.entries.popitem(last=False)
+            self.evicted_until = max(self.evicted_until, evicted_expires)
+            self.stats["evicted"] += 1
+
+    def _expire(self, now):
+        entries = self.entries
+        while entries:
+            message_hash, expires = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[message_hash]
+
+        if self.bloom is not None and now - self.bloom_rotated_at >= self.window:
+            self.previous_bloom = self.bloom
+            self.bloom = BloomFilter(self.max_entries)
+            self.bloom_rotated_at = now
+
+    async def persist(self):
+        rows, self.pending_rows = self.pending_rows, []
+        if not rows:
+            return
+        try:
+            await self.db.save_message_hashes(rows)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения хэшей: {e}")
+
+    async def sweep(self):
+        """Удаление просроченных строк message_hashes пачками"""
+        while True:
+            deleted = await self.db.delete_expired_message_hashes(datetime.now(), self.sweep_batch)
+            self.stats["expired_rows_deleted"] += deleted
+            if deleted < self.sweep_batch:
+                break
+            await asyncio.sleep(0)
+
+    async def _background_loop(self):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                self._expire(time.monotonic())
+                await self.persist()
+                if time.monotonic() - last_sweep >= self.sweep_interval:
+                    await self.sweep()
+                    last_sweep = time.monotonic()
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи дедупликации: {e}", exc_info=True)
+
+    def get_stats(self):
+        return {**self.stats, "entries": len(self.entries), "pending_rows": len(self.pending_rows)}
@@ -0,0 +1,120 @@
+from collections import OrderedDict, deque
+
+
+class ChatHistoryCache:
+    """Последние сообщения чатов в памяти: кольцо на чат, LRU по чатам.
+
+    Кольцо чата хранит до ring_size самых новых сообщений (старые — слева).
+    complete=True значит, что в кольце вся история чата (в БД сообщений
+    меньше ring_size), и запрос с любым limit можно отдать из памяти.
+    Общий объем ограничен числом чатов и суммарным числом сообщений.
+
+    Загрузка из БД идет через await, и запись в чат может закоммититься
+    раньше, чем fill() положит снимок: между begin_fill() и fill() такие
+    записи копятся и вливаются в кольцо, а не теряются до вытеснения чата.
+    """
+
+    def __init__(self, max_chats=1000, max_messages=20000, ring_size=50):
+        self.max_chats = max_chats
+        self.max_messages = max_messages
+        self.ring_size = ring_size
+        self.chats = OrderedDict()  # chat_id -> [deque(Message), complete]
+        self.filling = {}  # chat_id -> [загрузок в процессе, [Message записанные во время загрузки], сброшен]
+        self.total = 0
+        self.stats = {"hits": 0, "misses": 0, "evicted_chats": 0, "appended": 0}
+
+    def get(self, chat_id, limit):
+        """Сообщения от новых к старым или None, если в памяти их недостаточно"""
+        entry = self.chats.get(chat_id)
+        if entry is None or (len(entry[0]) < limit and not entry[1]):
+            self.stats["misses"] += 1
+            return None
+        self.chats.move_to_end(chat_id)
+        self.stats["hits"] += 1
+        ring = entry[0]
+        return [ring[index] for index in range(len(ring) - 1, max(len(ring) - limit, 0) - 1, -1)]
+
+    def begin_fill(self, chat_id):
+        """Перед чтением истории чата из БД; парный вызов — fill() или abort_fill()"""
+        pending = self.filling.get(chat_id)
+        if pending is None:
+            pending = self.filling[chat_id] = [0, [], False]
+        pending[0] += 1
+
+    def abort_fill(self, chat_id):
+        pending = self.filling.get(chat_id)
+        if pending is None:
+            return None
+        pending[0] -= 1
+        if pending[0] <= 0:
+            del self.filling[chat_id]
+        return pending
+
+    def fill(self, chat_id, messages, complete):
+        """Загрузить историю из БД; messages — от новых к старым"""
+        pending = self.abort_fill(chat_id)
+        if pending is not None and pending[2]:
+            return  # чат сброшен во время чтения — снимок мог устареть
+        self._drop(chat_id)
+        ring = deque(reversed(messages[:self.ring_size]), maxlen=self.ring_size)
+        self.chats[chat_id] = [ring, complete and len(messages) <= self.ring_size]
+        self.total += len(ring)
+        if pending is not None:
+            # Записи, закоммиченные во время чтения; уже попавшие в снимок append пропустит
+            for message in pending[1]:
+                self._push(message)
+        self._evict()
+
+    def append(self, message):
+        """Write-through новой записи; чаты, которых нет в памяти, не заводим"""
+        pending = self.filling.get(message.chat_id)
+        if pending is not None:
+            pending[1].append(message)
+        if self._push(message):
+            self.chats.move_to_end(message.chat_id)
+            self._evict()
+
+    def _push(self, message):
+        entry = self.chats.get(message.chat_id)
+        if entry is None:
+            return False
+        ring = entry[0]
+        if ring and message.id <= ring[-1].id:
+            return False  # уже попало в кольцо при загрузке из БД
+        if len(ring) == ring.maxlen:
+            self.total -= 1
+            entry[1] = False  # самое старое вытеснено — история больше не полная
+        ring.append(message)
+        self.total += 1
+        self.stats["appended"] += 1
+        return True
+
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self.chats.clear()
+            self.total = 0
+        else:
+            self._drop(chat_id)
+        for cid, pending in self.filling.items():
+            if chat_id is None or cid == chat_id:
+                pending[2] = True
+
+    def _drop(self, chat_id):
+        entry = self.chats.pop(chat_id, None)
+        if entry is not None:
+            self.total -= len(entry[0])
+
+    def _evict(self):
+        while self.chats and (len(self.chats) > self.max_chats or self.total > self.max_messages):
+            _, (ring, _) = self.chats.popitem(last=False)
+            self.total -= len(ring)
+            self.stats["evicted_chats"] += 1
+
+    def get_stats(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "chats": len(self.chats),
+            "messages": self.total,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,268 @@
+"""
+database/migrations.py — версионные миграции схемы SQLite.
+
+CREATE_TABLES_SQL — базовая схема (версия 1); всё, что меняется потом,
+описывается здесь миграцией с номером версии. Примененные версии пишутся
+в schema_migrations. Миграция — набор DDL в одной транзакции и проверки
+EXPLAIN QUERY PLAN: горячие запросы должны идти по нужному индексу,
+иначе транзакция откатывается и бот не стартует.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger("FunPayBot.Migrations")
+
+SCHEMA_MIGRATIONS_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INTEGER
+)
+"""
+
+
+class MigrationError(Exception):
+    """Миграция не применилась или план запроса не тот, что ожидался"""
+
+
+@dataclass
+class PlanCheck:
+    """sql должен использовать index; temp_btree=False — и обходиться без сортировки во временном B-дереве"""
+    sql: str
+    params: tuple
+    index: str
+    temp_btree: bool = True
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    statements: Tuple[str, ...] = ()
+    checks: Tuple[PlanCheck, ...] = ()
+    # Доп. шаг после DDL (внутри той же транзакции): async (connection) -> None
+    apply: Optional[Callable] = None
+
+
+def _fts_indexed(row_id):
+    """Условие «строка уже в messages_fts»: новая после миграции или пройдена фоновым заполнением"""
+    return (f"({row_id} > (SELECT pending_up_to FROM messages_fts_backfill) "
+            f"OR {row_id} <= (SELECT indexed_up_to FROM messages_fts_backfill))")
+
+
+_TEMPLATE_REVISION = "SELECT revision FROM template_revision WHERE id = 1"
+_BUMP_TEMPLATE_REVISION = "UPDATE template_revision SET revision = revision + 1 WHERE id = 1;"
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline"),
+    Migration(
+        2, "messages_chat_timestamp_index",
+        statements=(
+            # История чата: фильтр по chat_id и порядок по времени из одного индекса, без сортировки
+            "CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp ON messages(chat_id, timestamp DESC, id DESC)",
+            # Префикс нового индекса
+            "DROP INDEX IF EXISTS idx_messages_chat_id",
+            # Дубликат неявного индекса UNIQUE(message_hash)
+            "DROP INDEX IF EXISTS idx_messages_hash",
+        ),
+        checks=(
+            PlanCheck(
+                "SELECT * FROM messages WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (1, 50), "idx_messages_chat_timestamp", temp_btree=False
+            ),
+            PlanCheck(
+                "SELECT 1 FROM messages WHERE message_hash = ? LIMIT 1",
+                ("x",), "sqlite_autoindex_messages_1"
+            ),
+        ),
+    ),
+    Migration(
+        3, "orders_status_created_index",
+        statements=(
+            # Активные заказы: статус + дата создания. Сортировку покрывает только при равенстве
+            # по статусу, поэтому get_active_orders читает статусы отдельно и сливает (UNION ALL)
+            "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)",
+            "DROP INDEX IF EXISTS idx_orders_status",
+        ),
+        checks=(
+            PlanCheck(
+                """SELECT * FROM orders WHERE status = 'new'
+                UNION ALL SELECT * FROM orders WHERE status = 'active'
+                ORDER BY created_at DESC""",
+                (), "idx_orders_status_created", temp_btree=False
+            ),
+            PlanCheck(
+                "SELECT COUNT(*) FROM orders WHERE status = ?",
+                ("active",), "idx_orders_status_created"
+            ),
+        ),
+    ),
+    Migration(
+        4, "messages_full_text_search",
+        statements=(
+            # Индекс без копии текста (content=messages). Без prefix-индексов: они в разы
+            # увеличивают работу на каждую вставку, а префиксный поиск — только по запросу
+            """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                text, author_username, content='messages', content_rowid='id'
+            )""",
+            # Слияние сегментов — фоном (MessageSearchIndex), а не в коммите входящего сообщения;
+            # crisismerge — страховка, если фон не успевает
+            "INSERT INTO messages_fts (messages_fts, rank) VALUES ('automerge', 0)",
+            "INSERT INTO messages_fts (messages_fts, rank) VALUES ('crisismerge', 64)",
+            # Сообщения с id <= pending_up_to существовали до миграции и индексируются фоном
+            # (database/search.py) пачками по возрастанию id; indexed_up_to — докуда дошли
+            """CREATE TABLE IF NOT EXISTS messages_fts_backfill (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                indexed_up_to INTEGER NOT NULL,
+                pending_up_to INTEGER NOT NULL
+            )""",
+            """INSERT OR IGNORE INTO messages_fts_backfill (id, indexed_up_to, pending_up_to)
+            SELECT 1, 0, COALESCE(MAX(id), 0) FROM messages""",
+            # Триггеры трогают только уже проиндексированный диапазон: удаление из внешнего
+            # FTS-индекса строки, которой там нет, портит индекс
+            f"""CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+            WHEN {_fts_indexed("NEW.id")}
+            BEGIN
+                INSERT INTO messages_fts (rowid, text, author_username) VALUES (NEW.id, NEW.text, NEW.author_username);
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+            WHEN {_fts_indexed("OLD.id")}
+            BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, author_username)
+                VALUES ('delete', OLD.id, OLD.text, OLD.author_username);
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text, author_username ON messages
+            WHEN {_fts_indexed("OLD.id")}
+            BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, text, author_username)
+                VALUES ('delete', OLD.id, OLD.text, OLD.author_username);
+                INSERT INTO messages_fts (rowid, text, author_username) VALUES (NEW.id, NEW.text, NEW.author_username);
+            END""",
+        ),
+    ),
+    Migration(
+        5, "template_usage",
+        statements=(
+            # Счетчики пишутся пачками из autoresponder/usage.py, а не в пути ответа покупателю
+            "ALTER TABLE templates ADD COLUMN last_used_at TIMESTAMP",
+            # Срабатывания по часам (hour = unix-время // 3600): доли совпадений за окна для /templates.
+            # hour первым в ключе — окно и очистка старых часов идут диапазоном по ключу
+            """CREATE TABLE IF NOT EXISTS template_usage_hourly (
+                hour INTEGER NOT NULL,
+                template_id INTEGER NOT NULL,
+                matches INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, template_id)
+            ) WITHOUT ROWID""",
+            # Сколько сообщений проверил автоответчик — знаменатель доли
+            """CREATE TABLE IF NOT EXISTS autoresponder_checks_hourly (
+                hour INTEGER PRIMARY KEY,
+                messages INTEGER NOT NULL DEFAULT 0
+            )""",
+        ),
+    ),
+    Migration(
+        6, "template_revisions",
+        statements=(
+            # Кэш шаблонов (autoresponder/templates.py) сверяет один счетчик и догружает
+            # только строки с revision новее своей. Счетчик и revision ставят триггеры,
+            # поэтому видны и правки шаблонов прямо в БД
+            "ALTER TABLE templates ADD COLUMN revision INTEGER NOT NULL DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_templates_revision ON templates(revision)",
+            """CREATE TABLE IF NOT EXISTS template_revision (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                revision INTEGER NOT NULL
+            )""",
+            "INSERT OR IGNORE INTO template_revision (id, revision) VALUES (1, 0)",
+            # Удаленные шаблоны: строки уже нет, кэшу нужен только id
+            """CREATE TABLE IF NOT EXISTS template_tombstones (
+                template_id INTEGER PRIMARY KEY,
+                revision INTEGER NOT NULL
+            )""",
+            f"""CREATE TRIGGER IF NOT EXISTS templates_revision_insert AFTER INSERT ON templates
+            BEGIN
+                {_BUMP_TEMPLATE_REVISION}
+                UPDATE templates SET revision = ({_TEMPLATE_REVISION}) WHERE id = NEW.id;
+            END""",
+            # Только поля, влияющие на подбор: запись use_count/last_used_at кэш не сбрасывает
+            f"""CREATE TRIGGER IF NOT EXISTS templates_revision_update
+            AFTER UPDATE OF name, trigger, response, is_active ON templates
+            BEGIN
+                {_BUMP_TEMPLATE_REVISION}
+                UPDATE templates SET revision = ({_TEMPLATE_REVISION}) WHERE id = NEW.id;
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS templates_revision_delete AFTER DELETE ON templates
+            BEGIN
+                {_BUMP_TEMPLATE_REVISION}
+                INSERT OR REPLACE INTO template_tombstones (template_id, revision) VALUES (OLD.id, ({_TEMPLATE_REVISION}));
+            END""",
+        ),
+        checks=(
+            PlanCheck("SELECT * FROM templates WHERE revision > ?", (0,), "idx_templates_revision"),
+        ),
+    ),
+]
+
+
+class Migrator:
+    def __init__(self, connection, write_lock, migrations=None):
+        self.connection = connection
+        self.write_lock = write_lock
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda migration: migration.version)
+
+    async def current_version(self):
+        async with self.write_lock:
+            await self.connection.execute(SCHEMA_MIGRATIONS_SQL)
+            await self.connection.commit()
+            cursor = await self.connection.execute("SELECT MAX(version) FROM schema_migrations")
+            row = await cursor.fetchone()
+        return row[0] or 0
+
+    async def migrate(self):
+        """Применить все новые миграции по порядку; возвращает итоговую версию"""
+        version = await self.current_version()
+        pending = [migration for migration in self.migrations if migration.version > version]
+        for migration in pending:
+            started = time.perf_counter()
+            logger.info(f"⏳ Миграция {migration.version}: {migration.name}")
+            await self._apply(migration, started)
+            version = migration.version
+            logger.info(f"✓ Миграция {migration.version} применена за {time.perf_counter() - started:.2f}s")
+        if pending:
+            async with self.write_lock:
+                await self.connection.execute("PRAGMA optimize")
+        return version
+
+    async def _apply(self, migration, started):
+        async with self.write_lock:
+            try:
+                await self.connection.execute("BEGIN IMMEDIATE")
+                for statement in migration.statements:
+                    await self.connection.execute(statement)
+                if migration.apply:
+                    await migration.apply(self.connection)
+                for check in migration.checks:
+                    await self.check_plan(check)
+                await self.connection.execute(
+                    "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (?, ?, ?)",
+                    (migration.version, migration.name, int((time.perf_counter() - started) * 1000))
+                )
+                await self.connection.commit()
+            except Exception as e:
+                await self.connection.rollback()
+                raise MigrationError(f"Миграция {migration.version} ({migration.name}) откачена: {e}") from e
+
+    async def explain(self, sql, params=()):
+        cursor = await self.connection.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[3] for row in await cursor.fetchall()]
+
+    async def check_plan(self, check):
+        plan = await self.explain(check.sql, check.params)
+        uses_index = any(f"INDEX {check.index}" in step for step in plan)
+        sorts = any("TEMP B-TREE" in step for step in plan)
+        if not uses_index or (sorts and not check.temp_btree):
+            raise MigrationError(f"План запроса не использует {check.index}: {' | '.join(plan)} ({check.sql})")
+        logger.debug(f"План OK ({check.index}): {' | '.join(plan)}")
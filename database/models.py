@@ -2,6 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
+# Базовая схема (версия 1); дальнейшие изменения — миграциями в database/migrations.py
 CREATE_TABLES_SQL = """
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -61,11 +62,23 @@ CREATE TABLE IF NOT EXISTS message_hashes (
     expires_at TIMESTAMP NOT NULL
 );
 
-CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id);
+CREATE TABLE IF NOT EXISTS outbound_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    dedup_key TEXT,
+    status TEXT DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
-CREATE INDEX IF NOT EXISTS idx_messages_hash ON messages(message_hash);
 CREATE INDEX IF NOT EXISTS idx_orders_buyer_id ON orders(buyer_id);
-CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_message_hashes_expires_at ON message_hashes(expires_at);
+CREATE INDEX IF NOT EXISTS idx_outbound_queue_status ON outbound_queue(status, priority DESC, id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_outbound_queue_dedup ON outbound_queue(dedup_key)
+    WHERE status IN ('pending', 'spilled', 'sending');
 """
 
 @dataclass
@@ -117,3 +130,5 @@ class Template:
     use_count: int = 0
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    last_used_at: Optional[datetime] = None
+    revision: int = 0
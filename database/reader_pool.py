@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import logging
+import re
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiosqlite
+
+logger = logging.getLogger("FunPayBot.ReaderPool")
+
+_WRITE_WORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE|UPSERT)\b", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=512)
+def is_read_query(sql):
+    """SELECT (и WITH без изменяющих операторов) можно выполнить на читающем соединении"""
+    verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    if verb == "SELECT":
+        return "RETURNING" not in sql.upper()
+    return verb == "WITH" and not _WRITE_WORDS.search(sql)
+
+
+class ReaderPool:
+    """Пул read-only соединений SQLite.
+
+    В режиме WAL читатели не ждут писателя и друг друга, поэтому тяжелые
+    выборки не стоят в одной очереди с записью входящих сообщений. Каждое
+    соединение — отдельный поток aiosqlite; запрос берет свободное соединение
+    из очереди и возвращает его после чтения.
+    """
+
+    def __init__(self, db_path, size=2, timeout=30.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.connections = []
+        self.idle = asyncio.Queue()
+        self.stats = {"queries": 0, "waits": 0, "max_wait": 0.0}
+
+    async def open(self):
+        uri = Path(self.db_path).absolute().as_uri() + "?mode=ro"
+        for _ in range(self.size):
+            connection = await aiosqlite.connect(uri, uri=True, timeout=self.timeout)
+            await connection.execute("PRAGMA query_only = ON")
+            self.connections.append(connection)
+            self.idle.put_nowait(connection)
+        logger.info(f"✓ Пул чтения БД: {self.size} соединений")
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+        self.connections = []
+        self.idle = asyncio.Queue()
+
+    @asynccontextmanager
+    async def acquire(self):
+        if self.idle.empty():
+            self.stats["waits"] += 1
+            started = time.perf_counter()
+            connection = await self.idle.get()
+            self.stats["max_wait"] = max(self.stats["max_wait"], time.perf_counter() - started)
+        else:
+            connection = self.idle.get_nowait()
+        try:
+            yield connection
+        finally:
+            self.idle.put_nowait(connection)
+
+    async def fetchall(self, sql, params=()):
+        self.stats["queries"] += 1
+        async with self.acquire() as connection:
+            # Один переход в поток соединения вместо трех (execute, fetch, close):
+            # под конкурентной записью каждый переход стоит в очереди за GIL
+            return await connection.execute_fetchall(sql, params)
+
+    async def fetchone(self, sql, params=()):
+        """Для выборок из одной строки (поиск по ключу, агрегат): результат читается целиком"""
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "max_wait": round(self.stats["max_wait"], 4),
+            "size": self.size,
+            "idle": self.idle.qsize()
+        }
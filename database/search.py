@@ -0,0 +1,108 @@
+"""
+database/search.py — полнотекстовый поиск по истории сообщений (SQLite FTS5).
+
+Индекс messages_fts создается миграцией 4 и хранит только токены: текст
+берется из messages (external content). Новые сообщения попадают в индекс
+триггерами в той же транзакции, что и запись. Сообщения, существовавшие
+до миграции, индексируются в фоне короткими пачками по возрастанию id,
+чтобы не держать писателя; прогресс (watermark) хранится в
+messages_fts_backfill и переживает рестарт.
+
+Каждый коммит добавляет в индекс маленький сегмент. Встроенное слияние
+сегментов (automerge) выключено миграцией: оно выполнялось бы внутри
+коммита входящего сообщения и давало хвосты в десятки мс. Сегменты
+сливаются здесь же в фоне небольшими шагами.
+
+Архивные сообщения (database/archive.py) при переносе удаляются и из индекса.
+"""
+import asyncio
+import logging
+import re
+
+logger = logging.getLogger("FunPayBot.Search")
+
+_WORD = re.compile(r"(\w+)(\*?)", re.UNICODE)
+
+
+def match_query(text):
+    """Запрос пользователя -> выражение MATCH: все слова (AND), целиком; "слово*" — по началу.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 и пунктуация из запроса
+    не ломают синтаксис. Целое слово FTS5 читает лениво в порядке rowid и
+    останавливается на LIMIT; префикс сначала сливает списки всех подходящих
+    слов, поэтому включается только явно и не короче двух букв.
+    """
+    terms = []
+    for word, star in _WORD.findall(text):
+        terms.append(f'"{word}"*' if star and len(word) > 1 else f'"{word}"')
+    return " ".join(terms)
+
+
+class MessageSearchIndex:
+    def __init__(self, database, batch_size=1000, pause=0.1, merge_interval=5.0, merge_pages=50):
+        self.db = database
+        self.batch_size = batch_size
+        self.pause = pause
+        self.merge_interval = merge_interval
+        self.merge_pages = merge_pages
+        self.task = None
+        self.stats = {"backfilled": 0, "indexed_up_to": 0, "pending_up_to": 0, "searches": 0, "merges": 0}
+
+    @property
+    def backfill_done(self):
+        return self.stats["indexed_up_to"] >= self.stats["pending_up_to"]
+
+    async def start(self):
+        indexed_up_to, pending_up_to = await self.db.get_search_backfill_state()
+        self.stats.update(indexed_up_to=indexed_up_to, pending_up_to=pending_up_to)
+        if not self.backfill_done:
+            logger.info(f"⏳ Индексация истории для поиска: сообщения {indexed_up_to + 1}..{pending_up_to} (в фоне)")
+        self.task = asyncio.create_task(self._background_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _background_loop(self):
+        if not self.backfill_done:
+            await self._backfill()
+        while True:
+            await asyncio.sleep(self.merge_interval)
+            try:
+                await self.merge()
+            except Exception as e:
+                logger.error(f"Ошибка слияния сегментов индекса поиска: {e}", exc_info=True)
+
+    async def _backfill(self):
+        while not self.backfill_done:
+            try:
+                await self.backfill_once()
+            except Exception as e:
+                logger.error(f"Ошибка индексации истории для поиска: {e}", exc_info=True)
+                await asyncio.sleep(max(self.pause, 5))
+                continue
+            await asyncio.sleep(self.pause)  # между пачками писатель свободен для входящих
+        logger.info(f"✓ История проиндексирована для поиска: {self.stats['backfilled']} сообщений")
+
+    async def merge(self):
+        """Сливать сегменты шагами по merge_pages страниц, пока есть что сливать"""
+        while await self.db.merge_search_index(self.merge_pages):
+            self.stats["merges"] += 1
+            await asyncio.sleep(self.pause)
+
+    async def backfill_once(self):
+        """Одна пачка; возвращает число проиндексированных сообщений"""
+        rows, indexed_up_to, pending_up_to = await self.db.backfill_search_index(self.batch_size)
+        self.stats["backfilled"] += rows
+        self.stats.update(indexed_up_to=indexed_up_to, pending_up_to=pending_up_to)
+        return rows
+
+    def get_stats(self):
+        pending = self.stats["pending_up_to"]
+        progress = self.stats["indexed_up_to"] / pending if pending else 1.0
+        return {**self.stats, "backfill_progress": round(min(progress, 1.0), 4)}
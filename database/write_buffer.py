@@ -0,0 +1,190 @@
+"""
+database/write_buffer.py — отложенная запись (write-behind) с групповым коммитом.
+
+Сообщения и заказы копятся в памяти и записываются одной транзакцией,
+когда набирается max_rows строк или проходит flush_interval секунд.
+Вызывающий получает asyncio.Future с ID строки. Счетчики пользователей
+обновляются после коммита через UserCounters (database/counters.py).
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Tuple
+
+import aiosqlite
+
+from utils.metrics import DB_STATEMENT_TIME
+
+logger = logging.getLogger("FunPayBot.WriteBuffer")
+FLUSH_TIME = DB_STATEMENT_TIME.labels("write_buffer_flush")
+
+INSERT_MESSAGE_SQL = """INSERT INTO messages (chat_id, author_id, author_username, text, is_outgoing, message_hash)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(message_hash) DO NOTHING
+RETURNING id"""
+
+INSERT_ORDER_SQL = """INSERT INTO orders (order_id, buyer_id, buyer_username, description, price)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(order_id) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+RETURNING id"""
+
+
+@dataclass
+class PendingWrite:
+    kind: str  # "message" | "order"
+    params: Tuple[Any, ...]
+    future: asyncio.Future = field(repr=False)
+
+
+def _consume_exception(future):
+    # Ошибка уже залогирована буфером; не даем asyncio ругаться на неполученное исключение
+    if not future.cancelled():
+        future.exception()
+
+
+class WriteBehindBuffer:
+    def __init__(self, connection, write_lock, max_rows=100, flush_interval=0.05, counters=None):
+        self.connection = connection
+        self.write_lock = write_lock
+        self.counters = counters
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.pending_hashes = set()
+        self.has_pending = asyncio.Event()
+        self.is_full = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.flush_task = None
+        self.stats = {"rows_buffered": 0, "rows_flushed": 0, "flushes": 0, "flush_errors": 0}
+
+    def start(self):
+        if self.flush_task is None:
+            self.stopping.clear()
+            self.flush_task = asyncio.create_task(self._flush_loop())
+            logger.info(f"✓ Отложенная запись включена (max_rows={self.max_rows}, interval={self.flush_interval * 1000:.0f}ms)")
+
+    async def stop(self):
+        """Остановка с дозаписью всего, что осталось в буфере"""
+        if self.flush_task:
+            # Без cancel: отмена посреди flush() теряет уже вынутую из pending пачку,
+            # оставляет открытую транзакцию и неразрешенные Future
+            self.stopping.set()
+            self.has_pending.set()
+            self.is_full.set()
+            await self.flush_task
+            self.flush_task = None
+        while self.pending:
+            await self.flush()
+        logger.info("✓ Буфер отложенной записи сброшен")
+
+    def has_pending_hash(self, message_hash):
+        return message_hash in self.pending_hashes
+
+    def submit(self, kind, params, message_hash=None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+
+        if message_hash:
+            if message_hash in self.pending_hashes:
+                logger.debug(f"Дубликат сообщения в буфере игнорируется (hash: {message_hash[:8]}...)")
+                future.set_result(None)
+                return future
+            self.pending_hashes.add(message_hash)
+
+        self.pending.append(PendingWrite(kind, params, future))
+        self.stats["rows_buffered"] += 1
+        self.has_pending.set()
+        if len(self.pending) >= self.max_rows:
+            self.is_full.set()
+        return future
+
+    async def _flush_loop(self):
+        while not self.stopping.is_set():
+            await self.has_pending.wait()
+            if len(self.pending) < self.max_rows:
+                try:
+                    await asyncio.wait_for(self.is_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сброса буфера записи: {e}", exc_info=True)
+
+    async def flush(self):
+        batch = self.pending
+        self.pending = []
+        self.pending_hashes = set()
+        self.has_pending.clear()
+        self.is_full.clear()
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        error = None
+        async with self.write_lock:
+            try:
+                results = await self._apply(batch)
+                await self.connection.commit()
+            except Exception as e:
+                await self.connection.rollback()
+                error = e
+        if error is not None:
+            # Построчная запись берет блокировку сама — уже после ее освобождения
+            self.stats["flush_errors"] += 1
+            logger.warning(f"⚠️ Групповая запись не удалась ({error}), запись по одной строке")
+            await self._apply_one_by_one(batch)
+            return
+        FLUSH_TIME.observe(time.perf_counter() - started)
+
+        self.stats["flushes"] += 1
+        self.stats["rows_flushed"] += len(batch)
+        for write, row_id in zip(batch, results):
+            self._count(write, row_id)
+            if not write.future.done():
+                write.future.set_result(row_id)
+
+    async def _apply(self, batch):
+        return [await self._insert(write) for write in batch]
+
+    def _count(self, write, row_id):
+        """Приращение счетчика автора/покупателя — только для закоммиченной строки"""
+        if self.counters is None or row_id is None:
+            return
+        # params: (chat_id, author_id, author_username, ...) / (order_id, buyer_id, buyer_username, ...)
+        user_id, username = write.params[1], write.params[2]
+        if write.kind == "message":
+            self.counters.add(user_id, username, messages=1)
+        else:
+            self.counters.add(user_id, username, orders=1)
+
+    async def _insert(self, write):
+        sql = INSERT_MESSAGE_SQL if write.kind == "message" else INSERT_ORDER_SQL
+        cursor = await self.connection.execute(sql, write.params)
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def _apply_one_by_one(self, batch):
+        for write in batch:
+            async with self.write_lock:
+                try:
+                    row_id = (await self._apply([write]))[0]
+                    await self.connection.commit()
+                except aiosqlite.IntegrityError as e:
+                    await self.connection.rollback()
+                    logger.debug(f"Дубликат при отложенной записи (IntegrityError): {e}")
+                    row_id = None
+                except Exception as e:
+                    await self.connection.rollback()
+                    logger.error(f"Ошибка отложенной записи ({write.kind}): {e}")
+                    if not write.future.done():
+                        write.future.set_exception(e)
+                    continue
+            self.stats["rows_flushed"] += 1
+            self._count(write, row_id)
+            if not write.future.done():
+                write.future.set_result(row_id)
+
+    def get_stats(self):
+        return {**self.stats, "pending": len(self.pending)}
@@ -1,16 +1,37 @@
 import logging
 import asyncio
+import time
 from datetime import datetime
 
+from utils.tracing import tracer
+
 logger = logging.getLogger("FunPayBot.MessageHandler")
 
+# Этапы обработки: на критическом пути только автоответ покупателю,
+# запись в БД и уведомление в Telegram идут параллельно в фоне
+STAGES = ("dedup", "db_incoming", "notify", "autoreply", "db_outgoing")
+
 
 class MessageHandler:
-    def __init__(self, database, telegram_bot, autoresponder, queue_manager):
+    def __init__(self, database, telegram_bot, autoresponder, queue_manager, dedup_index=None,
+                 db_timeout=5.0, notify_timeout=10.0, autoreply_timeout=5.0):
         self.database = database
         self.telegram_bot = telegram_bot
         self.autoresponder = autoresponder
         self.queue_manager = queue_manager
+        self.dedup_index = dedup_index
+        self.timeouts = {
+            "db_incoming": db_timeout,
+            "db_outgoing": db_timeout,
+            "notify": notify_timeout,
+            "autoreply": autoreply_timeout
+        }
+        self.background_tasks = set()
+        self.stats = {
+            "handled": 0,
+            "duplicates": 0,
+            "stages": {name: {"count": 0, "total": 0.0, "max": 0.0, "timeouts": 0, "errors": 0} for name in STAGES}
+        }
         logger.info("✓ Обработчик сообщений инициализирован")
 
     async def handle(self, message):
@@ -24,61 +45,129 @@ class MessageHandler:
             author = str(message.author)
             text = message.text
 
-            # --- ЛОГИКА 2: Сохранение в БД ---
+            # --- ЛОГИКА 1: Дедупликация (скользящее окно, без запроса к БД) ---
+            if self.dedup_index:
+                started = time.perf_counter()
+                with tracer.span("message_handler.dedup"):
+                    duplicate = await self.dedup_index.is_duplicate(chat_id, text)
+                self._record("dedup", time.perf_counter() - started)
+                if duplicate:
+                    self.stats["duplicates"] += 1
+                    logger.debug(f"Дубликат сообщения в чате {chat_id} игнорируется")
+                    return False
+
+            # --- ЛОГИКА 2: Сохранение в БД (фон) ---
             if self.database:
-                try:
-                    # Передаем все аргументы, которые ждет Database.add_message
-                    # chat_id, author_id, author_username, text, is_outgoing
-                    await self.database.add_message(
-                        chat_id=chat_id,
-                        author_id=author_id,
-                        author_username=author,
-                        text=text,
-                        is_outgoing=False
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка БД при сохранении сообщения: {e}")
-
-            # --- ЛОГИКА 3: Отправка уведомления в Telegram ---
+                # Передаем все аргументы, которые ждет Database.add_message
+                # chat_id, author_id, author_username, text, is_outgoing
+                # ID строки не нужен — не ждем коммита (при DB_WRITE_BEHIND запись групповая)
+                self._spawn("db_incoming", self.database.enqueue_message(
+                    chat_id=chat_id,
+                    author_id=author_id,
+                    author_username=author,
+                    text=text,
+                    is_outgoing=False
+                ))
+
+            # --- ЛОГИКА 3: Уведомление в Telegram (фон) ---
             if self.telegram_bot:
-                await self.telegram_bot.send_message_notification(
+                self._spawn("notify", self.telegram_bot.send_message_notification(
                     chat_id=chat_id,
                     username=author,
-                    text=text
-                )
+                    text=text,
+                    received_at=getattr(message, 'received_at', None)
+                ))
             else:
                 logger.error("❌ self.telegram_bot is None!")
 
-            # --- ЛОГИКА 4: Автоответчик (AutoResponder) ---
+            # --- ЛОГИКА 4: Автоответчик (критический путь) ---
             if self.autoresponder:
-                response = await self.autoresponder.get_response(chat_id, text)
-                if response:
-                    logger.info(f"🤖 Автоответчик сработал для {author}: {response[:20]}...")
-
-                    # Добавляем ответ в очередь отправки
-                    if self.queue_manager:
-                        await self.queue_manager.add_message(chat_id, response)
-
-                        # Сохраняем ответ бота в БД
-                        if self.database:
-                            # Сохраняем исходящее сообщение бота
-                            # Для бота ID обычно 0 или ID аккаунта (если известен, но тут ставим 0)
-                            await self.database.add_message(
-                                chat_id=chat_id,
-                                author_id=0,
-                                author_username="Bot",
-                                text=response,
-                                is_outgoing=True
-                            )
-                    else:
-                        logger.error("❌ QueueManager не инициализирован!")
+                await self._run_stage("autoreply", self._autoreply(chat_id, author, text))
 
+            self.stats["handled"] += 1
             return True
 
         except Exception as e:
             logger.error(f"❌ Ошибка в handle: {e}", exc_info=True)
             return False
 
+    async def _autoreply(self, chat_id, author, text):
+        response = await self.autoresponder.get_response(text)
+        if not response:
+            return
+        logger.info(f"🤖 Автоответчик сработал для {author}: {response[:20]}...")
+
+        # Добавляем ответ в очередь отправки
+        if not self.queue_manager:
+            logger.error("❌ QueueManager не инициализирован!")
+            return
+        await self.queue_manager.add_message(chat_id, response)
+
+        # Сохраняем ответ бота в БД — уже вне критического пути
+        # Для бота ID обычно 0 или ID аккаунта (если известен, но тут ставим 0)
+        if self.database:
+            self._spawn("db_outgoing", self.database.enqueue_message(
+                chat_id=chat_id,
+                author_id=0,
+                author_username="Bot",
+                text=response,
+                is_outgoing=True
+            ))
+
+    def _spawn(self, stage, coro):
+        task = asyncio.create_task(self._run_stage(stage, coro))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def _run_stage(self, stage, coro):
+        """Выполнение этапа со своим таймаутом и замером длительности"""
+        started = time.perf_counter()
+        try:
+            with tracer.span(f"message_handler.{stage}"):
+                await asyncio.wait_for(coro, timeout=self.timeouts[stage])
+        except asyncio.TimeoutError:
+            self.stats["stages"][stage]["timeouts"] += 1
+            logger.warning(f"⏱️ Этап {stage} превысил таймаут {self.timeouts[stage]}s")
+        except Exception as e:
+            self.stats["stages"][stage]["errors"] += 1
+            logger.error(f"Ошибка этапа {stage}: {e}")
+        finally:
+            self._record(stage, time.perf_counter() - started)
+
+    def _record(self, stage, elapsed):
+        stage_stats = self.stats["stages"][stage]
+        stage_stats["count"] += 1
+        stage_stats["total"] += elapsed
+        stage_stats["max"] = max(stage_stats["max"], elapsed)
+
+    async def drain(self, timeout=10.0):
+        """Ожидание фоновых этапов при остановке"""
+        if not self.background_tasks:
+            return
+        done, pending = await asyncio.wait(set(self.background_tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"⚠️ Прервано фоновых этапов обработки: {len(pending)}")
+
     async def handle_message(self, message):
         """Алиас для совместимости"""
         return await self.handle(message)
+
+    def get_stats(self):
+        stages = {}
+        for name, stage_stats in self.stats["stages"].items():
+            count = stage_stats["count"] or 1
+            stages[name] = {
+                **stage_stats,
+                "total": round(stage_stats["total"], 4),
+                "avg": round(stage_stats["total"] / count, 4),
+                "max": round(stage_stats["max"], 4)
+            }
+        return {
+            "handled": self.stats["handled"],
+            "duplicates": self.stats["duplicates"],
+            "in_flight": len(self.background_tasks),
+            "stages": stages
+        }
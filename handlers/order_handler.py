@@ -1,16 +1,32 @@
 import logging
 from datetime import datetime
 from utils.helpers import parse_order_id
+from utils.ttl_cache import TTLSet
 
 logger = logging.getLogger("FunPayBot.OrderHandler")
 
 class OrderHandler:
-    def __init__(self, database, telegram_bot):
+    def __init__(self, database, telegram_bot, cache_size=10000, cache_ttl=259200):
         self.db = database
         self.telegram_bot = telegram_bot
-        self.processed_orders = set()
+        # Ограниченный кэш обработанных заказов; последняя линия защиты — orders.order_id UNIQUE
+        self.processed_orders = TTLSet(max_size=cache_size, ttl=cache_ttl)
         logger.info("✓ Обработчик заказов инициализирован")
 
+    async def warm_up(self):
+        """Прогрев кэша из таблицы orders: повтор недавних заказов после рестарта — не новые заказы"""
+        try:
+            order_ids = await self.db.load_recent_order_ids(
+                self.processed_orders.ttl or 259200, self.processed_orders.max_size
+            )
+        except Exception as e:
+            logger.error(f"Ошибка прогрева кэша заказов: {e}")
+            return
+        # Запрос отдает новые первыми — добавляем с конца, чтобы свежие вытеснялись последними
+        for order_id in reversed(order_ids):
+            self.processed_orders.add(order_id)
+        logger.info(f"✓ Кэш заказов прогрет: {len(order_ids)} заказов")
+
     async def handle(self, order):
         try:
             order_id_str = parse_order_id(order.description)
@@ -24,14 +40,19 @@ class OrderHandler:
             self.processed_orders.add(order_id_str)
             logger.info(f"🛒 Новый заказ от {order.buyer_username}: {order.description[:50]}...")
             
-            await self.db.add_or_update_user(funpay_user_id=0, username=order.buyer_username)
-            await self.db.add_order(
-                order_id=order_id_str,
-                buyer_id=0,
-                buyer_username=order.buyer_username,
-                description=order.description,
-                price=None
-            )
+            try:
+                await self.db.add_or_update_user(funpay_user_id=0, username=order.buyer_username)
+                await self.db.add_order(
+                    order_id=order_id_str,
+                    buyer_id=0,
+                    buyer_username=order.buyer_username,
+                    description=order.description,
+                    price=None
+                )
+            except Exception:
+                # Заказ не записан — при повторе события обработаем его заново
+                self.processed_orders.discard(order_id_str)
+                raise
             
             if self.telegram_bot:
                 await self.telegram_bot.send_order_notification(
@@ -45,3 +66,6 @@ class OrderHandler:
         except Exception as e:
             logger.error(f"Ошибка обработки заказа: {e}", exc_info=True)
             return False
+
+    def get_stats(self):
+        return {"cache": self.processed_orders.get_stats()}
@@ -0,0 +1,109 @@
+"""Персистентная очередь отправки: что переживает stop() и рестарт"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from core.queue_manager import MessageQueueManager
+from database.database import Database
+
+
+@asynccontextmanager
+async def open_store(path):
+    # Незакрытые соединения aiosqlite держат потоки — после упавшей проверки pytest не завершится
+    database = Database(str(path), write_behind=False)
+    await database.connect()
+    try:
+        await database.initialize()
+        yield database
+    finally:
+        await database.disconnect()
+
+
+async def outbound_statuses(database):
+    rows = await database._fetchall("SELECT text, status FROM outbound_queue ORDER BY id")
+    return {text: status for text, status in rows}
+
+
+def test_interrupted_before_send_is_replayed(tmp_path):
+    async def scenario():
+        async with open_store(tmp_path / "bot.db") as database:
+            sent = []
+
+            async def send(chat_id, text):
+                sent.append(text)
+                return True
+
+            # Глобальный лимит пропускает одно сообщение; второе стоит в бакете, когда приходит stop()
+            manager = MessageQueueManager(send_delay=0.01, workers=2, global_rate=0.01,
+                                          store=database, drain_timeout=0.2)
+            await manager.start(send)
+            await manager.add_message(1, "first")
+            await manager.add_message(2, "second")
+            await asyncio.sleep(0.1)
+            await manager.stop()
+            assert sent == ["first"]
+            assert await outbound_statuses(database) == {"second": "pending"}
+
+        async with open_store(tmp_path / "bot.db") as database:
+            manager = MessageQueueManager(send_delay=0.01, store=database, drain_timeout=1.0)
+            await manager.start(send)
+            await manager.stop()
+            assert sent == ["first", "second"]
+            assert await outbound_statuses(database) == {}
+
+    asyncio.run(scenario())
+
+
+def test_refused_send_interrupted_in_backoff_is_replayed(tmp_path):
+    async def scenario():
+        async with open_store(tmp_path / "bot.db") as database:
+            async def refuse(chat_id, text):
+                return False
+
+            # Явный отказ — сообщение не ушло; stop() застает воркер в паузе перед повтором
+            manager = MessageQueueManager(send_delay=0.01, store=database, drain_timeout=0.2)
+            await manager.start(refuse)
+            await manager.add_message(1, "refused")
+            await asyncio.sleep(0.1)
+            await manager.stop()
+            assert await outbound_statuses(database) == {"refused": "pending"}
+
+        async with open_store(tmp_path / "bot.db") as database:
+            sent = []
+
+            async def send(chat_id, text):
+                sent.append(text)
+                return True
+
+            manager = MessageQueueManager(send_delay=0.01, store=database, drain_timeout=1.0)
+            await manager.start(send)
+            await manager.stop()
+            assert sent == ["refused"]
+
+    asyncio.run(scenario())
+
+
+def test_interrupted_during_send_is_not_resent(tmp_path):
+    async def scenario():
+        async with open_store(tmp_path / "bot.db") as database:
+            calls = []
+
+            async def hanging_send(chat_id, text):
+                calls.append(text)
+                await asyncio.Event().wait()
+
+            manager = MessageQueueManager(send_delay=0.01, store=database, drain_timeout=0.2)
+            await manager.start(hanging_send)
+            await manager.add_message(1, "maybe sent")
+            await asyncio.sleep(0.1)
+            await manager.stop()
+            assert await outbound_statuses(database) == {"maybe sent": "sending"}
+
+        async with open_store(tmp_path / "bot.db") as database:
+            manager = MessageQueueManager(send_delay=0.01, store=database, drain_timeout=0.5)
+            await manager.start(hanging_send)
+            await manager.stop()
+            # Отправка могла дойти до FunPay — при replay не повторяем
+            assert calls == ["maybe sent"]
+            assert await outbound_statuses(database) == {"maybe sent": "failed"}
+
+    asyncio.run(scenario())
@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("FunPayBot.Executors")
+
+
+class ExecutorSaturated(Exception):
+    """Слишком много незавершенных задач в пуле — новую не ставим"""
+
+
+class BoundedExecutor:
+    """Отдельный пул потоков с ограничением числа задач в работе и в ожидании.
+
+    Задача считается занятой, пока реально выполняется в потоке: если
+    вызывающий не дождался ее по таймауту, место в пуле освобождается
+    только когда поток закончит.
+    """
+
+    def __init__(self, name, max_workers, max_pending=0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_in_flight = max_workers + max_pending
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"funpay-{name}")
+        self.in_flight = 0
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0, "max_queue_depth": 0}
+
+    @property
+    def queue_depth(self):
+        return max(0, self.in_flight - self.max_workers)
+
+    async def run(self, func, *args, timeout=None):
+        return await self.wait(self.submit(func, *args), timeout)
+
+    def submit(self, func, *args):
+        """Постановка в пул без ожидания; concurrent.futures.Future завершается,
+        когда поток реально закончит — в том числе после таймаута в wait()"""
+        if self.in_flight >= self.max_in_flight:
+            self.stats["rejected"] += 1
+            raise ExecutorSaturated(f"Пул {self.name} занят ({self.in_flight}/{self.max_in_flight})")
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        self.stats["submitted"] += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue_depth)
+
+        future = self.pool.submit(functools.partial(func, *args))
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return future
+
+    async def wait(self, future, timeout=None):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self.stats["completed"] += 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth
+        }
@@ -26,8 +26,9 @@ def sanitize_for_funpay(text):
     try:
         # Удаление HTML тегов
         text = re.sub(r'<[^>]+>', '', text)
-        # Удаление множественных пробелов
-        text = re.sub(r'\s+', ' ', text)
+        # Удаление множественных пробелов; переносы строк сохраняем (склеенные ответы идут построчно)
+        text = re.sub(r'[^\S\n]+', ' ', text)
+        text = re.sub(r' ?\n ?', '\n', text)
         # Удаление control characters кроме \n и \t
         text = ''.join(char for char in text if ord(char) >= 32 or char in '\n\t')
         return text.strip()
@@ -43,6 +44,10 @@ def generate_message_hash(chat_id, text, timestamp=None):
     hash_string = f"{chat_id}:{text}:{timestamp.strftime('%Y%m%d%H%M')}"
     return hashlib.sha256(hash_string.encode('utf-8')).hexdigest()
 
+def generate_content_hash(chat_id, text):
+    """Хэш содержимого без привязки ко времени (окно задает DedupIndex)"""
+    return hashlib.sha256(f"{chat_id}:{text}".encode('utf-8')).hexdigest()
+
 def parse_order_id(order_text):
     """Парсинг ID заказа из текста"""
     match = re.search(r'#(\d+)', order_text)
@@ -3,6 +3,7 @@ import sys
 from datetime import datetime
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
+from config import Config
 
 class ColoredFormatter(logging.Formatter):
     COLORS = {
@@ -20,7 +21,7 @@ class ColoredFormatter(logging.Formatter):
             record.levelname = f"{self.COLORS[levelname]}{levelname}{self.COLORS['RESET']}"
         return super().format(record)
 
-def setup_logger(name="FunPayBot", level="INFO", log_to_file=True, log_dir="logs"):
+def setup_logger(name="FunPayBot", level="INFO", log_to_file=True, log_dir=None):
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, level))
 
@@ -39,8 +40,8 @@ def setup_logger(name="FunPayBot", level="INFO", log_to_file=True, log_dir="logs
 
     # File handler с ротацией (критично для продакшна)
     if log_to_file:
-        log_path = Path(log_dir)
-        log_path.mkdir(exist_ok=True)
+        log_path = Path(log_dir or Config.LOG_DIR)
+        log_path.mkdir(parents=True, exist_ok=True)
         log_filename = log_path / f"funpay_bot_{datetime.now().strftime('%Y%m%d')}.log"
 
         # RotatingFileHandler: макс 10MB, 5 бэкапов
@@ -0,0 +1,352 @@
+"""
+utils/metrics.py — единый потокобезопасный реестр метрик.
+
+Счетчики, gauge и гистограммы с текстовым форматом Prometheus. Запись —
+одна операция под блокировкой метрики, поэтому ее можно вызывать на каждое
+событие, в том числе из потока опроса FunPay. Реестр можно отдавать по
+HTTP (MetricsServer, только 127.0.0.1) и кратко показывать в /stats.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger("FunPayBot.Metrics")
+
+# Границы корзин в секундах: от миллисекунд до минуты
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _CounterValue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        return self.value
+
+
+class _GaugeValue:
+    def __init__(self, func=None):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.func = func
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def get(self):
+        if self.func is not None:
+            try:
+                return self.func()
+            except Exception:
+                return float("nan")
+        return self.value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейная интерполяция внутри корзины)"""
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.children_lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.children_lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.children[()]
+
+    def _items(self):
+        with self.children_lock:
+            return list(self.children.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def get(self):
+        return self._default().get()
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+                for values, child in self._items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        self.func = func
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _GaugeValue(self.func)
+
+    def set(self, value):
+        self._default().set(value)
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def dec(self, amount=1):
+        self._default().dec(amount)
+
+    def get(self):
+        return self._default().get()
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+                for values, child in self._items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def quantile(self, q):
+        return self._default().quantile(q)
+
+    def render(self):
+        lines = []
+        for values, child in self._items():
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, values, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} уже зарегистрирована как {metric.kind}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames=labelnames)
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._register(Gauge, name, documentation, labelnames=labelnames, func=func)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames=labelnames, buckets=buckets)
+
+    def render(self):
+        """Текстовый формат Prometheus (version 0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Краткая сводка для /stats: счетчики и p50/p99 гистограмм"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        result = {}
+        for metric in metrics:
+            for values, child in metric._items():
+                key = metric.name + (f"[{','.join(values)}]" if values else "")
+                if isinstance(metric, Histogram):
+                    _, total, count = child.snapshot()
+                    if count:
+                        result[key] = {
+                            "count": count,
+                            "avg": total / count,
+                            "p50": child.quantile(0.5),
+                            "p99": child.quantile(0.99)
+                        }
+                else:
+                    result[key] = child.get()
+        return result
+
+
+# Общий реестр процесса
+metrics = MetricsRegistry()
+
+EVENT_TO_NOTIFICATION = metrics.histogram(
+    "funpaybot_event_to_notification_seconds",
+    "От получения события FunPay до отправки уведомления в Telegram"
+)
+QUEUE_WAIT = metrics.histogram(
+    "funpaybot_queue_wait_seconds",
+    "Ожидание сообщения в очереди отправки"
+)
+FUNPAY_SEND_LATENCY = metrics.histogram(
+    "funpaybot_funpay_send_seconds",
+    "Отправка сообщения в FunPay",
+    labelnames=("transport",)
+)
+DB_STATEMENT_TIME = metrics.histogram(
+    "funpaybot_db_statement_seconds",
+    "Выполнение операции с БД (включая ожидание блокировки записи)",
+    labelnames=("op",)
+)
+TEMPLATE_MATCH_TIME = metrics.histogram(
+    "funpaybot_template_match_seconds",
+    "Поиск подходящего шаблона автоответа",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+
+
+def timed(histogram):
+    """Декоратор async-функции: длительность вызова пишется в гистограмму"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics для Prometheus; слушает только локальный интерфейс"""
+
+    def __init__(self, registry=None, host="127.0.0.1", port=9108):
+        self.registry = registry or metrics
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def handle_metrics(request):
+            return web.Response(
+                text=self.registry.render(),
+                content_type="text/plain",
+                charset="utf-8",
+                headers={"X-Content-Type-Options": "nosniff"}
+            )
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        logger.info(f"✓ Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,45 @@
+import asyncio
+
+
+class PeriodicFlusher:
+    """Накопленное в памяти пишется раз в flush_interval секунд и при остановке.
+
+    Наследник реализует flush() и задает flush_error — текст для лога,
+    если фоновая запись не удалась (flush сам возвращает данные в буфер).
+    """
+
+    flush_error = "Ошибка фоновой записи"
+
+    def __init__(self, flush_interval, logger):
+        self.flush_interval = flush_interval
+        self.logger = logger
+        self.stopping = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.stopping.clear()
+            self.task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Остановка с записью всего накопленного"""
+        if self.task:
+            # Без cancel: прерванная посреди записи пачка могла бы записаться дважды
+            self.stopping.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                self.logger.error(f"{self.flush_error}: {e}", exc_info=True)
+
+    async def flush(self):
+        raise NotImplementedError
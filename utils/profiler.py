@@ -0,0 +1,111 @@
+"""
+utils/profiler.py — профилирование работающего процесса по запросу.
+
+Два режима, оба ограничены по времени:
+- "cpu": cProfile на потоке event loop (точные вызовы и время);
+- "sample": статистический сэмплер по всем потокам (sys._current_frames),
+  дешевле и видит поток опроса FunPay и пулы FunPayAPI.
+Одновременно работает только один профиль.
+"""
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+from collections import Counter
+
+logger = logging.getLogger("FunPayBot.Profiler")
+
+MAX_DURATION = 120
+
+
+class ProfilerBusy(Exception):
+    """Профиль уже снимается"""
+
+
+class Profiler:
+    def __init__(self, sample_interval=0.005):
+        self.sample_interval = sample_interval
+        self.lock = asyncio.Lock()
+
+    async def run(self, duration=10.0, mode="cpu", top=15):
+        """Снять профиль за duration секунд и вернуть текст с самыми горячими функциями"""
+        if self.lock.locked():
+            raise ProfilerBusy("Профилирование уже идет")
+        duration = max(1.0, min(float(duration), MAX_DURATION))
+        async with self.lock:
+            logger.info(f"🔬 Профилирование ({mode}) на {duration:.0f}s")
+            if mode == "sample":
+                return await self._sample(duration, top)
+            return await self._cprofile(duration, top)
+
+    async def _cprofile(self, duration, top):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profile.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+        lines = [f"cProfile, {duration:.0f}s, поток event loop — топ {top} по cumulative:"]
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        for (filename, line, function), (_, calls, total, cumulative, _) in entries[:top]:
+            lines.append(f"{cumulative:8.3f}s {total:8.3f}s {calls:>7} {_short(filename)}:{line}({function})")
+        return "\n".join(lines)
+
+    async def _sample(self, duration, top):
+        own = Counter()  # функция на вершине стека
+        inclusive = Counter()  # функция где-либо в стеке
+        samples = [0]
+        stop = threading.Event()
+        sampler_id = []
+
+        def sampler():
+            sampler_id.append(threading.get_ident())
+            while not stop.wait(self.sample_interval):
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id in sampler_id:
+                        continue
+                    samples[0] += 1
+                    own[_frame_key(frame)] += 1
+                    seen = set()
+                    while frame is not None:
+                        key = _frame_key(frame)
+                        if key not in seen:
+                            inclusive[key] += 1
+                            seen.add(key)
+                        frame = frame.f_back
+
+        thread = threading.Thread(target=sampler, name="profiler-sampler", daemon=True)
+        thread.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            stop.set()
+            await asyncio.to_thread(thread.join)
+
+        total = samples[0] or 1
+        lines = [f"Сэмплирование, {duration:.0f}s, {samples[0]} сэмплов (все потоки)", "Собственное время:"]
+        for key, count in own.most_common(top):
+            lines.append(f"{count / total * 100:6.1f}% {key}")
+        lines.append("Включая вызываемые:")
+        for key, count in inclusive.most_common(top):
+            lines.append(f"{count / total * 100:6.1f}% {key}")
+        return "\n".join(lines)
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return f"{_short(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+def _short(filename):
+    parts = filename.replace("\\", "/").split("/")
+    return "/".join(parts[-2:]) if len(parts) > 1 else filename
+
+
+profiler = Profiler()
@@ -0,0 +1,102 @@
+"""
+utils/tracing.py — сквозная трассировка событий FunPay.
+
+При получении события создается trace id (с вероятностью sample_rate) и
+передается дальше: через атрибут события между потоком опроса и event
+loop, через contextvars внутри loop (задачи наследуют контекст) и через
+QueuedMessage в очереди отправки. Каждый этап пишет span с длительностью
+в кольцевой буфер; для несэмплированных событий span почти ничего не стоит.
+"""
+import contextvars
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("FunPayBot.Tracing")
+
+current_trace = contextvars.ContextVar("funpaybot_trace_id", default=None)
+
+
+class Tracer:
+    def __init__(self, sample_rate=0.1, buffer_size=2000):
+        self.sample_rate = sample_rate
+        self.spans = deque(maxlen=buffer_size)  # (trace_id, имя, начало wall-clock, длительность, атрибуты)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.prefix = f"{os.getpid():x}"
+        self.stats = {"traces_started": 0, "spans": 0}
+
+    def configure(self, sample_rate, buffer_size):
+        with self.lock:
+            self.sample_rate = sample_rate
+            self.spans = deque(self.spans, maxlen=buffer_size)
+
+    def new_trace(self):
+        """Trace id для нового события или None, если событие не попало в выборку"""
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return None
+        self.stats["traces_started"] += 1
+        return f"{self.prefix}-{next(self.ids):x}"
+
+    def record(self, trace_id, name, started, duration, **attrs):
+        """Span с известной длительностью; started — time.time() начала"""
+        if trace_id is None:
+            return
+        with self.lock:
+            self.spans.append((trace_id, name, started, duration, attrs))
+            self.stats["spans"] += 1
+        logger.debug(f"[trace {trace_id}] {name}: {duration * 1000:.1f}ms {attrs or ''}")
+
+    @contextmanager
+    def span(self, name, trace_id=None, **attrs):
+        """Замер участка кода; trace id берется из контекста, если не передан явно"""
+        trace_id = trace_id or current_trace.get()
+        if trace_id is None:
+            yield
+            return
+        started_wall = time.time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(trace_id, name, started_wall, time.perf_counter() - started, **attrs)
+
+    @contextmanager
+    def activate(self, trace_id):
+        """Сделать trace id текущим для кода (и задач), запущенного внутри блока"""
+        token = current_trace.set(trace_id)
+        try:
+            yield
+        finally:
+            current_trace.reset(token)
+
+    def recent_traces(self, limit=5):
+        """Последние трассы: [(trace_id, суммарная длительность, [(span, длительность)])]"""
+        with self.lock:
+            spans = list(self.spans)
+        traces = {}
+        for trace_id, name, started, duration, attrs in spans:
+            traces.setdefault(trace_id, []).append((started, name, duration))
+        result = []
+        for trace_id in list(traces)[-limit:]:
+            items = sorted(traces[trace_id])
+            first = items[0][0]
+            last = max(started + duration for started, _, duration in items)
+            result.append((trace_id, last - first, [(name, duration) for _, name, duration in items]))
+        return result
+
+    def get_trace(self, trace_id):
+        with self.lock:
+            return [(name, started, duration, attrs) for tid, name, started, duration, attrs in self.spans if tid == trace_id]
+
+    def get_stats(self):
+        return {**self.stats, "buffered_spans": len(self.spans), "sample_rate": self.sample_rate}
+
+
+# Общий трассировщик процесса; sample_rate задается при старте бота
+tracer = Tracer()
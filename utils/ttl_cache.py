@@ -0,0 +1,47 @@
+import time
+from collections import OrderedDict
+
+
+class TTLSet:
+    """Ограниченное множество с вытеснением по LRU и сроком жизни записей (monotonic)"""
+
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # ключ -> monotonic-время истечения (None — бессрочно)
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0, "expired": 0}
+
+    def __contains__(self, key):
+        expires = self.entries.get(key, False)
+        if expires is False:
+            self.stats["misses"] += 1
+            return False
+        if expires is not None and expires <= time.monotonic():
+            del self.entries[key]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return False
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return True
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key):
+        self.entries[key] = time.monotonic() + self.ttl if self.ttl else None
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def get_stats(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+        }